@@ -1,9 +1,13 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
-from passlib.context import CryptContext
+from sqlalchemy import event, inspect
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from app.models import User, UserRead
 
 load_dotenv()
 
@@ -12,13 +16,12 @@ SECRET_KEY = os.getenv("SECRET_KEY", "insecure-dev-key-change-me-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60  # Reduced from 30 days to 1 hour for security
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# Authenticated users are cached briefly so each request doesn't query the users table
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "30"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "1024"))
+# Trust the user id embedded in the token, so id-only endpoints skip the lookup
+# entirely. A deleted user's token then keeps working on those endpoints until it expires.
+AUTH_TOKEN_USER_ID = os.getenv("AUTH_TOKEN_USER_ID", "false").lower() in ("1", "true", "yes")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -29,3 +32,71 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+class UserCache:
+    """Bounded, short-TTL cache of authenticated users keyed by token subject (username).
+
+    Entries are dropped when the user row is updated or deleted through the ORM,
+    so a change is seen immediately in this process and within ``ttl`` seconds
+    in other workers.
+    """
+
+    def __init__(self, max_entries: int = AUTH_USER_CACHE_SIZE, ttl: float = AUTH_USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[UserRead, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str) -> Optional[UserRead]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user: UserRead):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[user.username] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    # Drop the old name too when the username itself changed
+    history = inspect(target).attrs.username.history
+    for username in {target.username, *(history.deleted or ())}:
+        user_cache.invalidate(username)
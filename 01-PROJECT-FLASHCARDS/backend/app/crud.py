@@ -0,0 +1,550 @@
+"""Deck, card and user queries shared by the sync and async database paths.
+
+Every function takes a plain ``Session`` as its first argument and returns read
+models (or plain values) rather than ORM objects. Handlers call them through
+``Database.run``, which either runs them on the threadpool with a sync session
+or inside ``AsyncSession.run_sync``. Returning read models means nothing is
+lazy-loaded after the function returns, which an async session cannot do.
+"""
+import base64
+import binascii
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import String, column, delete, func, insert, or_, text, update
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+from app.models import (
+    Deck, DeckCreate, DeckRead, DeckUpdate, DeckTagLink, DeckArchiveHeader,
+    Card, CardCreate, CardRead, CardUpdate, CardStatus, CardBatchUpdateItem, CardSchedule, CardSearchHit,
+    DeckCardCount, DeckStats,
+    Tag, User, UserCreate, UserRead,
+)
+from app import search
+from app.services.scheduler import sm2
+
+load_dotenv()
+
+# Keep per-deck card counts in the deckcardcount table on every card write and
+# serve GET /decks/stats from it, instead of counting the cards on each request
+DECK_STATS_COUNTERS = os.getenv("DECK_STATS_COUNTERS", "false").lower() in ("1", "true", "yes")
+
+# --- Pagination ---
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: Optional[str]
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    """The id a cursor points after. Raises ValueError for anything not made by encode_cursor."""
+    try:
+        last_id = int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if last_id < 0:
+        raise ValueError("Invalid cursor")
+    return last_id
+
+class Version(NamedTuple):
+    """What a read depends on: ``key`` changes with every write that changes the read."""
+    key: tuple
+    updated_at: Optional[datetime]
+
+def _page(rows: list, limit: int, to_read) -> Page:
+    # One extra row was fetched to tell whether another page exists
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1].id) if has_more else None
+    return Page([to_read(row) for row in rows], next_cursor)
+
+# --- Writes ---
+
+def _save(session: Session, obj, to_read):
+    """Write ``obj`` and return ``to_read(obj)`` without reading the row back.
+
+    The flush sends the INSERT or UPDATE and fills in the generated id (via
+    RETURNING or the driver's lastrowid), and every other column was set in
+    Python, so the read model is built before committing. Reading it after the
+    commit would expire the object and cost a SELECT per write.
+    """
+    session.add(obj)
+    session.flush()
+    result = to_read(obj)
+    session.commit()
+    return result
+
+# --- Deck versions ---
+
+def _bump_decks(session: Session, deck_ids: set, user_id: Optional[int] = None) -> int:
+    """Bump version and updated_at of the decks (only the user's, if given); returns how many matched.
+
+    Runs in the caller's transaction. With ``user_id`` it doubles as the
+    ownership check, so a card insert costs no extra statement.
+    """
+    statement = update(Deck).where(Deck.id.in_(deck_ids))
+    if user_id is not None:
+        statement = statement.where(Deck.user_id == user_id)
+    statement = statement.values(version=Deck.version + 1, updated_at=datetime.utcnow())
+    return session.exec(statement.execution_options(synchronize_session=False)).rowcount
+
+def deck_version(session: Session, user_id: int, deck_id: int) -> Optional[Version]:
+    """The deck's version, or None when it does not exist or belongs to someone else.
+
+    SQLite hands a deleted deck's id to the next deck created, so the key also
+    carries created_at to tell the two apart.
+    """
+    row = session.exec(
+        select(Deck.created_at, Deck.version, Deck.updated_at).where(Deck.id == deck_id, Deck.user_id == user_id)
+    ).first()
+    return Version((deck_id, row.created_at, row.version), row.updated_at) if row else None
+
+def decks_version(session: Session, user_id: int) -> Version:
+    """A version of the user's deck list, from one aggregate over their deck rows.
+
+    Creating a deck changes the newest id and updated_at, deleting one the
+    count, and updating one (or its cards) the version sum.
+    """
+    count, last_id, versions, updated_at = session.exec(
+        select(func.count(Deck.id), func.max(Deck.id), func.sum(Deck.version), func.max(Deck.updated_at))
+        .where(Deck.user_id == user_id)
+    ).one()
+    return Version((count, last_id, versions, updated_at), updated_at)
+
+# --- Users ---
+
+def get_user_by_username(session: Session, username: str) -> Optional[User]:
+    return session.exec(select(User).where(User.username == username)).first()
+
+def create_user(session: Session, user: UserCreate, hashed_password: str) -> UserRead:
+    new_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
+    return _save(session, new_user, UserRead.model_validate)
+
+def update_password_hash(session: Session, user_id: int, hashed_password: str):
+    user = session.get(User, user_id)
+    if user:
+        user.hashed_password = hashed_password
+        session.add(user)
+        session.commit()
+
+# --- Decks ---
+
+# Tag names known to exist, mapped to their ids, so repeat tags skip the insert.
+# Tags are never deleted; an entry only goes stale if the database is replaced
+# or its transaction rolled back, and get_or_create_tags repairs that case.
+TAG_CACHE_SIZE = 10000
+_tag_ids: Dict[str, int] = {}
+_tag_ids_lock = threading.Lock()
+
+def clear_tag_cache():
+    with _tag_ids_lock:
+        _tag_ids.clear()
+
+def _insert_missing_tags(session: Session, names: List[str]):
+    """Insert the names in one statement, skipping any another request created concurrently."""
+    rows = [{"name": name} for name in names]
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = sqlite_insert(Tag).values(rows).on_conflict_do_nothing(index_elements=["name"])
+    elif dialect == "postgresql":
+        statement = postgresql_insert(Tag).values(rows).on_conflict_do_nothing(index_elements=["name"])
+    else:
+        # No portable insert-or-ignore; fall back to the ORM
+        session.add_all(Tag(name=name) for name in names)
+        session.flush()
+        return
+    session.exec(statement)
+
+def _select_tags(session: Session, names: List[str]) -> Dict[str, Tag]:
+    return {tag.name: tag for tag in session.exec(select(Tag).where(Tag.name.in_(names))).all()}
+
+def get_or_create_tags(session: Session, tag_names: List[str]) -> List[Tag]:
+    """Resolve tag names to Tag rows with at most two inserts and two selects, whatever the count."""
+    names = list(dict.fromkeys(name.strip().lower() for name in tag_names if name.strip()))
+    if not names:
+        return []
+
+    with _tag_ids_lock:
+        unknown = [name for name in names if name not in _tag_ids]
+    if unknown:
+        _insert_missing_tags(session, unknown)
+    tags = _select_tags(session, names)
+
+    missing = [name for name in names if name not in tags]
+    if missing:
+        # Names the cache believed existed but this database does not have
+        _insert_missing_tags(session, missing)
+        tags.update(_select_tags(session, missing))
+
+    with _tag_ids_lock:
+        if len(_tag_ids) + len(tags) > TAG_CACHE_SIZE:
+            _tag_ids.clear()
+        _tag_ids.update((name, tag.id) for name, tag in tags.items())
+    return [tags[name] for name in names]
+
+def _get_owned_deck(session: Session, user_id: int, deck_id: int, with_tags: bool = False) -> Optional[Deck]:
+    statement = select(Deck).where(Deck.id == deck_id, Deck.user_id == user_id)
+    if with_tags:
+        statement = statement.options(selectinload(Deck.tags))
+    return session.exec(statement).first()
+
+def create_deck(session: Session, user_id: int, deck: DeckCreate) -> DeckRead:
+    deck_data = deck.model_dump(exclude={"tags"})
+    db_deck = Deck(**deck_data)
+    db_deck.user_id = user_id
+
+    # Assigning the collection, even empty, keeps DeckRead from lazy-loading it
+    db_deck.tags = get_or_create_tags(session, deck.tags) if deck.tags else []
+    return _save(session, db_deck, DeckRead.model_validate)
+
+def list_decks(
+    session: Session,
+    user_id: int,
+    limit: int,
+    after_id: Optional[int] = None,
+    tag: Optional[str] = None,
+    offset: int = 0,
+) -> Page:
+    """A page of the user's decks in id order, starting after ``after_id``."""
+    # Load every deck's tags in one extra query instead of one per deck
+    statement = select(Deck).where(Deck.user_id == user_id).options(selectinload(Deck.tags))
+    if after_id is not None:
+        statement = statement.where(Deck.id > after_id)
+    if tag:
+        statement = statement.join(DeckTagLink).join(Tag).where(Tag.name == tag.strip().lower())
+    decks = session.exec(statement.order_by(Deck.id).offset(offset).limit(limit + 1)).all()
+    return _page(decks, limit, DeckRead.model_validate)
+
+def read_deck(session: Session, user_id: int, deck_id: int) -> Optional[DeckRead]:
+    deck = _get_owned_deck(session, user_id, deck_id, with_tags=True)
+    return DeckRead.model_validate(deck) if deck else None
+
+def update_deck(session: Session, user_id: int, deck_id: int, deck_update: DeckUpdate) -> Optional[DeckRead]:
+    db_deck = _get_owned_deck(session, user_id, deck_id, with_tags=True)
+    if not db_deck:
+        return None
+
+    deck_data = deck_update.model_dump(exclude_unset=True)
+
+    # Handle tags separately
+    if "tags" in deck_data:
+        tag_names = deck_data.pop("tags")
+        if tag_names is not None:
+             db_deck.tags = get_or_create_tags(session, tag_names)
+
+    for key, value in deck_data.items():
+        setattr(db_deck, key, value)
+    # Computed in SQL so concurrent writes can't both store the same version
+    db_deck.version = Deck.version + 1
+    db_deck.updated_at = datetime.utcnow()
+
+    return _save(session, db_deck, DeckRead.model_validate)
+
+def delete_deck(session: Session, user_id: int, deck_id: int) -> bool:
+    deck = _get_owned_deck(session, user_id, deck_id)
+    if not deck:
+        return False
+    # Cleared even with counters off, so rows left from an earlier run don't outlive the deck
+    session.exec(delete(DeckCardCount).where(DeckCardCount.deck_id == deck_id))
+    session.delete(deck)
+    session.commit()
+    return True
+
+# --- Card counts ---
+
+CountKey = Tuple[int, CardStatus]
+
+def _count_changes(added: Iterable[CountKey] = (), removed: Iterable[CountKey] = ()) -> Counter:
+    """Net change per (deck_id, status); a card whose status did not change nets to zero."""
+    changes = Counter(added)
+    changes.subtract(removed)
+    return changes
+
+def _adjust_card_counts(session: Session, changes: Counter):
+    """Apply the changes to deckcardcount in one upsert, in the caller's transaction."""
+    if not DECK_STATS_COUNTERS:
+        return
+    rows = [
+        {"deck_id": deck_id, "status": CardStatus(status), "count": delta}
+        for (deck_id, status), delta in changes.items() if delta
+    ]
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = sqlite_insert(DeckCardCount).values(rows)
+    elif dialect == "postgresql":
+        statement = postgresql_insert(DeckCardCount).values(rows)
+    else:
+        # No portable upsert; fall back to the ORM
+        for row in rows:
+            counter = session.get(DeckCardCount, (row["deck_id"], row["status"])) or DeckCardCount(
+                deck_id=row["deck_id"], status=row["status"]
+            )
+            counter.count += row["count"]
+            session.add(counter)
+        return
+    session.exec(statement.on_conflict_do_update(
+        index_elements=["deck_id", "status"],
+        set_={"count": DeckCardCount.count + statement.excluded["count"]},
+    ))
+
+def rebuild_deck_card_counts(session: Session):
+    """Recount every deck from the card table, e.g. after enabling DECK_STATS_COUNTERS on existing data."""
+    session.exec(delete(DeckCardCount))
+    session.exec(insert(DeckCardCount).from_select(
+        ["deck_id", "status", "count"],
+        select(Card.deck_id, Card.status, func.count()).where(Card.deck_id.is_not(None)).group_by(Card.deck_id, Card.status),
+    ))
+    session.commit()
+
+def deck_stats(session: Session, user_id: int) -> List[DeckStats]:
+    """Card counts by status for each of the user's decks, in one query."""
+    if DECK_STATS_COUNTERS:
+        statement = select(Deck.id, DeckCardCount.status, DeckCardCount.count).outerjoin(
+            DeckCardCount, DeckCardCount.deck_id == Deck.id
+        )
+    else:
+        statement = select(Deck.id, Card.status, func.count(Card.id)).outerjoin(
+            Card, Card.deck_id == Deck.id
+        ).group_by(Deck.id, Card.status)
+    counts_by_deck: Dict[int, Dict[CardStatus, int]] = {}
+    for deck_id, status, count in session.exec(statement.where(Deck.user_id == user_id).order_by(Deck.id)):
+        counts = counts_by_deck.setdefault(deck_id, {status: 0 for status in CardStatus})
+        if status is not None:
+            counts[CardStatus(status)] += count
+    return [
+        DeckStats(deck_id=deck_id, total=sum(counts.values()), counts=counts)
+        for deck_id, counts in counts_by_deck.items()
+    ]
+
+# --- Cards ---
+
+def _get_owned_card(session: Session, user_id: int, card_id: int) -> Optional[Card]:
+    # The card must belong to a deck owned by the user
+    return session.exec(
+        select(Card).join(Deck).where(Card.id == card_id, Deck.user_id == user_id)
+    ).first()
+
+def create_card(session: Session, user_id: int, card: CardCreate) -> Optional[CardRead]:
+    if not _bump_decks(session, {card.deck_id}, user_id):
+        return None
+
+    db_card = Card.from_orm(card)
+    db_card.user_id = user_id
+    _adjust_card_counts(session, _count_changes(added=[(db_card.deck_id, db_card.status)]))
+    return _save(session, db_card, CardRead.model_validate)
+
+def list_cards(
+    session: Session,
+    user_id: int,
+    deck_id: int,
+    limit: int,
+    after_id: Optional[int] = None,
+    status: Optional[CardStatus] = None,
+) -> Page:
+    """A page of the deck's cards in id order.
+
+    Callers check that the deck exists first (``deck_version``); another
+    user's deck id just yields an empty page.
+    """
+    statement = select(Card).where(Card.deck_id == deck_id, Card.user_id == user_id)
+    if status is not None:
+        statement = statement.where(Card.status == status)
+    if after_id is not None:
+        statement = statement.where(Card.id > after_id)
+    cards = session.exec(statement.order_by(Card.id).limit(limit + 1)).all()
+    return _page(cards, limit, CardRead.model_validate)
+
+def update_card(session: Session, user_id: int, card_id: int, card_update: CardUpdate) -> Optional[CardRead]:
+    db_card = _get_owned_card(session, user_id, card_id)
+    if not db_card:
+        return None
+
+    old_status = db_card.status
+    card_data = card_update.model_dump(exclude_unset=True)
+    for key, value in card_data.items():
+        setattr(db_card, key, value)
+
+    _adjust_card_counts(session, _count_changes(
+        added=[(db_card.deck_id, db_card.status)], removed=[(db_card.deck_id, old_status)]
+    ))
+    _bump_decks(session, {db_card.deck_id})
+    return _save(session, db_card, CardRead.model_validate)
+
+def delete_card(session: Session, user_id: int, card_id: int) -> bool:
+    db_card = _get_owned_card(session, user_id, card_id)
+    if not db_card:
+        return False
+    _adjust_card_counts(session, _count_changes(removed=[(db_card.deck_id, db_card.status)]))
+    _bump_decks(session, {db_card.deck_id})
+    session.delete(db_card)
+    session.commit()
+    return True
+
+# --- Reviews ---
+
+def review_card(session: Session, user_id: int, card_id: int, grade: int, now: Optional[datetime] = None) -> Optional[CardRead]:
+    """Reschedule the card after a review graded 0-5; its status follows the new interval."""
+    db_card = _get_owned_card(session, user_id, card_id)
+    if not db_card:
+        return None
+    old_status = db_card.status
+    schedule = sm2(db_card.interval_days, db_card.ease, db_card.repetitions, grade, now or datetime.utcnow())
+    for key, value in schedule._asdict().items():
+        setattr(db_card, key, value)
+    _adjust_card_counts(session, _count_changes(
+        added=[(db_card.deck_id, db_card.status)], removed=[(db_card.deck_id, old_status)]
+    ))
+    _bump_decks(session, {db_card.deck_id})
+    return _save(session, db_card, CardRead.model_validate)
+
+def next_due_cards(session: Session, user_id: int, limit: int, now: Optional[datetime] = None) -> List[CardRead]:
+    """The user's most overdue cards across all decks, read in order from ix_card_user_id_due_at."""
+    cards = session.exec(
+        select(Card)
+        .where(Card.user_id == user_id, Card.due_at <= (now or datetime.utcnow()))
+        .order_by(Card.due_at)
+        .limit(limit)
+    ).all()
+    return [CardRead.model_validate(card) for card in cards]
+
+# --- Search ---
+
+def search_cards(session: Session, user_id: int, query: str, limit: int) -> List[CardSearchHit]:
+    """The user's cards matching every word of ``query``, best match first."""
+    terms = search.search_terms(query)
+    if not terms:
+        return []
+    if not search.has_card_search(session.connection()):
+        return _search_cards_like(session, user_id, terms, limit)
+    statement = text(
+        f"SELECT card.*, {search.snippet_sql()} AS snippet "
+        f"FROM {search.CARD_FTS_TABLE} JOIN card ON card.id = {search.CARD_FTS_TABLE}.rowid "
+        f"WHERE {search.CARD_FTS_TABLE} MATCH :match AND card.user_id = :user_id "
+        f"ORDER BY bm25({search.CARD_FTS_TABLE}, {search.FRONT_WEIGHT}, {search.BACK_WEIGHT}) LIMIT :limit"
+    ).columns(*Card.__table__.columns, column("snippet", String))
+    rows = session.exec(statement, params={"match": search.fts_query(terms), "user_id": user_id, "limit": limit})
+    return [
+        CardSearchHit.model_validate({**row._mapping, "snippet": search.highlight(row.snippet)})
+        for row in rows
+    ]
+
+def _search_cards_like(session: Session, user_id: int, terms: List[str], limit: int) -> List[CardSearchHit]:
+    # Without FTS5: a scan of the user's cards, unranked, with the front as the snippet
+    statement = select(Card).where(Card.user_id == user_id)
+    for term in terms:
+        # Terms may contain "_", a LIKE wildcard; match it and the other specials literally
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        statement = statement.where(or_(Card.front.ilike(pattern, escape="\\"), Card.back.ilike(pattern, escape="\\")))
+    cards = session.exec(statement.order_by(Card.id).limit(limit)).all()
+    return [
+        CardSearchHit.model_validate({**card.model_dump(), "snippet": search.highlight(card.front)})
+        for card in cards
+    ]
+
+# --- Card batches ---
+
+def _card_rows(cards: List[CardCreate], user_id: int, deck_id: Optional[int] = None) -> List[dict]:
+    """Insert parameters for Core inserts, which skip the model's Python-side defaults."""
+    # Plain dicts: building a Card per row costs several times the insert itself
+    created_at = datetime.utcnow()
+    overrides = {**CardSchedule(due_at=created_at).model_dump(), "created_at": created_at, "user_id": user_id}
+    if deck_id is not None:
+        overrides["deck_id"] = deck_id
+    return [{**card.model_dump(), **overrides} for card in cards]
+
+def create_cards(session: Session, user_id: int, cards: List[CardCreate]) -> Optional[List[int]]:
+    """Insert all cards in one transaction; None (and nothing inserted) if any deck isn't the user's."""
+    if not cards:
+        return []
+    deck_ids = {card.deck_id for card in cards}
+    if _bump_decks(session, deck_ids, user_id) != len(deck_ids):
+        session.rollback()
+        return None
+    # A Core insert with a parameter list goes out as one multi-row INSERT ... RETURNING;
+    # the ORM flush sends one statement per card on SQLite
+    rows = _card_rows(cards, user_id)
+    _adjust_card_counts(session, _count_changes(added=[(row["deck_id"], row["status"]) for row in rows]))
+    ids = list(session.exec(insert(Card).returning(Card.id, sort_by_parameter_order=True), params=rows).scalars())
+    session.commit()
+    return ids
+
+def update_cards(session: Session, user_id: int, updates: List[CardBatchUpdateItem]) -> Optional[List[int]]:
+    """Apply all updates in one transaction; None (and nothing changed) if any card isn't the user's."""
+    if not updates:
+        return []
+    ids = {update.id for update in updates}
+    db_cards = session.exec(
+        select(Card).join(Deck).where(Card.id.in_(ids), Deck.user_id == user_id)
+    ).all()
+    if len(db_cards) != len(ids):
+        return None
+    by_id = {card.id: card for card in db_cards}
+    old_status = {card.id: card.status for card in db_cards}
+    for update in updates:
+        for key, value in update.model_dump(exclude_unset=True, exclude={"id"}).items():
+            setattr(by_id[update.id], key, value)
+    _adjust_card_counts(session, _count_changes(
+        added=[(card.deck_id, card.status) for card in db_cards],
+        removed=[(card.deck_id, old_status[card.id]) for card in db_cards],
+    ))
+    _bump_decks(session, {card.deck_id for card in db_cards})
+    # Rows with the same changed columns are flushed as one executemany UPDATE
+    session.commit()
+    return [update.id for update in updates]
+
+def delete_cards(session: Session, user_id: int, card_ids: List[int]) -> Optional[List[int]]:
+    """Delete the cards with one statement; None (and nothing deleted) if any card isn't the user's."""
+    ids = set(card_ids)
+    if not ids:
+        return []
+    owned = session.exec(
+        select(Card.id, Card.deck_id, Card.status).join(Deck).where(Card.id.in_(ids), Deck.user_id == user_id)
+    ).all()
+    if len(owned) != len(ids):
+        return None
+    _adjust_card_counts(session, _count_changes(removed=[(deck_id, status) for _, deck_id, status in owned]))
+    _bump_decks(session, {deck_id for _, deck_id, _ in owned})
+    session.exec(delete(Card).where(Card.id.in_(ids)))
+    session.commit()
+    return sorted(ids)
+
+# --- Deck archives ---
+
+def deck_archive_statement(deck_id: int) -> Select:
+    """The card columns a deck export contains, in id order; stream it with ``Database.stream``."""
+    return select(Card.front, Card.back, Card.status).where(Card.deck_id == deck_id).order_by(Card.id)
+
+def deck_card_text_statement(deck_id: int) -> Select:
+    """The text of a deck's cards, for building a near-duplicate index; stream it with ``Database.stream``."""
+    return select(Card.front, Card.back).where(Card.deck_id == deck_id)
+
+def start_deck_import(session: Session, user_id: int, header: DeckArchiveHeader) -> DeckRead:
+    """Add the imported deck without committing; the cards and ``commit`` follow in the same transaction."""
+    db_deck = Deck(**header.model_dump(exclude={"tags"}), user_id=user_id)
+    db_deck.tags = get_or_create_tags(session, header.tags) if header.tags else []
+    session.add(db_deck)
+    session.flush()
+    return DeckRead.model_validate(db_deck)
+
+def import_cards(session: Session, user_id: int, deck_id: int, cards: List[CardCreate]):
+    rows = _card_rows(cards, user_id, deck_id)
+    _adjust_card_counts(session, _count_changes(added=[(deck_id, row["status"]) for row in rows]))
+    _bump_decks(session, {deck_id})
+    # No RETURNING, so the driver runs one executemany for the whole batch
+    session.exec(insert(Card), params=rows)
+
+def commit(session: Session):
+    session.commit()
+
+def rollback(session: Session):
+    session.rollback()
@@ -1,17 +1,173 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from sqlalchemy.sql import Select
+from starlette.concurrency import run_in_threadpool
 
 import os
+from typing import AsyncIterator, Callable, List, Optional, TypeVar
 from dotenv import load_dotenv
+from app.query_stats import SQL_ECHO, query_instrumentation
 
 load_dotenv()
 
 database_url = os.getenv("DATABASE_URL", "sqlite:///database.db")
 
-connect_args = {}
-if database_url.startswith("sqlite"):
-    connect_args["check_same_thread"] = False
+# Serve requests from an async engine (aiosqlite / asyncpg) instead of sync
+# sessions on the threadpool. ASYNC_DATABASE_URL defaults to DATABASE_URL with
+# the async driver swapped in.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
 
-engine = create_engine(database_url, echo=True, connect_args=connect_args)
+# SQLite tuning, applied to every new connection. WAL lets readers run alongside
+# the single writer, and synchronous=NORMAL skips the fsync on each commit (still
+# safe against corruption in WAL mode; only the last commits can be lost on power failure).
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Mapped pages live in the OS page cache and are shared by every connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Negative values are in KiB. The cache is private to each connection, so the
+# worst case is this times DB_POOL_SIZE + DB_MAX_OVERFLOW: 4 MB x 30 = 120 MB.
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-4096"))
+
+# Connection pool sizing. uvicorn runs sync handlers on up to 40 threads, so
+# the default pool lets most of them hold a connection at the same time.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+
+T = TypeVar("T")
+
+
+def to_async_url(url: str) -> str:
+    """Swap the driver in a sync database URL for its async counterpart."""
+    scheme, sep, rest = url.partition("://")
+    base = scheme.split("+", 1)[0]
+    if base == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if base in ("postgres", "postgresql"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
+def is_sqlite_memory(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":"))
+
+
+def sqlite_pragmas() -> dict:
+    return {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": SQLITE_MMAP_SIZE,
+        "cache_size": SQLITE_CACHE_SIZE,
+    }
+
+
+def apply_sqlite_pragmas(engine: Engine, pragmas: dict):
+    """Run the given PRAGMA statements on every connection the engine opens."""
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def build_engine(url: str, tuned: bool = True, **kwargs) -> Engine:
+    """Create an engine for ``url``, with the SQLite pragmas and pool sizing above when ``tuned``."""
+    connect_args = {}
+    if url.startswith("sqlite"):
+        connect_args["check_same_thread"] = False
+    if tuned and not is_sqlite_memory(url):
+        kwargs.setdefault("pool_size", DB_POOL_SIZE)
+        kwargs.setdefault("max_overflow", DB_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", DB_POOL_TIMEOUT)
+    new_engine = create_engine(url, echo=SQL_ECHO, connect_args=connect_args, **kwargs)
+    if tuned and url.startswith("sqlite"):
+        pragmas = sqlite_pragmas()
+        if is_sqlite_memory(url):
+            # In-memory databases have no journal file to switch to WAL
+            pragmas.pop("journal_mode")
+        apply_sqlite_pragmas(new_engine, pragmas)
+    query_instrumentation.install(new_engine)
+    return new_engine
+
+
+def build_async_engine(url: str, tuned: bool = True, **kwargs) -> AsyncEngine:
+    """Async counterpart of build_engine(); ``url`` must name an async driver."""
+    if is_sqlite_memory(url):
+        # Every new in-memory connection is a separate, empty database
+        kwargs.setdefault("poolclass", StaticPool)
+    elif tuned:
+        kwargs.setdefault("poolclass", AsyncAdaptedQueuePool)
+        kwargs.setdefault("pool_size", DB_POOL_SIZE)
+        kwargs.setdefault("max_overflow", DB_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", DB_POOL_TIMEOUT)
+    new_engine = create_async_engine(url, echo=SQL_ECHO, **kwargs)
+    if tuned and url.startswith("sqlite"):
+        pragmas = sqlite_pragmas()
+        if is_sqlite_memory(url):
+            pragmas.pop("journal_mode")
+        apply_sqlite_pragmas(new_engine.sync_engine, pragmas)
+    query_instrumentation.install(new_engine.sync_engine)
+    return new_engine
+
+
+engine = build_engine(database_url)
+async_engine: Optional[AsyncEngine] = (
+    build_async_engine(os.getenv("ASYNC_DATABASE_URL") or to_async_url(database_url)) if DB_ASYNC else None
+)
+
+
+class Database:
+    """Runs session-level functions (see app.crud) without blocking the event loop.
+
+    With an AsyncSession the function runs through ``run_sync``, so its queries
+    go through the async driver. With a sync Session it runs on the threadpool
+    as a plain ``def`` handler would.
+    """
+
+    def __init__(self, session: Optional[Session] = None, async_session: Optional[AsyncSession] = None):
+        self.session = session
+        self.async_session = async_session
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        if self.async_session is not None:
+            return await self.async_session.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+    async def stream(self, statement: Select, batch_size: int = 1000) -> AsyncIterator[List]:
+        """Yield the statement's rows in lists of up to ``batch_size``.
+
+        Rows come from a server-side cursor (``yield_per``), so only one batch is
+        in memory. The query runs on a session of its own, on the same engine,
+        because a streamed response outlives the request's session.
+        """
+        statement = statement.execution_options(yield_per=batch_size)
+        if self.async_session is not None:
+            async with AsyncSession(self.async_session.bind, expire_on_commit=False) as session:
+                result = await session.stream(statement)
+                async for rows in result.partitions():
+                    yield rows
+            return
+        session = Session(self.session.get_bind())
+        try:
+            partitions = (await run_in_threadpool(session.exec, statement)).partitions()
+            while True:
+                rows = await run_in_threadpool(next, partitions, None)
+                if rows is None:
+                    break
+                yield rows
+        finally:
+            await run_in_threadpool(session.close)
 
 
 def create_db_and_tables():
@@ -20,3 +176,15 @@ def create_db_and_tables():
 def get_session():
     with Session(engine) as session:
         yield session
+
+async def get_db() -> AsyncIterator[Database]:
+    if async_engine is not None:
+        # Attributes stay loaded after commit; reloading them would need the event loop
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield Database(async_session=session)
+    else:
+        session = Session(engine)
+        try:
+            yield Database(session=session)
+        finally:
+            await run_in_threadpool(session.close)
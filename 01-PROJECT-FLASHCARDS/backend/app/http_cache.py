@@ -0,0 +1,40 @@
+"""Validators for conditional GETs: weak ETags, Last-Modified and If-None-Match.
+
+Responses are per user, so they are marked ``private, no-cache``: browsers
+keep them but revalidate on every use, and shared caches never store them.
+A revalidation that matches is answered with 304 and no body.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Dict, Optional
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def weak_etag(*parts) -> str:
+    """A weak ETag derived from everything the response depends on."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against ``etag`` (RFC 9110, section 13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def http_date(value: datetime) -> str:
+    """Format a naive UTC datetime as an HTTP date."""
+    return format_datetime(value.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Authorization"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
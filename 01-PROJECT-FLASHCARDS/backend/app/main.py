@@ -1,52 +1,126 @@
-from typing import List
+from typing import List, Optional
 from datetime import timedelta
+from contextlib import asynccontextmanager, AsyncExitStack
+import json
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
-from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File, Form, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, UploadFile, File, Form, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlmodel import Session, select
 from jose import JWTError, jwt
-from app.database import create_db_and_tables, get_session
-from app.services.ai_agent import FlashcardAgent
-from app.auth import verify_password, get_password_hash, create_access_token, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from starlette.concurrency import run_in_threadpool
+from sqlmodel import Session
+from app import crud, http_cache
+from app.database import Database, create_db_and_tables, engine, get_db, get_session
+from app.query_stats import query_instrumentation
+from app.services.ai_agent import FlashcardAgent, GENERATION_MODES
+from app.services.llm_runtime import LLMTimeoutError, llm_executor
+from app.services.response_cache import get_refine_cache
+from app.services.mcp_pool import MCPSessionPool, MCPPoolTimeoutError, MCP_POOL_SIZE
+from app.services.pdf_cache import get_page_cache
+from app.services.password_hasher import password_hasher
+from app.services.uploads import CleanupStreamingResponse, spool_upload, UploadSizeLimit, UploadTooLargeError
+from app.services import deck_archive
+from app.services.dedup import NearDuplicateIndex
+from app.auth import (
+    create_access_token, user_cache,
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_TOKEN_USER_ID,
+)
 from app.models import (
-    Deck, DeckCreate, DeckRead, DeckUpdate,
-    Card, CardCreate, CardRead, CardUpdate, CardStatus,
-    Tag, TagRead, TagCreate, DeckTagLink,
+    DeckCreate, DeckRead, DeckUpdate, DeckImportResult, DeckStats,
+    CardCreate, CardRead, CardUpdate, CardStatus, CardReview, CardSearchHit,
+    CardBatchCreate, CardBatchUpdate, CardBatchDelete, CardBatchResult,
     GenerateResponse, RefineRequest,
-    User, UserCreate, UserRead, Token, TokenData
+    UserCreate, UserRead, Token, TokenData
 )
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(session: Session = Depends(get_session), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+# Upper bound on items in one batch card request
+MAX_CARD_BATCH = int(os.getenv("MAX_CARD_BATCH", "1000"))
+# /metrics reveals cache sizes, token savings and query counters and needs no login, so it is opt-in
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# List endpoints return a JSON array; the cursor for the next page, if any, travels in this header
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = session.exec(select(User).where(User.username == token_data.username)).first()
-    if user is None:
+    if payload.get("sub") is None:
         raise credentials_exception
+    return payload
+
+async def get_current_user(db: Database = Depends(get_db), token: str = Depends(oauth2_scheme)) -> UserRead:
+    token_data = TokenData(username=decode_token(token)["sub"])
+    user = user_cache.get(token_data.username)
+    if user is None:
+        db_user = await db.run(crud.get_user_by_username, token_data.username)
+        if db_user is None:
+            raise credentials_exception
+        user = UserRead.model_validate(db_user)
+        user_cache.put(user)
     return user
 
+async def get_current_user_id(db: Database = Depends(get_db), token: str = Depends(oauth2_scheme)) -> int:
+    """The caller's user id, read from the token itself when AUTH_TOKEN_USER_ID is enabled."""
+    if AUTH_TOKEN_USER_ID:
+        user_id = decode_token(token).get("uid")
+        if isinstance(user_id, int):
+            return user_id
+    return (await get_current_user(db, token)).id
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    create_db_and_tables()
+    if crud.DECK_STATS_COUNTERS:
+        # Counters are not maintained while disabled, so start from an exact recount
+        with Session(engine) as session:
+            crud.rebuild_deck_card_counts(session)
+
+    # Keep warm MCP extraction servers for the lifetime of the app
+    app.state.mcp_pool = None
+    if MCP_POOL_SIZE > 0:
+        pool = MCPSessionPool(size=MCP_POOL_SIZE)
+        await pool.start()
+        app.state.mcp_pool = pool
+
+    # One configured agent (and its cached model handles) shared by all requests
+    app.state.agent = None
+    try:
+        app.state.agent = FlashcardAgent(mcp_pool=app.state.mcp_pool)
+    except ValueError as e:
+        print(f"DEBUG: AI agent not configured: {e}")
+    try:
+        yield
+    finally:
+        app.state.agent = None
+        password_hasher.shutdown()
+        if app.state.mcp_pool is not None:
+            await app.state.mcp_pool.close()
+            app.state.mcp_pool = None
+
 app = FastAPI(
     title="Flashcards AI API",
     version="1.0.0",
-    description="Backend API for Flashcards App with AI capabilities"
+    description="Backend API for Flashcards App with AI capabilities",
+    lifespan=lifespan
 )
 
+# Reject oversized PDFs before the form parser spools them; added first so CORS still wraps the 413
+app.add_middleware(UploadSizeLimit, paths={"/generate", "/generate/stream"})
+
 # Configure CORS
 # Read allowed origins from environment variable (comma-separated)
 # If not provided, default to wildcard for development (requires allow_credentials=False for browser compatibility)
@@ -64,222 +138,446 @@ app.add_middleware(
     allow_credentials=allow_credentials,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+async def record_query_stats(request: Request, call_next):
+    with query_instrumentation.track() as stats:
+        response = await call_next(request)
+    query_instrumentation.log_request(request.method, request.url.path, response.status_code, stats)
+    return response
+
+# Only wrap requests when instrumentation is configured, so it costs nothing by default
+if query_instrumentation.enabled:
+    app.middleware("http")(record_query_stats)
+
+def get_agent(request: Request) -> FlashcardAgent:
+    """The app-scoped FlashcardAgent. Tests can replace it via app.dependency_overrides."""
+    agent = getattr(request.app.state, "agent", None)
+    if agent is not None:
+        return agent
+    # Lifespan did not run (or had no API key): build one for this request
+    try:
+        return FlashcardAgent(mcp_pool=getattr(request.app.state, "mcp_pool", None))
+    except ValueError:
+        raise HTTPException(status_code=500, detail="AI configuration error")
 
 @app.get("/health")
 def health_check():
     return {"status": "ok", "message": "Flashcards API is running"}
 
+@app.get("/metrics")
+def metrics(request: Request):
+    """Runtime counters for the model executor, caches, MCP pool and SQL queries."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    refine_cache = get_refine_cache()
+    # The extraction servers keep their counters in the shared cache file, so they are readable here
+    page_cache = get_page_cache()
+    mcp_pool = getattr(request.app.state, "mcp_pool", None)
+    return {
+        "llm": llm_executor.stats(),
+        "refine_cache": refine_cache.stats() if refine_cache is not None else None,
+        "pdf_cache": page_cache.stats() if page_cache is not None else None,
+        "mcp_pool": mcp_pool.stats() if mcp_pool is not None else None,
+        "sql": query_instrumentation.stats(),
+        "auth_user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+    }
+
 # --- Auth Endpoints ---
 
 @app.post("/register", response_model=UserRead)
-def register(user: UserCreate, session: Session = Depends(get_session)):
-    db_user = session.exec(select(User).where(User.username == user.username)).first()
+async def register(user: UserCreate, db: Database = Depends(get_db)):
+    db_user = await db.run(crud.get_user_by_username, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = get_password_hash(user.password)
-    new_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
-    session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
-    return new_user
+    # bcrypt is deliberately slow; it runs in the hashing worker processes
+    hashed_password = await password_hasher.hash(user.password)
+    return await db.run(crud.create_user, user, hashed_password)
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Database = Depends(get_db)):
+    user = await db.run(crud.get_user_by_username, form_data.username)
+    valid, new_hash = await password_hasher.verify(form_data.password, user.hashed_password) if user else (False, None)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this hash was stored
+        await db.run(crud.update_password_hash, user.id, new_hash)
     access_token = create_access_token(
-        data={"sub": user.username},
+        data={"sub": user.username, "uid": user.id},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me", response_model=UserRead)
-def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: UserRead = Depends(get_current_user)):
     return current_user
 
 # --- Deck Endpoints ---
 
-def get_or_create_tags(session: Session, tag_names: List[str]) -> List[Tag]:
-    tags = []
-    for name in tag_names:
-        name = name.strip().lower()
-        if not name: continue
-        tag = session.exec(select(Tag).where(Tag.name == name)).first()
-        if not tag:
-            tag = Tag(name=name)
-            session.add(tag)
-        tags.append(tag)
-    return tags
-
 @app.post("/decks/", response_model=DeckRead)
-def create_deck(deck: DeckCreate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    deck_data = deck.model_dump(exclude={"tags"})
-    db_deck = Deck(**deck_data)
-    db_deck.user_id = current_user.id
-    
-    if deck.tags:
-        db_deck.tags = get_or_create_tags(session, deck.tags)
-    
-    session.add(db_deck)
-    session.commit()
-    session.refresh(db_deck)
-    return db_deck
+async def create_deck(deck: DeckCreate, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    return await db.run(crud.create_deck, user_id, deck)
+
+def parse_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return crud.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def cache_headers(request: Request, user_id: int, version: crud.Version) -> dict:
+    """ETag and Last-Modified for a read; the ETag also covers the user and the query string."""
+    etag = http_cache.weak_etag(user_id, request.url.path, str(request.query_params), *version.key)
+    return http_cache.validator_headers(etag, version.updated_at)
+
+def not_modified(request: Request, headers: dict) -> Optional[Response]:
+    if http_cache.etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return None
 
 @app.get("/decks/", response_model=List[DeckRead])
-def read_decks(offset: int = 0, limit: int = Query(default=100, le=100), session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    decks = session.exec(select(Deck).where(Deck.user_id == current_user.id).offset(offset).limit(limit)).all()
-    return decks
+async def read_decks(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=100),
+    tag: Optional[str] = None,
+    offset: int = Query(default=0, ge=0),
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Decks in id order. Pass the X-Next-Cursor header of one page as ``cursor`` to get the next.
+
+    Answers If-None-Match with 304 after one aggregate query over the user's decks.
+    """
+    after_id = parse_cursor(cursor)
+    # The version is read before the decks, so a write in between can only make the ETag stale, never the body
+    headers = cache_headers(request, user_id, await db.run(crud.decks_version, user_id))
+    if cached := not_modified(request, headers):
+        return cached
+    response.headers.update(headers)
+    page = await db.run(crud.list_decks, user_id, limit, after_id=after_id, tag=tag, offset=offset)
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
+
+@app.get("/decks/stats", response_model=List[DeckStats])
+async def read_deck_stats(db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    """Card counts by status for every deck of the user, without loading any cards."""
+    return await db.run(crud.deck_stats, user_id)
 
 @app.get("/decks/{deck_id}", response_model=DeckRead)
-def read_deck(deck_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    deck = session.exec(select(Deck).where(Deck.id == deck_id, Deck.user_id == current_user.id)).first()
+async def read_deck(deck_id: int, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    deck = await db.run(crud.read_deck, user_id, deck_id)
     if not deck:
         raise HTTPException(status_code=404, detail="Deck not found or no access")
     return deck
 
 @app.put("/decks/{deck_id}", response_model=DeckRead)
-def update_deck(deck_id: int, deck_update: DeckUpdate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    db_deck = session.exec(select(Deck).where(Deck.id == deck_id, Deck.user_id == current_user.id)).first()
+async def update_deck(deck_id: int, deck_update: DeckUpdate, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    db_deck = await db.run(crud.update_deck, user_id, deck_id, deck_update)
     if not db_deck:
         raise HTTPException(status_code=404, detail="Deck not found or no access")
-    
-    deck_data = deck_update.model_dump(exclude_unset=True)
-    
-    # Handle tags separately
-    if "tags" in deck_data:
-        tag_names = deck_data.pop("tags")
-        if tag_names is not None:
-             db_deck.tags = get_or_create_tags(session, tag_names)
-
-    for key, value in deck_data.items():
-        setattr(db_deck, key, value)
-        
-    session.add(db_deck)
-    session.commit()
-    session.refresh(db_deck)
     return db_deck
 
 @app.delete("/decks/{deck_id}")
-def delete_deck(deck_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    deck = session.exec(select(Deck).where(Deck.id == deck_id, Deck.user_id == current_user.id)).first()
-    if not deck:
+async def delete_deck(deck_id: int, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    if not await db.run(crud.delete_deck, user_id, deck_id):
         raise HTTPException(status_code=404, detail="Deck not found or no access")
-    session.delete(deck)
-    session.commit()
     return {"ok": True}
 
+@app.get("/decks/{deck_id}/export")
+async def export_deck(
+    deck_id: int,
+    gzip: bool = False,
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Stream the deck and all its cards as NDJSON (see app.services.deck_archive), gzip-compressed if asked."""
+    deck = await db.run(crud.read_deck, user_id, deck_id)
+    if not deck:
+        raise HTTPException(status_code=404, detail="Deck not found or no access")
+
+    async def lines():
+        yield deck_archive.deck_line(deck)
+        async for rows in db.stream(crud.deck_archive_statement(deck_id), deck_archive.ARCHIVE_BATCH_SIZE):
+            yield deck_archive.card_lines(rows)
+
+    filename = f"deck-{deck_id}.ndjson"
+    if gzip:
+        body, media_type, filename = deck_archive.gzip_chunks(lines()), "application/gzip", filename + ".gz"
+    else:
+        body, media_type = lines(), "application/x-ndjson"
+    return StreamingResponse(
+        body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/decks/import", response_model=DeckImportResult)
+async def import_deck(
+    request: Request,
+    dedup: bool = False,
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Create a deck from an export sent as the raw request body, plain or gzip-compressed.
+
+    The body is spooled to disk and parsed in full before the transaction
+    starts, so a slow upload or a malformed line never holds the database's
+    write lock. Cards are then inserted in batches and committed together. With
+    ``dedup``, cards that near-duplicate an earlier card in the archive are left out.
+    """
+    index = NearDuplicateIndex() if dedup else None
+    try:
+        async with deck_archive.spool_archive(request.stream()) as path:
+            await deck_archive.check_archive(deck_archive.file_chunks(path))
+            header, batches = await deck_archive.read_archive(deck_archive.file_chunks(path), deck_archive.ARCHIVE_BATCH_SIZE)
+            deck = await db.run(crud.start_deck_import, user_id, header)
+            count = duplicates = 0
+            async for cards in batches:
+                if index is not None:
+                    cards, dropped = await run_in_threadpool(index.drop_duplicates, cards)
+                    duplicates += dropped
+                if cards:
+                    await db.run(crud.import_cards, user_id, deck.id, cards)
+                count += len(cards)
+            await db.run(crud.commit)
+    except deck_archive.ArchiveTooLargeError:
+        raise HTTPException(status_code=413, detail="Archive is too large")
+    except deck_archive.ArchiveError as e:
+        await db.run(crud.rollback)
+        raise HTTPException(status_code=400, detail=str(e))
+    return DeckImportResult(deck=deck, cards=count, duplicates=duplicates)
+
 # --- Card Endpoints ---
 
 @app.post("/cards/", response_model=CardRead)
-def create_card(card: CardCreate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    # Verify deck exists and belongs to current user
-    deck = session.exec(select(Deck).where(Deck.id == card.deck_id, Deck.user_id == current_user.id)).first()
-    if not deck:
+async def create_card(card: CardCreate, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    # The deck must exist and belong to the current user
+    db_card = await db.run(crud.create_card, user_id, card)
+    if not db_card:
         raise HTTPException(status_code=404, detail="Deck not found or no access")
-    
-    db_card = Card.from_orm(card)
-    session.add(db_card)
-    session.commit()
-    session.refresh(db_card)
     return db_card
 
+# Batch routes are declared before /cards/{card_id} so "batch" is not read as an id
+
+def check_batch_size(count: int):
+    if count > MAX_CARD_BATCH:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_CARD_BATCH} cards per batch")
+
+@app.post("/cards/batch", response_model=CardBatchResult)
+async def create_cards_batch(batch: CardBatchCreate, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    """Create many cards in one transaction. All target decks must belong to the user, or nothing is saved."""
+    check_batch_size(len(batch.cards))
+    ids = await db.run(crud.create_cards, user_id, batch.cards)
+    if ids is None:
+        raise HTTPException(status_code=404, detail="Deck not found or no access")
+    return CardBatchResult(ids=ids)
+
+@app.put("/cards/batch", response_model=CardBatchResult)
+async def update_cards_batch(batch: CardBatchUpdate, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    check_batch_size(len(batch.cards))
+    ids = await db.run(crud.update_cards, user_id, batch.cards)
+    if ids is None:
+        raise HTTPException(status_code=404, detail="Card not found or no access")
+    return CardBatchResult(ids=ids)
+
+@app.post("/cards/batch/delete", response_model=CardBatchResult)
+async def delete_cards_batch(batch: CardBatchDelete, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    check_batch_size(len(batch.ids))
+    ids = await db.run(crud.delete_cards, user_id, batch.ids)
+    if ids is None:
+        raise HTTPException(status_code=404, detail="Card not found or no access")
+    return CardBatchResult(ids=ids)
+
 @app.get("/decks/{deck_id}/cards", response_model=List[CardRead])
-def read_cards_by_deck(deck_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    # Verify deck exists and belongs to user
-    deck = session.exec(select(Deck).where(Deck.id == deck_id, Deck.user_id == current_user.id)).first()
-    if not deck:
+async def read_cards_by_deck(
+    deck_id: int,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=500, ge=1, le=1000),
+    status: Optional[CardStatus] = None,
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Cards in id order, optionally only those with ``status``. Paginated and cached like GET /decks/.
+
+    The deck's version is one primary-key lookup, so a 304 never loads a card.
+    """
+    after_id = parse_cursor(cursor)
+    version = await db.run(crud.deck_version, user_id, deck_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Deck not found or no access")
-        
-    statement = select(Card).where(Card.deck_id == deck_id)
-    cards = session.exec(statement).all()
-    return cards
+    headers = cache_headers(request, user_id, version)
+    if cached := not_modified(request, headers):
+        return cached
+    response.headers.update(headers)
+    page = await db.run(crud.list_cards, user_id, deck_id, limit, after_id=after_id, status=status)
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return page.items
 
 @app.put("/cards/{card_id}", response_model=CardRead)
-def update_card(card_id: int, card_update: CardUpdate, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    # Find card and verify it belongs to a deck owned by the user
-    db_card = session.exec(
-        select(Card).join(Deck).where(Card.id == card_id, Deck.user_id == current_user.id)
-    ).first()
-    
+async def update_card(card_id: int, card_update: CardUpdate, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    db_card = await db.run(crud.update_card, user_id, card_id, card_update)
     if not db_card:
         raise HTTPException(status_code=404, detail="Card not found or no access")
-        
-    card_data = card_update.model_dump(exclude_unset=True)
-    for key, value in card_data.items():
-        setattr(db_card, key, value)
-        
-    session.add(db_card)
-    session.commit()
-    session.refresh(db_card)
     return db_card
 
-@app.delete("/cards/{card_id}")
-def delete_card(card_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    # Find card and verify it belongs to a deck owned by the user
-    db_card = session.exec(
-        select(Card).join(Deck).where(Card.id == card_id, Deck.user_id == current_user.id)
-    ).first()
-    
+@app.post("/cards/{card_id}/review", response_model=CardRead)
+async def review_card(card_id: int, review: CardReview, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    """Record a review graded 0-5 and schedule the card's next one (SM-2)."""
+    db_card = await db.run(crud.review_card, user_id, card_id, review.grade)
     if not db_card:
         raise HTTPException(status_code=404, detail="Card not found or no access")
-    session.delete(db_card)
-    session.commit()
+    return db_card
+
+@app.get("/review/next", response_model=List[CardRead])
+async def read_review_queue(
+    limit: int = Query(default=20, ge=1, le=100),
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Cards due for review across all of the user's decks, most overdue first."""
+    return await db.run(crud.next_due_cards, user_id, limit)
+
+@app.get("/search/cards", response_model=List[CardSearchHit])
+async def search_cards(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=20, ge=1, le=100),
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+):
+    """Full-text search over the front and back of the user's cards, best match first."""
+    return await db.run(crud.search_cards, user_id, q, limit)
+
+@app.delete("/cards/{card_id}")
+async def delete_card(card_id: int, db: Database = Depends(get_db), user_id: int = Depends(get_current_user_id)):
+    if not await db.run(crud.delete_card, user_id, card_id):
+        raise HTTPException(status_code=404, detail="Card not found or no access")
     return {"ok": True}
 
 
 # --- AI Generation Endpoint ---
 
+async def deck_duplicate_index(db: Database, user_id: int, deck_id: int) -> NearDuplicateIndex:
+    """A near-duplicate index of the deck's cards, to filter generated cards against."""
+    if not await db.run(crud.read_deck, user_id, deck_id):
+        raise HTTPException(status_code=404, detail="Deck not found or no access")
+    index = NearDuplicateIndex()
+    async for rows in db.stream(crud.deck_card_text_statement(deck_id)):
+        # Hashing is CPU-bound; keep it off the event loop for large decks
+        await run_in_threadpool(index.add_rows, rows)
+    return index
+
 @app.post("/generate", response_model=GenerateResponse)
 async def generate_cards(
     file: UploadFile = File(...),
     start_page: int = Form(1),
     end_page: int = Form(-1),
-    current_user: User = Depends(get_current_user)
+    mode: Optional[str] = Form(None),
+    deck_id: Optional[int] = Form(None),
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+    agent: FlashcardAgent = Depends(get_agent)
 ):
+    """Generate cards from a PDF. With ``deck_id``, near-duplicates of that deck's cards are left out."""
     print(f"DEBUG: Received file: {file.filename}, Pages: {start_page}-{end_page}")
     if not file.filename.lower().endswith('.pdf'):
         print("DEBUG: Filename check failed")
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    if mode is not None and mode not in GENERATION_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(GENERATION_MODES)}")
+    index = await deck_duplicate_index(db, user_id, deck_id) if deck_id is not None else None
 
-    # Memory-efficient reading: UploadFile uses a SpooledTemporaryFile.
-    # We can read in chunks if we were processing it locally, but since we
-    # passed it to the AI agent which expects bytes, we still need to load it.
-    # To improve this, we could pass a file path to the agent if stored locally.
-    # For now, we'll keep it as bytes but acknowledge the limitation.
-    content = await file.read()
-    await file.close() # Ensure file is closed after reading
-    
     try:
-        # Initialize agent
-        agent = FlashcardAgent()
-        
-        # Generate cards
-        valid_cards, source_text = await agent.generate_from_pdf(content, start_page=start_page, end_page=end_page)
-        return GenerateResponse(cards=valid_cards, source_text=source_text)
-        
+        # Stream the upload to disk in chunks; only the path reaches the extractor
+        async with spool_upload(file) as upload:
+            valid_cards, source_text = await agent.generate_from_pdf_path(
+                upload.path, start_page=start_page, end_page=end_page, pdf_sha256=upload.sha256, mode=mode
+            )
+            duplicates = 0
+            if index is not None:
+                valid_cards, duplicates = index.drop_duplicates(valid_cards)
+            return GenerateResponse(cards=valid_cards, source_text=source_text, duplicates=duplicates)
+
+    except UploadTooLargeError:
+        raise HTTPException(status_code=413, detail="PDF file is too large")
     except ValueError as ve:
         raise HTTPException(status_code=500, detail="AI configuration error")
+    except MCPPoolTimeoutError:
+        raise HTTPException(status_code=503, detail="All PDF extractors are busy. Please try again shortly.")
+    except LLMTimeoutError:
+        raise HTTPException(status_code=504, detail="The AI model took too long to respond. Please try again.")
     except Exception as e:
         print(f"DEBUG: AI generation failed: {str(e)}") # Log internally
         raise HTTPException(status_code=500, detail="Flashcard generation failed. Please try again later.")
+    finally:
+        await file.close()
+
+@app.post("/generate/stream")
+async def generate_cards_stream(
+    file: UploadFile = File(...),
+    start_page: int = Form(1),
+    end_page: int = Form(-1),
+    deck_id: Optional[int] = Form(None),
+    db: Database = Depends(get_db),
+    user_id: int = Depends(get_current_user_id),
+    agent: FlashcardAgent = Depends(get_agent)
+):
+    """Like /generate, but streams NDJSON events: extraction progress, one line per card, then "done"."""
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    index = await deck_duplicate_index(db, user_id, deck_id) if deck_id is not None else None
+
+    # Spool before the response starts so an oversized upload still gets a status code
+    cleanup = AsyncExitStack()
+    try:
+        upload = await cleanup.enter_async_context(spool_upload(file))
+    except UploadTooLargeError:
+        await cleanup.aclose()
+        raise HTTPException(status_code=413, detail="PDF file is too large")
+    finally:
+        await file.close()
+
+    async def event_stream():
+        duplicates = 0
+        try:
+            async for event in agent.stream_from_pdf_path(
+                upload.path, start_page=start_page, end_page=end_page, pdf_sha256=upload.sha256
+            ):
+                if index is not None:
+                    if event["type"] == "card":
+                        card = event["card"]
+                        if index.add_if_new(("new", len(index)), card["front"], card["back"]) is not None:
+                            duplicates += 1
+                            continue
+                    elif event["type"] == "done":
+                        event = {**event, "card_count": event["card_count"] - duplicates, "duplicates": duplicates}
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"DEBUG: Streaming generation failed: {str(e)}") # Log internally
+            yield json.dumps({"type": "error", "detail": "Flashcard generation failed. Please try again later."}) + "\n"
+
+    # The response deletes the spooled file, even if the body is never iterated
+    return CleanupStreamingResponse(event_stream(), cleanup, media_type="application/x-ndjson")
 
 @app.post("/generate/refine", response_model=List[CardCreate])
-async def refine_cards(request: RefineRequest, current_user: User = Depends(get_current_user)):
+async def refine_cards(request: RefineRequest, user_id: int = Depends(get_current_user_id), agent: FlashcardAgent = Depends(get_agent)):
     try:
-        agent = FlashcardAgent()
         new_cards = await agent.refine_flashcards(request.cards, request.source_text, request.feedback)
         return new_cards
+    except LLMTimeoutError:
+        raise HTTPException(status_code=504, detail="The AI model took too long to respond. Please try again.")
     except Exception as e:
         print(f"DEBUG: Refinement failed: {str(e)}") # Log internally
         raise HTTPException(status_code=500, detail="Flashcard refinement failed. Please try again later.")
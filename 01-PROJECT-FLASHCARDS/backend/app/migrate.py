@@ -1,5 +1,6 @@
 import sqlite3
 import os
+from app.search import CARD_FTS_DDL, CARD_FTS_TABLE
 
 def migrate():
     db_path = "database.db"
@@ -49,6 +50,77 @@ def migrate():
         else:
             print("tags column already exists in deck table.")
 
+        # 4. Composite indexes for keyset pagination
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_deck_user_id_id ON deck (user_id, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_card_deck_id_status_id ON card (deck_id, status, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_card_deck_id_id ON card (deck_id, id)")
+        conn.commit()
+        print("Pagination indexes are in place.")
+
+        # 5. Spaced-repetition schedule and the review queue index
+        cursor.execute("PRAGMA table_info(card)")
+        columns = [column[1] for column in cursor.fetchall()]
+        schedule_columns = {
+            "due_at": "DATETIME",
+            "interval_days": "INTEGER NOT NULL DEFAULT 0",
+            "ease": "FLOAT NOT NULL DEFAULT 2.5",
+            "repetitions": "INTEGER NOT NULL DEFAULT 0",
+            "user_id": "INTEGER REFERENCES user(id)",
+        }
+        for name, definition in schedule_columns.items():
+            if name not in columns:
+                print(f"Adding {name} column to card table...")
+                cursor.execute(f"ALTER TABLE card ADD COLUMN {name} {definition}")
+        # Existing cards are due now and take their owner from the deck
+        cursor.execute("UPDATE card SET due_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE due_at IS NULL")
+        cursor.execute(
+            "UPDATE card SET user_id = (SELECT deck.user_id FROM deck WHERE deck.id = card.deck_id) "
+            "WHERE user_id IS NULL"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_card_user_id_due_at ON card (user_id, due_at)")
+        conn.commit()
+        print("Review schedule columns are in place.")
+
+        # 6. Full-text search index over card text
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CARD_FTS_TABLE,))
+        if cursor.fetchone() is None:
+            print("Creating card search index...")
+            try:
+                for statement in CARD_FTS_DDL:
+                    cursor.execute(statement)
+                # Index the cards that existed before the triggers
+                cursor.execute(f"INSERT INTO {CARD_FTS_TABLE}({CARD_FTS_TABLE}) VALUES ('rebuild')")
+                conn.commit()
+                print("Successfully created card search index.")
+            except sqlite3.OperationalError as e:
+                # SQLite built without FTS5; search falls back to LIKE
+                conn.rollback()
+                print(f"Card search index not created: {e}")
+        else:
+            print("Card search index already exists.")
+
+        # 7. Deck versions for conditional GETs
+        cursor.execute("PRAGMA table_info(deck)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if "version" not in columns:
+            print("Adding version column to deck table...")
+            cursor.execute("ALTER TABLE deck ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if "updated_at" not in columns:
+            print("Adding updated_at column to deck table...")
+            cursor.execute("ALTER TABLE deck ADD COLUMN updated_at DATETIME")
+        cursor.execute("UPDATE deck SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE updated_at IS NULL")
+        conn.commit()
+        print("Deck version columns are in place.")
+
+        # 8. Sentinel column for ordered batch inserts of cards
+        cursor.execute("PRAGMA table_info(card)")
+        if "insert_sentinel" not in [column[1] for column in cursor.fetchall()]:
+            print("Adding insert_sentinel column to card table...")
+            cursor.execute("ALTER TABLE card ADD COLUMN insert_sentinel INTEGER")
+            conn.commit()
+        else:
+            print("Card insert sentinel already exists.")
+
         conn.close()
     except Exception as e:
         print(f"Migration failed: {e}")
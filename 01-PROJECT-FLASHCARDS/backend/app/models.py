@@ -1,4 +1,5 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
+from sqlalchemy import Index, insert_sentinel
 from sqlmodel import Field, Relationship, SQLModel
 from datetime import datetime
 from enum import Enum
@@ -61,9 +62,15 @@ class DeckBase(SQLModel):
     description: Optional[str] = None
 
 class Deck(DeckBase, table=True):
+    # Backs keyset pagination of a user's decks
+    __table_args__ = (Index("ix_deck_user_id_id", "user_id", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     notes: Optional[str] = Field(default="")
+    # Bumped by app.crud on every write to the deck or its cards; backs the ETags of deck reads
+    version: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
     
     # Relationship to User
     user_id: Optional[int] = Field(default=None, foreign_key="user.id")
@@ -84,6 +91,16 @@ class DeckRead(DeckBase):
     notes: Optional[str] = None
     tags: List[TagRead] = []
 
+class DeckArchiveHeader(DeckCreate):
+    """First line of a deck export; the card lines follow."""
+    notes: Optional[str] = ""
+
+class DeckImportResult(SQLModel):
+    deck: DeckRead
+    cards: int
+    # Cards left out as near-duplicates of earlier ones (import with ?dedup=true)
+    duplicates: int = 0
+
 class DeckUpdate(SQLModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -97,9 +114,29 @@ class CardBase(SQLModel):
     status: CardStatus = Field(default=CardStatus.NEW)
     deck_id: Optional[int] = Field(default=None, foreign_key="deck.id")
 
-class Card(CardBase, table=True):
+class CardSchedule(SQLModel):
+    # SM-2 state; new cards are due immediately
+    due_at: datetime = Field(default_factory=datetime.utcnow)
+    interval_days: int = 0
+    ease: float = 2.5
+    repetitions: int = 0
+
+class Card(CardSchedule, CardBase, table=True):
+    # Back keyset pagination of a deck's cards, with and without a status filter,
+    # and the review queue across all of a user's decks
+    __table_args__ = (
+        Index("ix_card_deck_id_status_id", "deck_id", "status", "id"),
+        Index("ix_card_deck_id_id", "deck_id", "id"),
+        Index("ix_card_user_id_due_at", "user_id", "due_at"),
+        # Lets a batch INSERT ... RETURNING hand back ids in parameter order in one statement;
+        # SQLite does not promise that order for the autoincrement id alone
+        insert_sentinel("insert_sentinel"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Copy of deck.user_id, so the review queue is one index range scan instead of a join
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
     
     # Relationship to Deck
     deck: Optional[Deck] = Relationship(back_populates="cards")
@@ -107,19 +144,57 @@ class Card(CardBase, table=True):
 class CardCreate(CardBase):
     pass
 
-class CardRead(CardBase):
+class CardRead(CardSchedule, CardBase):
     id: int
     created_at: datetime
 
+class CardSearchHit(CardRead):
+    # Matched text with the terms wrapped in <mark>; everything else is HTML-escaped
+    snippet: str
+
+class CardReview(SQLModel):
+    # SM-2 answer quality: 0-2 forgotten, 3 hard, 4 good, 5 easy
+    grade: int = Field(ge=0, le=5)
+
 class CardUpdate(SQLModel):
     front: Optional[str] = None
     back: Optional[str] = None
     status: Optional[CardStatus] = None
 
+# Denormalized card counts per deck and status, maintained by app.crud when
+# DECK_STATS_COUNTERS is enabled
+class DeckCardCount(SQLModel, table=True):
+    deck_id: int = Field(foreign_key="deck.id", primary_key=True)
+    status: CardStatus = Field(primary_key=True)
+    count: int = 0
+
+class DeckStats(SQLModel):
+    deck_id: int
+    total: int
+    counts: Dict[CardStatus, int]
+
+# Batch card operations
+class CardBatchCreate(SQLModel):
+    cards: List[CardCreate]
+
+class CardBatchUpdateItem(CardUpdate):
+    id: int
+
+class CardBatchUpdate(SQLModel):
+    cards: List[CardBatchUpdateItem]
+
+class CardBatchDelete(SQLModel):
+    ids: List[int]
+
+class CardBatchResult(SQLModel):
+    ids: List[int]
+
 # AI Models
 class GenerateResponse(SQLModel):
     cards: List[CardCreate]
     source_text: str
+    # Cards left out as near-duplicates of the target deck's cards
+    duplicates: int = 0
 
 class RefineRequest(SQLModel):
     cards: List[CardCreate]
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+load_dotenv()
+
+logger = logging.getLogger("app.sql")
+
+# Echoing every statement to stdout is for local debugging only
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+# Statements slower than this are logged; 0 disables slow-query logging
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "0"))
+# Fraction of requests whose query count and total time are logged
+SQL_LOG_SAMPLE_RATE = float(os.getenv("SQL_LOG_SAMPLE_RATE", "0"))
+_MAX_LOGGED_STATEMENT = 500
+
+
+class QueryStats:
+    """Queries issued while handling one request."""
+
+    __slots__ = ("count", "duration_ms", "slow")
+
+    def __init__(self):
+        self.count = 0
+        self.duration_ms = 0.0
+        self.slow = 0
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+class QueryInstrumentation:
+    """Per-request query counting, slow-query logging and sampled request summaries.
+
+    Hooks are attached to an engine only when slow-query logging or sampling is
+    turned on, so the default configuration adds no work per statement. Log
+    lines are single JSON objects on the ``app.sql`` logger.
+    """
+
+    def __init__(self, slow_query_ms: float = SQL_SLOW_QUERY_MS, sample_rate: float = SQL_LOG_SAMPLE_RATE):
+        self.slow_query_ms = slow_query_ms
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.slow_queries = 0
+        self.duration_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.slow_query_ms > 0 or self.sample_rate > 0
+
+    def install(self, engine: Engine):
+        if not self.enabled:
+            return
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    # The start time lives on the statement's execution context rather than a
+    # per-connection stack: a statement that raises never reaches
+    # after_cursor_execute, and its start must not be paired with the next one.
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_query_start", None)
+        if start is None:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        slow = self.slow_query_ms > 0 and elapsed_ms >= self.slow_query_ms
+        with self._lock:
+            self.queries += 1
+            self.duration_ms += elapsed_ms
+            self.slow_queries += slow
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.duration_ms += elapsed_ms
+            stats.slow += slow
+        if slow:
+            logger.warning(json.dumps({
+                "event": "slow_query",
+                "duration_ms": round(elapsed_ms, 2),
+                "statement": " ".join(statement.split())[:_MAX_LOGGED_STATEMENT],
+                "executemany": executemany,
+            }))
+
+    @contextmanager
+    def track(self):
+        """Collect the queries run in this context (and tasks or threads it spawns)."""
+        stats = QueryStats()
+        token = _current_stats.set(stats)
+        try:
+            yield stats
+        finally:
+            _current_stats.reset(token)
+
+    def log_request(self, method: str, path: str, status_code: int, stats: QueryStats):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        logger.info(json.dumps({
+            "event": "request_queries",
+            "method": method,
+            "path": path,
+            "status": status_code,
+            "queries": stats.count,
+            "duration_ms": round(stats.duration_ms, 2),
+            "slow_queries": stats.slow,
+        }))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "queries": self.queries,
+                "slow_queries": self.slow_queries,
+                "duration_ms": round(self.duration_ms, 2),
+            }
+
+
+query_instrumentation = QueryInstrumentation()
+
+
+class QueryLog:
+    """Statements captured by ``count_queries``."""
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(engine: Engine):
+    """Record every statement the engine runs inside the block, e.g. to guard against N+1 queries."""
+    log = QueryLog()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        log.statements.append(" ".join(statement.split()))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield log
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
@@ -0,0 +1,92 @@
+"""Full-text search over card text with SQLite FTS5.
+
+``card_fts`` is an external-content FTS5 table: it indexes ``card.front`` and
+``card.back`` without storing a second copy, and triggers keep it in sync on
+every insert, delete and text update, whichever code path writes the card.
+It is created together with the ``card`` table, or by ``app.migrate`` for
+existing databases. Other databases, or SQLite builds without FTS5, fall back
+to a LIKE scan in app.crud.search_cards.
+"""
+import html
+import re
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection
+from app.models import Card
+
+CARD_FTS_TABLE = "card_fts"
+
+CARD_FTS_DDL = [
+    # unicode61 folds case and, with remove_diacritics, accents ("resume" finds "résumé")
+    "CREATE VIRTUAL TABLE IF NOT EXISTS card_fts USING fts5("
+    "front, back, content='card', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS card_fts_ai AFTER INSERT ON card BEGIN "
+    "INSERT INTO card_fts(rowid, front, back) VALUES (new.id, new.front, new.back); END",
+    "CREATE TRIGGER IF NOT EXISTS card_fts_ad AFTER DELETE ON card BEGIN "
+    "INSERT INTO card_fts(card_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back); END",
+    # Status and review updates leave the text alone, so they skip the index
+    "CREATE TRIGGER IF NOT EXISTS card_fts_au AFTER UPDATE OF front, back ON card BEGIN "
+    "INSERT INTO card_fts(card_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back); "
+    "INSERT INTO card_fts(rowid, front, back) VALUES (new.id, new.front, new.back); END",
+]
+
+# bm25 column weights: a hit on the question outranks one on the answer
+FRONT_WEIGHT = 2.0
+BACK_WEIGHT = 1.0
+SNIPPET_TOKENS = 12
+# Highlight markers SQLite puts around matches; swapped for <mark> after escaping
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def fts5_available(connection: Connection) -> bool:
+    options = connection.exec_driver_sql("PRAGMA compile_options").scalars().all()
+    return "ENABLE_FTS5" in options
+
+
+def create_card_search(connection: Connection):
+    """Create card_fts and its triggers if missing (SQLite with FTS5 only)."""
+    if connection.dialect.name != "sqlite" or not fts5_available(connection):
+        return
+    for statement in CARD_FTS_DDL:
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Card.__table__, "after_create")
+def _create_card_search_with_table(target, connection, **kw):
+    create_card_search(connection)
+
+
+def has_card_search(connection: Connection) -> bool:
+    """Whether this database has card_fts; cached on the DBAPI connection."""
+    if connection.dialect.name != "sqlite":
+        return False
+    if CARD_FTS_TABLE not in connection.info:
+        connection.info[CARD_FTS_TABLE] = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": CARD_FTS_TABLE}
+        ).first() is not None
+    return connection.info[CARD_FTS_TABLE]
+
+
+def search_terms(query: str) -> list:
+    return _TOKEN.findall(query)
+
+
+def fts_query(terms: list) -> str:
+    """An FTS5 MATCH expression requiring every term, the last one as a prefix.
+
+    Terms are quoted, so user input can never be read as FTS5 syntax.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def snippet_sql() -> str:
+    return f"snippet({CARD_FTS_TABLE}, -1, '{_MARK_START}', '{_MARK_END}', '…', {SNIPPET_TOKENS})"
+
+
+def highlight(snippet: str) -> str:
+    """HTML-escape card text, then wrap the matched terms in <mark>."""
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
@@ -1,15 +1,38 @@
 import os
 import json
 import re
+import asyncio
 import tempfile
 import google.generativeai as genai
-from typing import List, Tuple
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 from app.models import CardCreate
-from mcp import ClientSession, StdioServerParameters
+from app.services.dedup import normalize_text
+from app.services.mcp_pool import MCPSessionPool, mcp_server_params
+from app.services.pdf_cache import sha256_bytes
+from app.services.fake_model import FakeGenerativeModel, FAKE_MODEL_NAME
+from app.services.llm_runtime import LLMExecutor, llm_executor
+from app.services.response_cache import ResponseCache, estimate_tokens, get_refine_cache, refine_cache_key
+from mcp import ClientSession
+from starlette.concurrency import run_in_threadpool
 from mcp.client.stdio import stdio_client
 
 import base64
 
+# "agent" lets Gemini call the extraction tool itself; "chunked" extracts first and
+# generates cards per chunk of pages concurrently (map), then merges them (reduce).
+GENERATION_MODES = ("agent", "chunked")
+GENERATION_MODE = os.getenv("GENERATION_MODE", "agent")
+GENERATION_CHUNK_CHARS = int(os.getenv("GENERATION_CHUNK_CHARS", "12000"))
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "4"))
+# Pages extracted per tool call when streaming, i.e. how often progress is reported
+STREAM_EXTRACT_BATCH_PAGES = int(os.getenv("STREAM_EXTRACT_BATCH_PAGES", "10"))
+
+# Arguments of extract_text_from_pdf the model may choose
+_MODEL_TOOL_ARGS = ("start_page", "end_page")
+
+_PAGE_MARKER = re.compile(r"^--- Page \d+ ---$", re.MULTILINE)
+
 def extract_json_from_response(text: str) -> str:
     """Extract JSON from markdown code blocks or raw JSON."""
     # Try to extract from markdown code blocks
@@ -24,29 +47,396 @@ def extract_json_from_response(text: str) -> str:
     
     return text.strip()
 
-class FlashcardAgent:
+def parse_cards(text: str) -> List[CardCreate]:
+    """Parse a model response into cards, skipping items without both 'front' and 'back'."""
+    cards_data = json.loads(extract_json_from_response(text))
+    valid_cards = []
+    for item in cards_data:
+        if 'front' in item and 'back' in item:
+            valid_cards.append(CardCreate(front=str(item['front']), back=str(item['back'])))
+    return valid_cards
+
+def split_text_into_chunks(text: str, max_chars: int = GENERATION_CHUNK_CHARS) -> List[str]:
+    """Group extracted '--- Page N ---' sections into chunks of at most max_chars.
+
+    Pages are never split, so a single page longer than max_chars forms its own chunk.
+    """
+    starts = [m.start() for m in _PAGE_MARKER.finditer(text)]
+    if not starts:
+        return [text] if text.strip() else []
+    pages = [text[a:b].strip() for a, b in zip(starts, starts[1:] + [len(text)])]
+
+    chunks, current, current_len = [], [], 0
+    for page in pages:
+        if current and current_len + len(page) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, current_len = [], 0
+        current.append(page)
+        current_len += len(page) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def merge_cards(card_lists: List[List[CardCreate]]) -> List[CardCreate]:
+    """Concatenate per-chunk results in document order, dropping repeated questions."""
+    seen = set()
+    merged = []
+    for cards in card_lists:
+        for card in cards:
+            key = normalize_text(card.front)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(card)
+    return merged
+
+# Tool signature offered to Gemini. It maps directly to the mcp_server.py
+# 'extract_text_from_pdf' tool; the actual call is made in the agent's execution loop.
+def extract_text_from_pdf(start_page: int, end_page: int) -> str:
+    """
+    Extracts text from the uploaded PDF for the given page range.
+    
+    Args:
+        start_page: The starting page number (1-indexed).
+        end_page: The ending page number (1-indexed). Use -1 for the end of the document.
+    """
+    return f"Extracting text from pages {start_page} to {end_page}..."
+
+class IncrementalCardParser:
+    """Pull complete card objects out of a JSON array while it is still streaming in.
+
+    Text before the opening '[' (such as a markdown fence) is ignored. Each
+    top-level object is parsed as soon as its closing brace arrives. Objects
+    without both 'front' and 'back' are skipped.
+    """
+
     def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    def feed(self, text: str) -> List[CardCreate]:
+        self._buffer += text
+        cards = []
+        while self._pos < len(self._buffer):
+            ch = self._buffer[self._pos]
+            if self._depth == 0:
+                if ch == "[":
+                    self._depth = 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "{" and self._depth == 2:
+                    self._object_start = self._pos
+            elif ch in "}]":
+                if ch == "}" and self._depth == 2 and self._object_start is not None:
+                    card = self._parse_object(self._buffer[self._object_start:self._pos + 1])
+                    if card is not None:
+                        cards.append(card)
+                    self._object_start = None
+                self._depth -= 1
+            self._pos += 1
+
+        # Drop consumed text so the buffer only ever holds the object in progress
+        keep_from = self._object_start if self._object_start is not None else self._pos
+        self._buffer = self._buffer[keep_from:]
+        self._pos -= keep_from
+        if self._object_start is not None:
+            self._object_start = 0
+        return cards
+
+    @staticmethod
+    def _parse_object(raw: str) -> Optional[CardCreate]:
+        try:
+            item = json.loads(raw)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(item, dict) and 'front' in item and 'back' in item:
+            return CardCreate(front=str(item['front']), back=str(item['back']))
+        return None
+
+class FlashcardAgent:
+    """Gemini-backed card generator.
+
+    Meant to be created once per app (see app.main.get_agent): construction
+    configures the SDK, and model handles are cached per (model name, tool set).
+    """
+
+    def __init__(
+        self,
+        mcp_pool: Optional[MCPSessionPool] = None,
+        llm: Optional[LLMExecutor] = None,
+        refine_cache: Optional[ResponseCache] = None,
+    ):
+        self.mcp_pool = mcp_pool
+        # All model calls go through the shared bounded executor, never the event loop
+        self.llm = llm or llm_executor
+        self.refine_cache = refine_cache if refine_cache is not None else get_refine_cache()
+        # Reverting to 'gemini-flash-latest' as 'gemini-1.5-flash' caused 404
+        self.model_name = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+        self._models: Dict[Tuple[str, Tuple[str, ...]], object] = {}
+        if self.model_name == FAKE_MODEL_NAME:
+            # Offline mode: no API key needed, only chunked generation is supported
+            self.model = FakeGenerativeModel()
+            return
+
         self.api_key = os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
             raise ValueError("GOOGLE_API_KEY not configured")
         
         genai.configure(api_key=self.api_key)
-        # Reverting to 'gemini-flash-latest' as 'gemini-1.5-flash' caused 404
-        self.model_name = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
         self.model = genai.GenerativeModel(self.model_name)
+        self._models[(self.model_name, ())] = self.model
 
-    async def generate_from_pdf(self, pdf_content: bytes, start_page: int = 1, end_page: int = -1) -> Tuple[List[CardCreate], str]:
-        # MCP Server parameters for the backend extraction tool
-        # Calculate absolute path to mcp_server.py which is in the same directory as the backend root
-        backend_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-        mcp_server_path = os.path.join(backend_dir, "mcp_server.py")
+    def get_model(self, tools: Tuple[Callable, ...] = ()):
+        """Return the cached model handle for this model name and tool set, creating it once."""
+        if self.is_fake:
+            return self.model
+        key = (self.model_name, tuple(tool.__name__ for tool in tools))
+        model = self._models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name=self.model_name, tools=list(tools))
+            self._models[key] = model
+        return model
+
+    @property
+    def is_fake(self) -> bool:
+        return isinstance(self.model, FakeGenerativeModel)
+
+    @asynccontextmanager
+    async def _mcp_session(self):
+        """Yield an initialized MCP session, preferring a warm one from the pool."""
+        if self.mcp_pool is not None:
+            async with self.mcp_pool.session() as session:
+                yield session
+            return
+
+        # No pool (e.g. tests or MCP_POOL_SIZE=0): spawn a one-off server for this call
+        async with stdio_client(mcp_server_params()) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                yield session
+
+    async def _call_extract_tool(self, tool_args: dict) -> str:
+        return await self._call_tool("extract_text_from_pdf", tool_args)
+
+    async def _call_tool(self, name: str, tool_args: dict) -> str:
+        # Hold an MCP session only for the tool call itself, not the LLM round trips
+        async with self._mcp_session() as session:
+            mcp_result = await session.call_tool(name, arguments=tool_args)
+
+        if mcp_result.content and hasattr(mcp_result.content[0], "text"):
+            return mcp_result.content[0].text
+        return str(mcp_result.content)
+
+    async def generate_from_pdf_path(self, pdf_path: str, start_page: int = 1, end_page: int = -1, pdf_sha256: Optional[str] = None, mode: Optional[str] = None) -> Tuple[List[CardCreate], str]:
+        """Generate cards from a PDF already on disk. The caller owns the file."""
+        mode = mode or GENERATION_MODE
+        if mode not in GENERATION_MODES:
+            raise ValueError(f"Unknown generation mode: {mode}")
+        if mode == "chunked" or self.is_fake:
+            tool_args = {"pdf_path": pdf_path, "start_page": start_page, "end_page": end_page}
+            if pdf_sha256:
+                tool_args["pdf_sha256"] = pdf_sha256
+            extracted_text = await self._call_extract_tool(tool_args)
+            return await self.generate_from_text_chunked(extracted_text), extracted_text
+
+        extracted_text = ""
         
-        server_params = StdioServerParameters(
-            command="python", 
-            args=[mcp_server_path], 
-            env=None
+        try:
+            # The tool-bound model is built once per agent and reused across requests
+            model_with_tools = self.get_model(tools=(extract_text_from_pdf,))
+            
+            chat = model_with_tools.start_chat(enable_automatic_function_calling=False)
+            
+            prompt = f"""
+            I have uploaded a PDF document. 
+            Please create flashcards from it. 
+            The user requested pages {start_page} to {end_page if end_page != -1 else 'the end'}.
+            
+            Use the `extract_text_from_pdf` tool to get the content. 
+            You MUST pass the correct page range: start_page={start_page}, end_page={end_page}.
+            
+            After you get the text, generate a JSON list of flashcards with 'front' and 'back' keys.
+            Return ONLY the JSON array.
+            """
+            
+            response = await self.llm.run(chat.send_message, prompt)
+            
+            # Tool Execution Loop
+            while True:
+                # Check if response has parts and if the first part is a function call
+                # Add bounds checking to prevent IndexError
+                if (not response.candidates or 
+                    not response.candidates[0].content.parts):
+                    break
+                
+                part = response.candidates[0].content.parts[0]
+                # In Gemini SDK, text parts might not have function_call attribute or it's None
+                if not getattr(part, "function_call", None):
+                    break
+                    
+                call = part.function_call
+                if call.name == "extract_text_from_pdf":
+                    print(f"DEBUG: LLM requested tool call: {call.name} with args {call.args}")
+                    
+                    # Only the page range comes from the model. The file and its hash are ours:
+                    # a prompt-injected pdf_sha256 would read another document's cached pages
+                    model_args = dict(call.args)
+                    tool_args = {key: model_args[key] for key in _MODEL_TOOL_ARGS if key in model_args}
+                    tool_args["pdf_path"] = pdf_path
+                    if pdf_sha256:
+                        # Lets the extractor hit its page cache without re-hashing the file
+                        tool_args["pdf_sha256"] = pdf_sha256
+                    
+                    extracted_text = await self._call_extract_tool(tool_args)
+                        
+                    print(f"DEBUG: Tool execution complete. Extracted text length: {len(extracted_text)}")
+                    
+                    # Feed the result back to Gemini
+                    response = await self.llm.run(
+                        chat.send_message,
+                        {
+                            "parts": [
+                                {
+                                    "function_response": {
+                                        "name": call.name,
+                                        "response": {"result": extracted_text}
+                                    }
+                                }
+                            ]
+                        }
+                    )
+                else:
+                    print(f"DEBUG: LLM requested unknown tool: {call.name}")
+                    break
+            
+            # Final response handling - use robust JSON extraction
+            try:
+                return parse_cards(response.text), extracted_text
+            except Exception as e:
+                print(f"DEBUG: Failed to parse LLM response: {response.text}")
+                import traceback
+                traceback.print_exc()
+                raise e
+            
+        except Exception as e:
+            print(f"DEBUG: AI Error: {e}")
+            import traceback
+            traceback.print_exc()
+            raise e
+
+    async def _generate_chunk(self, chunk: str, semaphore: asyncio.Semaphore) -> List[CardCreate]:
+        prompt = f"""
+        Create flashcards from the following excerpt of a PDF document.
+        Cover the key facts and concepts of this excerpt only.
+
+        Return ONLY a JSON array of objects with 'front' and 'back' keys.
+
+        TEXT:
+        {chunk}
+        """
+        async with semaphore:
+            response = await self.llm.run(self.model.generate_content, prompt)
+        return parse_cards(response.text)
+
+    async def generate_from_text_chunked(self, text: str, max_chars: int = GENERATION_CHUNK_CHARS, max_concurrency: int = GENERATION_MAX_CONCURRENCY) -> List[CardCreate]:
+        """Map-reduce generation: cards per page-aligned chunk, generated concurrently, then merged."""
+        chunks = split_text_into_chunks(text, max_chars)
+        if not chunks:
+            return []
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        results = await asyncio.gather(
+            *(self._generate_chunk(chunk, semaphore) for chunk in chunks),
+            return_exceptions=True
         )
-        
+
+        card_lists = []
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"DEBUG: Chunk generation failed: {result}")
+                continue
+            card_lists.append(result)
+        if not card_lists:
+            # Every chunk failed; surface the first error
+            raise results[0]
+
+        print(f"DEBUG: Chunked generation: {len(chunks)} chunks, {len(card_lists)} succeeded")
+        return merge_cards(card_lists)
+
+    async def stream_from_pdf_path(self, pdf_path: str, start_page: int = 1, end_page: int = -1, pdf_sha256: Optional[str] = None, batch_pages: int = STREAM_EXTRACT_BATCH_PAGES) -> AsyncIterator[dict]:
+        """Stream generation as events: extraction progress, then each card as soon as it is parsed.
+
+        Yields dicts with a "type" of "progress", "card" or "done".
+        """
+        base_args = {"pdf_path": pdf_path}
+        if pdf_sha256:
+            base_args["pdf_sha256"] = pdf_sha256
+
+        page_count = await self._call_tool("count_pdf_pages", base_args)
+        if not page_count.isdigit():
+            raise ValueError(page_count)
+        first = max(1, start_page)
+        last = int(page_count) if end_page == -1 else min(end_page, int(page_count))
+        total = max(0, last - first + 1)
+        yield {"type": "progress", "stage": "extracting", "pages_done": 0, "total_pages": total}
+
+        # Extract in batches so the client sees page progress before the model starts
+        texts = []
+        for batch_start in range(first, last + 1, batch_pages):
+            batch_end = min(batch_start + batch_pages - 1, last)
+            text = await self._call_extract_tool({**base_args, "start_page": batch_start, "end_page": batch_end})
+            if text:
+                texts.append(text)
+            yield {"type": "progress", "stage": "extracting", "pages_done": batch_end - first + 1, "total_pages": total}
+        extracted_text = "\n\n".join(texts)
+
+        yield {"type": "progress", "stage": "generating"}
+        prompt = f"""
+        Create flashcards from the following text extracted from a PDF document.
+
+        Return ONLY a JSON array of objects with 'front' and 'back' keys.
+
+        TEXT:
+        {extracted_text}
+        """
+        response = await self.llm.run(self.model.generate_content, prompt, stream=True)
+        chunks = iter(response)
+        parser = IncrementalCardParser()
+        seen = set()
+        count = 0
+        while True:
+            chunk = await self.llm.run(next, chunks, None)
+            if chunk is None:
+                break
+            try:
+                chunk_text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final safety/finish chunk)
+                continue
+            for card in parser.feed(chunk_text):
+                key = normalize_text(card.front)
+                if key in seen:
+                    continue
+                seen.add(key)
+                count += 1
+                yield {"type": "card", "card": card.model_dump(include={"front", "back"})}
+
+        yield {"type": "done", "card_count": count, "source_text": extracted_text}
+
+    async def generate_from_pdf(self, pdf_content: bytes, start_page: int = 1, end_page: int = -1) -> Tuple[List[CardCreate], str]:
         # Save PDF to a temporary file for the MCP server to read
         # Using a temporary file is more efficient than passing large base64 strings
         temp_pdf_path = None  # Initialize to None for safer cleanup
@@ -60,125 +450,10 @@ class FlashcardAgent:
             print(f"DEBUG: Failed to create temp file: {e}")
             raise
         
-        extracted_text = ""
-        
         try:
-            # 1. Start MCP Session
-            async with stdio_client(server_params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    
-                    # Fetch available tools from MCP server to inform Gemini
-                    # For simplicity in this implementation, we define the tool interface manually
-                    # but it maps directly to the mcp_server.py 'extract_text_from_pdf' tool.
-                    
-                    # Note: We define this local function to provide Gemini with the tool signature.
-                    # The actual implementation is handled in the execution loop below.
-                    def extract_text_from_pdf(start_page: int, end_page: int) -> str:
-                        """
-                        Extracts text from the uploaded PDF for the given page range.
-                        
-                        Args:
-                            start_page: The starting page number (1-indexed).
-                            end_page: The ending page number (1-indexed). Use -1 for the end of the document.
-                        """
-                        return f"Extracting text from pages {start_page} to {end_page}..."
-
-                    # Temporarily update model with tools for this session
-                    model_with_tools = genai.GenerativeModel(
-                        model_name=self.model_name,
-                        tools=[extract_text_from_pdf]
-                    )
-                    
-                    chat = model_with_tools.start_chat(enable_automatic_function_calling=False)
-                    
-                    prompt = f"""
-                    I have uploaded a PDF document. 
-                    Please create flashcards from it. 
-                    The user requested pages {start_page} to {end_page if end_page != -1 else 'the end'}.
-                    
-                    Use the `extract_text_from_pdf` tool to get the content. 
-                    You MUST pass the correct page range: start_page={start_page}, end_page={end_page}.
-                    
-                    After you get the text, generate a JSON list of flashcards with 'front' and 'back' keys.
-                    Return ONLY the JSON array.
-                    """
-                    
-                    response = chat.send_message(prompt)
-                    
-                    # Tool Execution Loop
-                    while True:
-                        # Check if response has parts and if the first part is a function call
-                        # Add bounds checking to prevent IndexError
-                        if (not response.candidates or 
-                            not response.candidates[0].content.parts):
-                            break
-                        
-                        part = response.candidates[0].content.parts[0]
-                        # In Gemini SDK, text parts might not have function_call attribute or it's None
-                        if not getattr(part, "function_call", None):
-                            break
-                            
-                        call = part.function_call
-                        if call.name == "extract_text_from_pdf":
-                            print(f"DEBUG: LLM requested tool call: {call.name} with args {call.args}")
-                            
-                            # Safely convert args to dict
-                            try:
-                                tool_args = {k: v for k, v in call.args.items()}
-                            except AttributeError:
-                                # Fallback if items() is not available
-                                tool_args = dict(call.args)
-                                
-                            tool_args["pdf_path"] = temp_pdf_path
-                            
-                            mcp_result = await session.call_tool("extract_text_from_pdf", arguments=tool_args)
-                            
-                            if mcp_result.content and hasattr(mcp_result.content[0], "text"):
-                                extracted_text = mcp_result.content[0].text
-                            else:
-                                extracted_text = str(mcp_result.content)
-                                
-                            print(f"DEBUG: Tool execution complete. Extracted text length: {len(extracted_text)}")
-                            
-                            # Feed the result back to Gemini
-                            response = chat.send_message(
-                                {
-                                    "parts": [
-                                        {
-                                            "function_response": {
-                                                "name": call.name,
-                                                "response": {"result": extracted_text}
-                                            }
-                                        }
-                                    ]
-                                }
-                            )
-                        else:
-                            print(f"DEBUG: LLM requested unknown tool: {call.name}")
-                            break
-                    
-                    # Final response handling - use robust JSON extraction
-                    cleaned_response = extract_json_from_response(response.text)
-                        
-                    try:
-                        cards_data = json.loads(cleaned_response)
-                        valid_cards = []
-                        for item in cards_data:
-                            if 'front' in item and 'back' in item:
-                                valid_cards.append(CardCreate(front=str(item['front']), back=str(item['back'])))
-                        return valid_cards, extracted_text
-                    except Exception as e:
-                        print(f"DEBUG: Failed to parse LLM response: {cleaned_response}")
-                        import traceback
-                        traceback.print_exc()
-                        raise e
-                
-        except Exception as e:
-            print(f"DEBUG: AI Error: {e}")
-            import traceback
-            traceback.print_exc()
-            raise e
+            return await self.generate_from_pdf_path(
+                temp_pdf_path, start_page=start_page, end_page=end_page, pdf_sha256=sha256_bytes(pdf_content)
+            )
         finally:
             # Clean up the temporary file - improved cleanup logic
             if temp_pdf_path is not None:
@@ -191,7 +466,17 @@ class FlashcardAgent:
 
     async def refine_flashcards(self, current_cards: List[CardCreate], source_text: str, feedback: str) -> List[CardCreate]:
         # Serialize current cards to JSON for the prompt
-        cards_json = json.dumps([c.model_dump() for c in current_cards])
+        card_dicts = [c.model_dump() for c in current_cards]
+        cards_json = json.dumps(card_dicts)
+
+        # Identical resubmissions are answered from the cache without a model call
+        cache_key = None
+        if self.refine_cache is not None:
+            cache_key = refine_cache_key(self.model_name, card_dicts, source_text, feedback)
+            # The cache may read its SQLite tier; keep that off the event loop
+            cached = await run_in_threadpool(self.refine_cache.get, cache_key)
+            if cached is not None:
+                return [CardCreate(**card) for card in cached]
         
         system_instruction = f"""
         You are a helpful assistant assisting a student with flashcards.
@@ -213,19 +498,16 @@ class FlashcardAgent:
         """
         
         try:
-            response = self.model.generate_content(system_instruction)
+            response = await self.llm.run(self.model.generate_content, system_instruction)
             
             # Use robust JSON extraction
-            cleaned_response = extract_json_from_response(response.text)
-                
-            cards_data = json.loads(cleaned_response)
-            
-            valid_cards = []
-            for item in cards_data:
-                if 'front' in item and 'back' in item:
-                    valid_cards.append(CardCreate(front=str(item['front']), back=str(item['back'])))
-                    
-            return valid_cards
+            cards = parse_cards(response.text)
+            if cache_key is not None and cards:
+                tokens = getattr(getattr(response, "usage_metadata", None), "total_token_count", None)
+                if not isinstance(tokens, int):
+                    tokens = estimate_tokens(system_instruction + response.text)
+                await run_in_threadpool(self.refine_cache.put, cache_key, [c.model_dump() for c in cards], tokens=tokens)
+            return cards
             
         except Exception as e:
             print(f"DEBUG: AI Refine Error: {e}")
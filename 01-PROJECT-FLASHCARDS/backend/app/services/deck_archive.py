@@ -0,0 +1,194 @@
+"""Deck export/import format: newline-delimited JSON, optionally gzip-compressed.
+
+The first line describes the deck and every following line is one card::
+
+    {"type": "deck", "version": 1, "name": "Biology", "description": null, "notes": "", "tags": ["science"]}
+    {"type": "card", "front": "What is ATP?", "back": "The cell's energy carrier", "status": "NEW"}
+
+Both directions work on a stream of chunks, so memory use does not grow with
+the size of the deck. Uploads are spooled to a temporary file first, so they
+can be checked in full before anything is written to the database.
+"""
+import json
+import os
+import tempfile
+import zlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Tuple
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from app.models import CardCreate, DeckArchiveHeader, DeckRead
+
+load_dotenv()
+
+ARCHIVE_VERSION = 1
+# Cards per database round trip, in both directions
+ARCHIVE_BATCH_SIZE = 1000
+# Longest accepted line; a card is a few KB at most
+MAX_ARCHIVE_LINE_BYTES = 1024 * 1024
+# Largest request body accepted by /decks/import, compressed or not
+MAX_ARCHIVE_BYTES = int(os.getenv("MAX_ARCHIVE_BYTES", str(256 * 1024 * 1024)))
+GZIP_MAGIC = b"\x1f\x8b"
+_READ_SIZE = 64 * 1024
+
+
+class ArchiveError(ValueError):
+    """Raised when an uploaded archive is malformed."""
+
+
+class ArchiveTooLargeError(ArchiveError):
+    """Raised when an uploaded archive exceeds MAX_ARCHIVE_BYTES."""
+
+
+def deck_line(deck: DeckRead) -> str:
+    return json.dumps({
+        "type": "deck",
+        "version": ARCHIVE_VERSION,
+        "name": deck.name,
+        "description": deck.description,
+        "notes": deck.notes,
+        "tags": [tag.name for tag in deck.tags],
+    }, ensure_ascii=False) + "\n"
+
+
+def card_lines(rows: Iterable) -> str:
+    """Lines for rows of (front, back, status)."""
+    return "".join(
+        json.dumps({"type": "card", "front": front, "back": back, "status": status}, ensure_ascii=False) + "\n"
+        for front, back, status in rows
+    )
+
+
+async def gzip_chunks(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@asynccontextmanager
+async def spool_archive(chunks: AsyncIterator[bytes], max_bytes: int = MAX_ARCHIVE_BYTES):
+    """Copy an uploaded body to a temporary file, yield its path and delete it on exit."""
+    fd, path = tempfile.mkstemp(suffix=".ndjson")
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as out:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ArchiveTooLargeError(f"Archive exceeds {max_bytes} bytes")
+                await run_in_threadpool(out.write, chunk)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def file_chunks(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as source:
+        while chunk := await run_in_threadpool(source.read, _READ_SIZE):
+            yield chunk
+
+
+async def _decompressed(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pass plain bodies through and inflate gzip ones, recognised by their magic bytes."""
+    decompressor = None
+    first = True
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        if first:
+            first = False
+            if chunk.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(wbits=31)
+        if decompressor is None:
+            yield chunk
+            continue
+        try:
+            # Inflate in bounded pieces so a tiny, highly compressed body cannot expand all at once
+            data = decompressor.decompress(chunk, _READ_SIZE)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, _READ_SIZE)
+        except zlib.error:
+            raise ArchiveError("Invalid gzip data")
+    if decompressor is not None and not decompressor.eof:
+        raise ArchiveError("Truncated gzip data")
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, dict]]:
+    """Decoded JSON objects with their line numbers, skipping blank lines."""
+    buffer = b""
+    number = 0
+    async for data in _decompressed(chunks):
+        buffer += data
+        *complete, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_ARCHIVE_LINE_BYTES:
+            raise ArchiveError(f"Line {number + len(complete) + 1} is too long")
+        for line in complete:
+            number += 1
+            if line.strip():
+                yield number, _decode(number, line)
+    if buffer.strip():
+        yield number + 1, _decode(number + 1, buffer)
+
+
+def _decode(number: int, line: bytes) -> dict:
+    try:
+        value = json.loads(line)
+    except ValueError:
+        raise ArchiveError(f"Line {number} is not valid JSON")
+    if not isinstance(value, dict):
+        raise ArchiveError(f"Line {number} is not a JSON object")
+    return value
+
+
+async def _card_batches(lines: AsyncIterator[Tuple[int, dict]], batch_size: int) -> AsyncIterator[List[CardCreate]]:
+    batch = []
+    async for number, value in lines:
+        if value.pop("type", None) != "card":
+            raise ArchiveError(f"Line {number} is not a card")
+        try:
+            batch.append(CardCreate.model_validate(value))
+        except ValidationError:
+            raise ArchiveError(f"Line {number} is not a valid card")
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def read_archive(
+    chunks: AsyncIterator[bytes], batch_size: int = ARCHIVE_BATCH_SIZE
+) -> Tuple[DeckArchiveHeader, AsyncIterator[List[CardCreate]]]:
+    """Parse the deck line, then return it with an iterator over batches of cards.
+
+    Errors in the card lines surface while iterating, as ArchiveError.
+    """
+    lines = _lines(chunks)
+    try:
+        number, value = await anext(lines)
+    except StopAsyncIteration:
+        raise ArchiveError("The archive is empty")
+    if value.pop("type", None) != "deck":
+        raise ArchiveError("The archive must start with a deck line")
+    if value.pop("version", None) != ARCHIVE_VERSION:
+        raise ArchiveError(f"Unsupported archive version; expected {ARCHIVE_VERSION}")
+    try:
+        header = DeckArchiveHeader.model_validate(value)
+    except ValidationError:
+        raise ArchiveError(f"Line {number} is not a valid deck")
+    return header, _card_batches(lines, batch_size)
+
+
+async def check_archive(chunks: AsyncIterator[bytes]) -> None:
+    """Parse a whole archive without keeping it, raising ArchiveError at the first bad line."""
+    _, batches = await read_archive(chunks)
+    async for _ in batches:
+        pass
@@ -0,0 +1,192 @@
+"""Near-duplicate detection for flashcards with MinHash and locality-sensitive hashing.
+
+Each side of a card is normalized, cut into overlapping character shingles and
+summarized as a MinHash signature, whose slots agree between two texts about
+as often as their shingle sets overlap (Jaccard similarity). A card's
+signature is its front's followed by its back's, so its similarity to another
+card is the average over both sides: cards sharing a question template but
+with different answers ("symbol for gold?" / "symbol for silver?") stay
+apart.
+
+Signatures are split into bands and indexed by band, so a lookup only
+compares the new card with cards sharing at least one band instead of with
+every card in the deck. Each band takes half its slots from the front and half
+from the back, so cards only meet in a bucket when both sides agree: a deck
+full of "Yes" or "True" answers does not pile into shared back-only buckets.
+Buckets are also capped, which bounds the work per lookup even for decks built
+from one question template. Candidates are then confirmed by the similarity
+their signatures estimate.
+
+Signatures use one-permutation hashing: a single hash per shingle, with the
+hash range split into one bin per slot. That keeps the work per card linear
+in its length, which matters in pure Python for decks of tens of thousands of
+cards.
+"""
+import os
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+from app.models import CardCreate
+
+load_dotenv()
+
+# Estimated similarity at or above which two cards count as duplicates. Rephrased
+# questions with the same answer score about 0.8; "What does ATP stand for?" vs
+# "What does ADP stand for?", with their different answers, about 0.65.
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.75"))
+SHINGLE_SIZE = 4
+NUM_SLOTS = 64
+# 16 bands of 4 slots, 2 per side: a pair at 0.75 on both sides shares a band
+# with probability > 0.99, and at 0.3 (unrelated cards) with only 0.12
+BANDS = 16
+# Keys kept per bucket; later cards still go into their other, less crowded buckets
+MAX_BUCKET_SIZE = 32
+
+_HASH_MASK = (1 << 64) - 1
+_EMPTY = _HASH_MASK + 1
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, punctuation to spaces, whitespace collapsed."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def card_key(front: str, back: str) -> Tuple[str, str]:
+    return normalize_text(front), normalize_text(back)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _shingle_hash(shingle: str) -> int:
+    # CRC-32 is fast and stable across processes, unlike the built-in string hash
+    # (salted per process, which made the same pair a duplicate in one run and
+    # not the next). The multiply and shift spread it over all 64 bits.
+    value = (zlib.crc32(shingle.encode()) * 0x9E3779B97F4A7C15) & _HASH_MASK
+    return value ^ (value >> 31)
+
+
+def signature(text: str, num_slots: int = NUM_SLOTS) -> Tuple[int, ...]:
+    """One-permutation MinHash of the text's shingles."""
+    slots = [_EMPTY] * num_slots
+    for value in map(_shingle_hash, shingles(text)):
+        rest, slot = divmod(value & _HASH_MASK, num_slots)
+        if rest < slots[slot]:
+            slots[slot] = rest
+    # Short texts leave slots empty; each borrows from the next filled slot, wrapping
+    # around, offset by its distance (rotation densification). Two passes backwards
+    # cover the wrap; borrowed values are >= _EMPTY, so they are never lent on.
+    donor = None
+    for i in range(2 * num_slots - 1, -1, -1):
+        value = slots[i % num_slots]
+        if value < _EMPTY:
+            donor = i
+        elif value == _EMPTY and donor is not None:
+            slots[i % num_slots] = slots[donor % num_slots] + (donor - i) * _EMPTY
+    return tuple(slots)
+
+
+def card_signature(key: Tuple[str, str], num_slots: int = NUM_SLOTS) -> Tuple[int, ...]:
+    front, back = key
+    half = num_slots // 2
+    return signature(front, half) + signature(back, num_slots - half)
+
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class NearDuplicateIndex:
+    """Signatures of known cards, banded for sub-linear duplicate lookups."""
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        num_slots: int = NUM_SLOTS,
+        bands: int = BANDS,
+        max_bucket_size: int = MAX_BUCKET_SIZE,
+    ):
+        if num_slots % (2 * bands):
+            raise ValueError("num_slots must be a multiple of 2 * bands (each band takes slots from both sides)")
+        self.threshold = threshold
+        self.num_slots = num_slots
+        self.bands = bands
+        self.max_bucket_size = max_bucket_size
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[Hashable]] = defaultdict(list)
+        self._signatures: Dict[Hashable, Tuple[int, ...]] = {}
+        self._exact: Dict[Tuple[str, str], Hashable] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _bands(self, sig: Tuple[int, ...]) -> list:
+        # The front fills the first half of the signature and the back the second
+        half = self.num_slots // 2
+        step = half // self.bands
+        return [
+            (band, sig[start:start + step] + sig[half + start:half + start + step])
+            for band, start in enumerate(range(0, half, step))
+        ]
+
+    def _match(self, text: Tuple[str, str], sig: Tuple[int, ...]) -> Optional[Hashable]:
+        if text in self._exact:
+            return self._exact[text]
+        best, best_score = None, self.threshold
+        seen = set()
+        for band_key in self._bands(sig):
+            for key in self._buckets.get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                score = similarity(sig, self._signatures[key])
+                if score >= best_score:
+                    best, best_score = key, score
+        return best
+
+    def _insert(self, key: Hashable, text: Tuple[str, str], sig: Tuple[int, ...]):
+        self._signatures[key] = sig
+        self._exact.setdefault(text, key)
+        for band_key in self._bands(sig):
+            bucket = self._buckets[band_key]
+            if len(bucket) < self.max_bucket_size:
+                bucket.append(key)
+
+    def add(self, key: Hashable, front: str, back: str):
+        text = card_key(front, back)
+        self._insert(key, text, card_signature(text, self.num_slots))
+
+    def find(self, front: str, back: str) -> Optional[Hashable]:
+        """The key of the closest known card at or above the threshold, if any."""
+        text = card_key(front, back)
+        return self._match(text, card_signature(text, self.num_slots))
+
+    def add_if_new(self, key: Hashable, front: str, back: str) -> Optional[Hashable]:
+        """Add the card unless it duplicates a known one; returns that one's key if so."""
+        text = card_key(front, back)
+        sig = card_signature(text, self.num_slots)
+        match = self._match(text, sig)
+        if match is None:
+            self._insert(key, text, sig)
+        return match
+
+    def add_rows(self, rows: Iterable[Tuple[str, str]]):
+        """Index existing (front, back) rows, e.g. a deck's cards streamed in batches."""
+        for front, back in rows:
+            self.add(("existing", len(self._signatures)), front, back)
+
+    def drop_duplicates(self, cards: Iterable[CardCreate]) -> Tuple[List[CardCreate], int]:
+        """Cards that duplicate neither an indexed card nor an earlier card in ``cards``, and the number dropped."""
+        kept, dropped = [], 0
+        for card in cards:
+            if self.add_if_new(("new", len(self._signatures)), card.front, card.back) is None:
+                kept.append(card)
+            else:
+                dropped += 1
+        return kept, dropped
+
@@ -0,0 +1,63 @@
+import json
+import re
+import threading
+import time
+
+# Setting GEMINI_MODEL to this name runs the agent against FakeGenerativeModel
+FAKE_MODEL_NAME = "local-fake"
+
+_PAGE_SECTION = re.compile(r"--- Page (\d+) ---\n(.*?)(?=\n--- Page \d+ ---|\Z)", re.DOTALL)
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.candidates = []
+
+
+class FakeGenerativeModel:
+    """Offline stand-in for ``genai.GenerativeModel`` for tests and local development.
+
+    It returns one card per ``--- Page N ---`` section found in the prompt, built
+    from the first line of that page, so identical pages yield identical cards.
+    ``delay`` simulates model latency, and the peak number of overlapping calls
+    is recorded in ``max_active``.
+    """
+
+    def __init__(self, model_name: str = FAKE_MODEL_NAME, delay: float = 0.0):
+        self.model_name = model_name
+        self.delay = delay
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        if stream:
+            # Mimic the SDK's streamed response: an iterable of small text chunks
+            text = self._respond(prompt).text
+            return [FakeResponse(text[i:i + 16]) for i in range(0, len(text), 16)]
+        return self._respond(prompt)
+
+    def _respond(self, prompt: str) -> FakeResponse:
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            return FakeResponse(json.dumps(self._cards_for(prompt)))
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def _cards_for(self, prompt: str) -> list:
+        cards = []
+        for _, body in _PAGE_SECTION.findall(prompt):
+            lines = [line.strip() for line in body.splitlines() if line.strip()]
+            if not lines:
+                continue
+            topic = " ".join(lines[0].split()[:5])
+            cards.append({"front": f"What does the text say about {topic}?", "back": lines[0][:200]})
+        return cards
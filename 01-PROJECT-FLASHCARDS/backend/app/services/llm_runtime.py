@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bound on Gemini calls in flight across the whole worker process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "120"))
+
+
+class LLMTimeoutError(Exception):
+    """Raised when a model call does not finish within its timeout."""
+
+
+class LLMExecutor:
+    """Runs blocking Gemini SDK calls on a dedicated, bounded thread pool.
+
+    The SDK's calls are synchronous network round trips. Making them directly
+    from an ``async def`` handler would stall the event loop, and every other
+    request with it. This pool is separate from FastAPI's threadpool, so slow
+    generations cannot starve CRUD handlers either. Calls beyond
+    ``max_concurrency`` wait in the queue, and the timeout covers that wait too.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_CALL_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.timeouts = 0
+
+    def _tracked(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(self._tracked, fn, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout if timeout is not None else self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError(f"Model call timed out after {timeout or self.timeout}s")
+
+    def stats(self) -> dict:
+        return {"max_concurrency": self.max_concurrency, "in_flight": self.in_flight, "timeouts": self.timeouts}
+
+
+llm_executor = LLMExecutor()
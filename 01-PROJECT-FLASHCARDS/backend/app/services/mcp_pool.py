@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from dotenv import load_dotenv
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+load_dotenv()
+
+# Pool settings. A size of 0 disables the pool and every generation spawns its own server.
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "2"))
+MCP_POOL_CHECKOUT_TIMEOUT = float(os.getenv("MCP_POOL_CHECKOUT_TIMEOUT", "30"))
+MCP_POOL_STARTUP_TIMEOUT = float(os.getenv("MCP_POOL_STARTUP_TIMEOUT", "30"))
+MCP_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_POOL_HEALTH_CHECK_INTERVAL", "60"))
+MCP_POOL_PING_TIMEOUT = 5.0
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MCP_SERVER_PATH = os.path.join(BACKEND_DIR, "mcp_server.py")
+
+
+def mcp_server_params() -> StdioServerParameters:
+    """Parameters for launching the PDF extraction MCP server over stdio."""
+    return StdioServerParameters(command="python", args=[MCP_SERVER_PATH], env=None)
+
+
+class MCPPoolTimeoutError(Exception):
+    """Raised when no MCP session becomes free within the checkout timeout."""
+
+
+class PooledConnection:
+    """A single MCP server subprocess with an initialized ClientSession.
+
+    stdio_client and ClientSession run anyio task groups that must be entered and
+    exited from the same task, so each connection is owned by a background task
+    that stays inside both contexts until the connection is closed.
+    """
+
+    def __init__(self, server_params: StdioServerParameters):
+        self.server_params = server_params
+        self.session: Optional[ClientSession] = None
+        self.last_used = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._error: Optional[BaseException] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def start(self, timeout: float = MCP_POOL_STARTUP_TIMEOUT):
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error = None
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise
+        if self._error is not None:
+            raise self._error
+        self.last_used = time.monotonic()
+
+    async def _run(self):
+        try:
+            async with stdio_client(self.server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._stop.wait()
+        except Exception as e:
+            self._error = e
+            print(f"DEBUG: MCP connection terminated: {e}")
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def ping(self, timeout: float = MCP_POOL_PING_TIMEOUT) -> bool:
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout)
+            return True
+        except Exception as e:
+            print(f"DEBUG: MCP health check failed: {e}")
+            return False
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), MCP_POOL_PING_TIMEOUT)
+        except Exception:
+            self._task.cancel()
+        self._task = None
+        self.session = None
+
+
+class MCPSessionPool:
+    """Bounded pool of warm MCP sessions to the PDF extraction server.
+
+    Sessions are checked out with ``async with pool.session() as session``. A
+    checkout waits at most ``checkout_timeout`` seconds, which also caps the
+    number of concurrent extractions at ``size``. Dead or unresponsive
+    connections are restarted transparently on checkout.
+    """
+
+    def __init__(
+        self,
+        size: int = MCP_POOL_SIZE,
+        checkout_timeout: float = MCP_POOL_CHECKOUT_TIMEOUT,
+        health_check_interval: float = MCP_POOL_HEALTH_CHECK_INTERVAL,
+        server_params: Optional[StdioServerParameters] = None,
+    ):
+        if size < 1:
+            raise ValueError("MCP pool size must be at least 1")
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.server_params = server_params or mcp_server_params()
+        self._connections: List[PooledConnection] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self.restarts = 0
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+
+    async def start(self):
+        self._idle = asyncio.Queue()
+        self._connections = [PooledConnection(self.server_params) for _ in range(self.size)]
+        results = await asyncio.gather(*(conn.start() for conn in self._connections), return_exceptions=True)
+        for conn, result in zip(self._connections, results):
+            if isinstance(result, BaseException):
+                # Keep the slot; it is restarted on its first checkout.
+                print(f"DEBUG: MCP pool connection failed to start: {result}")
+            self._idle.put_nowait(conn)
+        print(f"DEBUG: MCP pool started with {sum(c.alive for c in self._connections)}/{self.size} live sessions")
+
+    async def close(self):
+        await asyncio.gather(*(conn.close() for conn in self._connections), return_exceptions=True)
+        self._connections = []
+        self._idle = None
+
+    async def _ensure_healthy(self, conn: PooledConnection):
+        idle_for = time.monotonic() - conn.last_used
+        if conn.alive and (idle_for < self.health_check_interval or await conn.ping()):
+            return
+        print("DEBUG: Restarting MCP pool connection")
+        self.restarts += 1
+        await conn.close()
+        await conn.start()
+
+    @asynccontextmanager
+    async def session(self):
+        if self._idle is None:
+            raise RuntimeError("MCP pool is not started")
+        try:
+            conn = await asyncio.wait_for(self._idle.get(), self.checkout_timeout)
+        except asyncio.TimeoutError:
+            self.checkout_timeouts += 1
+            raise MCPPoolTimeoutError(f"No MCP session available after {self.checkout_timeout}s")
+
+        self.checkouts += 1
+        try:
+            await self._ensure_healthy(conn)
+            yield conn.session
+        finally:
+            conn.last_used = time.monotonic()
+            if self._idle is not None:
+                self._idle.put_nowait(conn)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "live": sum(conn.alive for conn in self._connections),
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.checkout_timeouts,
+            "restarts": self.restarts,
+        }
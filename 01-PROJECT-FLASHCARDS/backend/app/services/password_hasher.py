@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+
+load_dotenv()
+
+# bcrypt cost factor. Each +1 doubles the CPU time of a hash; stored hashes
+# with a different cost are rehashed on the user's next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Worker processes for hashing. 0 runs bcrypt on the threadpool instead.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+
+@functools.lru_cache(maxsize=None)
+def make_context(rounds: int) -> CryptContext:
+    """A bcrypt context that hashes at ``rounds`` and flags any other cost for update."""
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+def hash_password(password: str, rounds: int) -> str:
+    return make_context(rounds).hash(password)
+
+
+def verify_and_update(password: str, hashed_password: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    """Check a password; on success also return a new hash if the stored cost is outdated."""
+    return make_context(rounds).verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded pool of worker processes.
+
+    bcrypt holds a CPU core for hundreds of milliseconds per call. On the
+    threadpool, a burst of logins occupies the threads (and cores) that serve
+    CRUD requests. Separate processes keep that cost out of the API worker;
+    ``workers`` caps how many hashes run at once and the rest queue. If the
+    pool breaks, calls fall back to the threadpool.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = PASSWORD_HASH_WORKERS):
+        self.rounds = rounds
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.rehashes = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    async def _run(self, fn, *args):
+        if self.workers > 0:
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._get_executor(), fn, *args)
+            except BrokenProcessPool as e:
+                print(f"DEBUG: Password hashing pool failed, falling back to threads: {e}")
+                self.shutdown()
+        return await run_in_threadpool(fn, *args)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Returns ``(valid, new_hash)``; ``new_hash`` is set when the stored hash should be replaced."""
+        valid, new_hash = await self._run(verify_and_update, password, hashed_password, self.rounds)
+        if new_hash is not None:
+            self.rehashes += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {"rounds": self.rounds, "workers": self.workers, "rehashes": self.rehashes}
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PDF_CACHE_PATH = os.getenv("PDF_CACHE_PATH", os.path.join(BACKEND_DIR, ".cache", "pdf_pages.db"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# SQLite limits the number of bound parameters per statement
+_IN_CLAUSE_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    sha256 TEXT PRIMARY KEY,
+    page_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    sha256 TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (sha256, page)
+);
+CREATE INDEX IF NOT EXISTS ix_pages_last_access ON pages (last_access);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES
+    ('hits', 0), ('misses', 0), ('evictions', 0), ('total_bytes', 0);
+CREATE TRIGGER IF NOT EXISTS pages_size_insert AFTER INSERT ON pages BEGIN
+    UPDATE counters SET value = value + NEW.size WHERE name = 'total_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS pages_size_delete AFTER DELETE ON pages BEGIN
+    UPDATE counters SET value = value - OLD.size WHERE name = 'total_bytes';
+END;
+"""
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PageTextCache:
+    """On-disk cache of extracted PDF page text keyed by (SHA-256 of the PDF, page index).
+
+    Entries are evicted least-recently-used first once the stored text exceeds
+    ``max_bytes``. The store is a SQLite file so several MCP server processes can
+    share it, and hit/miss counters are kept in the same file for the same reason.
+    Cache failures are logged and treated as misses; they never fail an extraction.
+    """
+
+    def __init__(self, path: str = PDF_CACHE_PATH, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _bump(self, name: str, amount: int):
+        if amount:
+            self._conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def get_page_count(self, sha256: str) -> Optional[int]:
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT page_count FROM documents WHERE sha256 = ?", (sha256,)).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"DEBUG: PDF cache read failed: {e}")
+            return None
+
+    def set_page_count(self, sha256: str, page_count: int):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (sha256, page_count) VALUES (?, ?)", (sha256, page_count)
+                )
+        except sqlite3.Error as e:
+            print(f"DEBUG: PDF cache write failed: {e}")
+
+    def get_pages(self, sha256: str, pages: Iterable[int]) -> Dict[int, str]:
+        """Return cached text for the requested 0-based page indices that are present."""
+        pages = list(pages)
+        found: Dict[int, str] = {}
+        with self._lock:
+            try:
+                now = time.time()
+                self._conn.execute("BEGIN")
+                for i in range(0, len(pages), _IN_CLAUSE_BATCH):
+                    batch = pages[i:i + _IN_CLAUSE_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        f"SELECT page, text FROM pages WHERE sha256 = ? AND page IN ({placeholders})",
+                        (sha256, *batch),
+                    ).fetchall()
+                    found.update(rows)
+                    self._conn.execute(
+                        f"UPDATE pages SET last_access = ? WHERE sha256 = ? AND page IN ({placeholders})",
+                        (now, sha256, *batch),
+                    )
+                self._bump("hits", len(found))
+                self._bump("misses", len(pages) - len(found))
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"DEBUG: PDF cache read failed: {e}")
+                self._rollback()
+                return {}
+        return found
+
+    def put_pages(self, sha256: str, texts: Dict[int, str]):
+        if not texts:
+            return
+        with self._lock:
+            try:
+                now = time.time()
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO pages (sha256, page, text, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                    [(sha256, page, text, len(text.encode("utf-8")), now) for page, text in texts.items()],
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"DEBUG: PDF cache write failed: {e}")
+                self._rollback()
+
+    def _evict(self):
+        excess = self._counter("total_bytes") - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        for rowid, size in self._conn.execute("SELECT rowid, size FROM pages ORDER BY last_access, rowid"):
+            victims.append(rowid)
+            excess -= size
+            if excess <= 0:
+                break
+        for i in range(0, len(victims), _IN_CLAUSE_BATCH):
+            batch = victims[i:i + _IN_CLAUSE_BATCH]
+            self._conn.execute(f"DELETE FROM pages WHERE rowid IN ({','.join('?' * len(batch))})", batch)
+        self._bump("evictions", len(victims))
+        self._conn.execute("DELETE FROM documents WHERE sha256 NOT IN (SELECT sha256 FROM pages)")
+
+    def _counter(self, name: str) -> int:
+        return self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+    def _rollback(self):
+        try:
+            self._conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "hits": counters["hits"],
+            "misses": counters["misses"],
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+            "evictions": counters["evictions"],
+            "entries": entries,
+            "bytes": counters["total_bytes"],
+            "max_bytes": self.max_bytes,
+        }
+
+
+_page_cache: Optional[PageTextCache] = None
+
+
+def get_page_cache() -> Optional[PageTextCache]:
+    """Process-wide cache instance, or None when caching is disabled or unavailable."""
+    global _page_cache
+    if not PDF_CACHE_ENABLED:
+        return None
+    if _page_cache is None:
+        try:
+            _page_cache = PageTextCache()
+        except (sqlite3.Error, OSError) as e:
+            print(f"DEBUG: PDF cache unavailable: {e}")
+            return None
+    return _page_cache
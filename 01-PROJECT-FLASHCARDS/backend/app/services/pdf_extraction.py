@@ -0,0 +1,84 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+import pypdf
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Worker processes per extraction server. Ranges shorter than the minimum are
+# extracted serially since each worker has to open and parse the PDF itself.
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def extract_page_chunk(pdf_path: str, pages: List[int]) -> Dict[int, str]:
+    """Extract the given 0-based pages. Runs inside a worker, which opens the file by path."""
+    reader = pypdf.PdfReader(pdf_path)
+    return {i: reader.pages[i].extract_text() or "" for i in pages}
+
+
+def split_into_chunks(pages: List[int], chunks: int) -> List[List[int]]:
+    """Split pages into at most ``chunks`` contiguous, evenly sized runs."""
+    chunks = max(1, min(chunks, len(pages)))
+    size, remainder = divmod(len(pages), chunks)
+    result, start = [], 0
+    for i in range(chunks):
+        end = start + size + (1 if i < remainder else 0)
+        result.append(pages[start:end])
+        start = end
+    return result
+
+
+def extract_pages(
+    pages: List[int],
+    pdf_path: Optional[str] = None,
+    reader: Optional[pypdf.PdfReader] = None,
+    workers: int = PDF_EXTRACT_WORKERS,
+    min_parallel_pages: int = PDF_PARALLEL_MIN_PAGES,
+) -> Dict[int, str]:
+    """Extract text for 0-based page indices, in parallel when the range is large enough.
+
+    Parallel extraction needs ``pdf_path``; without it (e.g. base64 input) the
+    pages are read serially from ``reader``.
+    """
+    if pdf_path and workers > 1 and len(pages) >= min_parallel_pages:
+        chunks = split_into_chunks(pages, workers)
+        try:
+            executor = _get_executor(workers)
+            texts: Dict[int, str] = {}
+            for chunk_texts in executor.map(extract_page_chunk, [pdf_path] * len(chunks), chunks):
+                texts.update(chunk_texts)
+            return texts
+        except BrokenProcessPool as e:
+            print(f"DEBUG: PDF extraction pool failed, falling back to serial: {e}")
+            _reset_executor()
+
+    if reader is None:
+        reader = pypdf.PdfReader(pdf_path)
+    return {i: reader.pages[i].extract_text() or "" for i in pages}
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REFINE_CACHE_ENABLED = os.getenv("REFINE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+REFINE_CACHE_MAX_ENTRIES = int(os.getenv("REFINE_CACHE_MAX_ENTRIES", "256"))
+REFINE_CACHE_MAX_BYTES = int(os.getenv("REFINE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+REFINE_CACHE_TTL = float(os.getenv("REFINE_CACHE_TTL", "3600"))
+# Optional SQLite file shared by workers and kept across restarts; empty disables it
+REFINE_CACHE_DB_PATH = os.getenv("REFINE_CACHE_DB_PATH", "")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_responses_last_access ON responses (last_access);
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) when the SDK reports no usage."""
+    return max(1, len(text) // 4)
+
+
+def refine_cache_key(model_name: str, cards: List[dict], source_text: str, feedback: str) -> str:
+    """Stable hash of everything that determines a refine response."""
+    payload = json.dumps(
+        {"model": model_name, "cards": cards, "source_text": source_text, "feedback": feedback.strip()},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Bounded LRU cache with a TTL for model responses that are expensive to recompute.
+
+    Values are JSON-serialisable payloads stored alongside the number of tokens
+    the call consumed, so every hit adds that number to ``saved_tokens``. The
+    in-process tier is limited by ``max_entries`` and ``max_bytes``. When ``db_path``
+    is set, entries are also written to a SQLite file that is consulted on a
+    local miss, so results survive restarts and are shared between workers.
+    Failures in that tier are logged and treated as misses.
+
+    ``get`` and ``put`` block on the disk tier, so async callers run them on a
+    thread. The in-memory lock is never held across a disk call, so a busy
+    cache file does not hold up memory hits or ``stats``.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = REFINE_CACHE_MAX_ENTRIES,
+        max_bytes: int = REFINE_CACHE_MAX_BYTES,
+        ttl: float = REFINE_CACHE_TTL,
+        db_path: Optional[str] = REFINE_CACHE_DB_PATH or None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Serializes use of the SQLite connection, separately from the in-memory tier
+        self._disk_lock = threading.Lock()
+        # key -> (payload JSON, tokens, expires_at)
+        self._entries: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.saved_tokens = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        if db_path:
+            try:
+                if db_path != ":memory:":
+                    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+                self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+                if db_path != ":memory:":
+                    self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.executescript(_SCHEMA)
+            except (sqlite3.Error, OSError) as e:
+                print(f"DEBUG: Response cache disk tier unavailable: {e}")
+                self._conn = None
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= now:
+                self._remove(key)
+                entry = None
+        from_disk = False
+        if entry is None:
+            entry = self._disk_get(key, now)
+            from_disk = entry is not None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if from_disk:
+                self.disk_hits += 1
+                self._store(key, entry)
+            elif key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_tokens += entry[1]
+        return json.loads(entry[0])
+
+    def put(self, key: str, value, tokens: int = 0):
+        payload = json.dumps(value, ensure_ascii=False)
+        entry = (payload, tokens, time.time() + self.ttl)
+        with self._lock:
+            self._store(key, entry)
+        self._disk_put(key, entry)
+
+    def _store(self, key: str, entry: Tuple[str, int, float]):
+        if key in self._entries:
+            self._remove(key)
+        size = len(entry[0])
+        if size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        payload, _, _ = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[str, int, float]]:
+        if self._conn is None:
+            return None
+        try:
+            with self._disk_lock:
+                row = self._conn.execute(
+                    "SELECT payload, tokens, expires_at FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return tuple(row) if row else None
+        except sqlite3.Error as e:
+            print(f"DEBUG: Response cache read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, entry: Tuple[str, int, float]):
+        if self._conn is None:
+            return
+        with self._disk_lock:
+            try:
+                now = time.time()
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, payload, tokens, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, entry[0], entry[1], entry[2], now),
+                )
+                self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                # The disk tier keeps at most ten times as many entries as memory
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries * 10,),
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"DEBUG: Response cache write failed: {e}")
+                try:
+                    self._conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        with self._disk_lock:
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM responses")
+                except sqlite3.Error as e:
+                    print(f"DEBUG: Response cache clear failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "saved_tokens": self.saved_tokens,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "disk_tier": self._conn is not None,
+            }
+
+
+_refine_cache: Optional[ResponseCache] = None
+
+
+def get_refine_cache() -> Optional[ResponseCache]:
+    """Process-wide cache for refine responses, or None when disabled."""
+    global _refine_cache
+    if not REFINE_CACHE_ENABLED:
+        return None
+    if _refine_cache is None:
+        _refine_cache = ResponseCache()
+    return _refine_cache
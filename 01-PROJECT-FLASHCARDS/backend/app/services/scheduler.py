@@ -0,0 +1,45 @@
+import os
+from datetime import datetime, timedelta
+from typing import NamedTuple
+from dotenv import load_dotenv
+from app.models import CardStatus
+
+load_dotenv()
+
+# A card whose next review is at least this many days away counts as mastered
+MASTERED_INTERVAL_DAYS = int(os.getenv("MASTERED_INTERVAL_DAYS", "21"))
+MIN_EASE = 1.3
+# Lowest grade that counts as remembered
+PASSING_GRADE = 3
+
+
+class Schedule(NamedTuple):
+    due_at: datetime
+    interval_days: int
+    ease: float
+    repetitions: int
+    status: CardStatus
+
+
+def sm2(interval_days: int, ease: float, repetitions: int, grade: int, now: datetime) -> Schedule:
+    """The card's next schedule after a review graded 0-5 (SuperMemo 2).
+
+    A failed review starts the card over at a one-day interval. Passed reviews
+    go 1 day, then 6 days, then the previous interval times the ease. The ease
+    moves with every grade, and never drops below 1.3.
+    """
+    if grade < PASSING_GRADE:
+        repetitions = 0
+        interval_days = 1
+    else:
+        repetitions += 1
+        if repetitions == 1:
+            interval_days = 1
+        elif repetitions == 2:
+            interval_days = 6
+        else:
+            interval_days = max(1, round(interval_days * ease))
+    miss = 5 - grade
+    ease = max(MIN_EASE, ease + 0.1 - miss * (0.08 + miss * 0.02))
+    status = CardStatus.MASTERED if interval_days >= MASTERED_INTERVAL_DAYS else CardStatus.REVIEWING
+    return Schedule(now + timedelta(days=interval_days), interval_days, ease, repetitions, status)
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import tempfile
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Iterable, NamedTuple, Optional
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+
+load_dotenv()
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Room in a multipart body for the boundaries and the other form fields
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+class UploadSizeLimit:
+    """ASGI middleware capping the request body of the upload routes.
+
+    It runs before the multipart parser, which would otherwise receive the
+    whole body and spool it to disk before spool_upload could check its size.
+    A Content-Length over the limit is answered with 413 without reading the
+    body, and a body sent without one is cut off once it crosses the limit.
+    """
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: Optional[int] = None):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        limit = (self.max_bytes if self.max_bytes is not None else MAX_UPLOAD_BYTES) + FORM_OVERHEAD_BYTES
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            await JSONResponse({"detail": "PDF file is too large"}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the form parser, which lets HTTPException through
+                    raise HTTPException(status_code=413, detail="PDF file is too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class CleanupStreamingResponse(StreamingResponse):
+    """A StreamingResponse that closes ``cleanup`` when it ends, however it ends.
+
+    A finally block in the body generator never runs if the body is never
+    iterated (the client left, or sending the headers failed), and a
+    background task is skipped when sending raises.
+    """
+
+    def __init__(self, content, cleanup: AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cleanup.aclose()
+
+
+class SpooledUpload(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+
+
+@asynccontextmanager
+async def spool_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Stream an upload to a temporary file in fixed-size chunks.
+
+    The SHA-256 is computed while copying and the size limit is enforced as soon
+    as it is crossed, so at most one chunk is held in memory. Yields a
+    SpooledUpload and deletes the file on exit.
+    """
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        yield SpooledUpload(path=path, sha256=digest.hexdigest(), size=size)
+    finally:
+        try:
+            os.remove(path)
+        except OSError as cleanup_err:
+            print(f"DEBUG: Failed to cleanup spooled upload: {cleanup_err}")
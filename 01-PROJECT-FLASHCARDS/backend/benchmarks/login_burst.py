@@ -0,0 +1,95 @@
+"""CRUD latency during a burst of logins, with bcrypt on threads vs. worker processes.
+
+Run from the backend directory:
+
+    python -m benchmarks.login_burst --logins 40 --rounds 12 --workers 2
+
+A burst of concurrent ``POST /token`` requests is sent while one client keeps
+polling ``GET /decks/``. For each hashing mode the script prints how long the
+burst took and the median and p95 latency of the CRUD requests that ran during it.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from unittest.mock import patch
+
+import httpx
+from sqlmodel import Session, SQLModel
+
+from app.database import Database, build_engine
+from app.main import app, get_db
+from app.services.password_hasher import PasswordHasher
+
+
+async def run_burst(hasher: PasswordHasher, logins: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        SQLModel.metadata.create_all(engine)
+
+        def get_db_override():
+            with Session(engine) as session:
+                yield Database(session=session)
+
+        app.dependency_overrides[get_db] = get_db_override
+        try:
+            with patch("app.main.password_hasher", hasher):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                    await client.post("/register", json={"username": "bench", "password": "password"})
+                    token = (await client.post("/token", data={"username": "bench", "password": "password"})).json()["access_token"]
+                    headers = {"Authorization": f"Bearer {token}"}
+                    await client.post("/decks/", json={"name": "Bench Deck"}, headers=headers)
+
+                    latencies = []
+                    burst_done = asyncio.Event()
+
+                    async def poll_crud():
+                        while not burst_done.is_set():
+                            start = time.perf_counter()
+                            await client.get("/decks/", headers=headers)
+                            latencies.append(time.perf_counter() - start)
+
+                    async def login_burst():
+                        start = time.perf_counter()
+                        await asyncio.gather(*(
+                            client.post("/token", data={"username": "bench", "password": "password"})
+                            for _ in range(logins)
+                        ))
+                        burst_done.set()
+                        return time.perf_counter() - start
+
+                    burst_seconds, _ = await asyncio.gather(login_burst(), poll_crud())
+        finally:
+            app.dependency_overrides.clear()
+            hasher.shutdown()
+            engine.dispose()
+
+    return {
+        "burst_s": burst_seconds,
+        "crud_requests": len(latencies),
+        "crud_median_ms": statistics.median(latencies) * 1000,
+        "crud_p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else latencies[0] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"{args.logins} concurrent logins at bcrypt cost {args.rounds}")
+    for label, workers in (("threadpool", 0), (f"{args.workers} processes", args.workers)):
+        result = await run_burst(PasswordHasher(rounds=args.rounds, workers=workers), args.logins)
+        print(
+            f"{label:>12}: burst {result['burst_s']:5.2f}s  CRUD requests {result['crud_requests']:4d}  "
+            f"median {result['crud_median_ms']:7.1f} ms  p95 {result['crud_p95_ms']:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+"""Latency of GET /review/next's query on a large card table.
+
+Run from the backend directory:
+
+    python -m benchmarks.review_queue --cards 1000000 --users 100
+
+Fills a temporary SQLite database with cards spread over ``--users`` users
+with ten decks each and random due dates, then times the review queue query
+(crud.next_due_cards, served by ix_card_user_id_due_at) against the same
+query written as a join on deck.user_id, which is what it would take without
+card.user_id. The query plan of each is printed too.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+from sqlalchemy.dialects import sqlite
+from sqlmodel import Session, SQLModel, select
+
+from app import crud
+from app.database import build_engine
+from app.models import Card, CardStatus, Deck, User
+
+DECKS_PER_USER = 10
+INSERT_BATCH = 20000
+
+
+def populate(session: Session, cards: int, users: int, now: datetime):
+    session.exec(insert(User), params=[{"username": f"user{i}", "hashed_password": "x"} for i in range(users)])
+    session.exec(insert(Deck), params=[
+        {"name": f"Deck {i}", "user_id": i // DECKS_PER_USER + 1, "created_at": now, "notes": ""}
+        for i in range(users * DECKS_PER_USER)
+    ])
+    rng = random.Random(0)
+    for start in range(0, cards, INSERT_BATCH):
+        rows = []
+        for _ in range(min(INSERT_BATCH, cards - start)):
+            deck_id = rng.randrange(users * DECKS_PER_USER) + 1
+            rows.append({
+                "front": "Question", "back": "Answer", "status": CardStatus.REVIEWING,
+                "deck_id": deck_id, "user_id": (deck_id - 1) // DECKS_PER_USER + 1,
+                "due_at": now + timedelta(days=rng.uniform(-365, 365)),
+                "interval_days": 1, "ease": 2.5, "repetitions": 1, "created_at": now,
+            })
+        session.exec(insert(Card), params=rows)
+    session.commit()
+
+
+def joined_query(user_id: int, limit: int, now: datetime):
+    return (
+        select(Card).join(Deck).where(Deck.user_id == user_id, Card.due_at <= now)
+        .order_by(Card.due_at).limit(limit)
+    )
+
+
+def indexed_query(user_id: int, limit: int, now: datetime):
+    return (
+        select(Card).where(Card.user_id == user_id, Card.due_at <= now)
+        .order_by(Card.due_at).limit(limit)
+    )
+
+
+def query_plan(session: Session, statement) -> str:
+    compiled = statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+    return "; ".join(str(row[-1]) for row in session.exec(text(f"EXPLAIN QUERY PLAN {compiled}")))
+
+
+def time_queries(session: Session, run, users: int, repeats: int) -> dict:
+    rng = random.Random(1)
+    latencies = []
+    for _ in range(repeats):
+        user_id = rng.randrange(users) + 1
+        start = time.perf_counter()
+        run(user_id)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "median_ms": statistics.median(latencies) * 1000,
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    now = datetime.utcnow()
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            start = time.perf_counter()
+            populate(session, args.cards, args.users, now)
+            print(f"{args.cards} cards for {args.users} users loaded in {time.perf_counter() - start:.1f}s")
+
+            profiles = {
+                "join": lambda user_id: session.exec(joined_query(user_id, args.limit, now)).all(),
+                "indexed": lambda user_id: crud.next_due_cards(session, user_id, args.limit, now),
+            }
+            plans = {
+                "join": joined_query(1, args.limit, now),
+                "indexed": indexed_query(1, args.limit, now),
+            }
+            for name, run in profiles.items():
+                result = time_queries(session, run, args.users, args.repeats)
+                print(f"{name:>8}: median {result['median_ms']:7.2f} ms  p95 {result['p95_ms']:7.2f} ms")
+                print(f"{'':>10}plan: {query_plan(session, plans[name])}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
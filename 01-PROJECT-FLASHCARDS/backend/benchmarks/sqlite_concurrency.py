@@ -0,0 +1,100 @@
+"""Concurrent read/write throughput of the default vs. tuned SQLite engine.
+
+Run from the backend directory:
+
+    python -m benchmarks.sqlite_concurrency --threads 16 --seconds 5
+
+Each worker thread loops over short transactions against a temporary database:
+``--write-ratio`` of them insert a card, the rest list a deck's cards, mirroring
+the CRUD endpoints. Throughput and p95 latency are printed for both profiles.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, select
+
+from app.database import build_engine
+from app.models import Card, Deck
+
+
+def run_profile(tuned: bool, threads: int, seconds: float, write_ratio: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", tuned=tuned)
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            decks = [Deck(name=f"Deck {i}") for i in range(10)]
+            session.add_all(decks)
+            session.commit()
+            deck_ids = [deck.id for deck in decks]
+
+        latencies = []
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def worker():
+            rng = random.Random()
+            local, local_counts = [], {"reads": 0, "writes": 0, "errors": 0}
+            while time.perf_counter() < deadline:
+                deck_id = rng.choice(deck_ids)
+                start = time.perf_counter()
+                try:
+                    with Session(engine) as session:
+                        if rng.random() < write_ratio:
+                            session.add(Card(front="Question", back="Answer", deck_id=deck_id))
+                            session.commit()
+                            local_counts["writes"] += 1
+                        else:
+                            session.exec(select(Card).where(Card.deck_id == deck_id).limit(50)).all()
+                            local_counts["reads"] += 1
+                except OperationalError:
+                    # "database is locked" once the busy timeout is exhausted
+                    local_counts["errors"] += 1
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+                for key, value in local_counts.items():
+                    counts[key] += value
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        engine.dispose()
+
+    ops = counts["reads"] + counts["writes"]
+    return {
+        "profile": "tuned" if tuned else "default",
+        "ops_per_sec": ops / seconds,
+        "writes_per_sec": counts["writes"] / seconds,
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else 0.0,
+        "errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads, {args.seconds:.0f}s per profile, {args.write_ratio:.0%} writes")
+    for tuned in (False, True):
+        result = run_profile(tuned, args.threads, args.seconds, args.write_ratio)
+        print(
+            f"{result['profile']:>8}: {result['ops_per_sec']:8.0f} ops/s  "
+            f"{result['writes_per_sec']:7.0f} writes/s  p95 {result['p95_ms']:7.2f} ms  "
+            f"errors {result['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,40 @@
 from fastmcp import FastMCP
 import pypdf
 import io
+import json
 
 import base64
 
+from app.services.pdf_cache import get_page_cache, sha256_bytes, sha256_file
+from app.services.pdf_extraction import extract_pages
+
 # Initialize FastMCP server
 mcp = FastMCP("PDF Extractor")
 
-def extract_text_logic(pdf_base64: str = None, start_page: int = 1, end_page: int = -1, pdf_path: str = None) -> str:
+def extract_text_logic(pdf_base64: str = None, start_page: int = 1, end_page: int = -1, pdf_path: str = None, pdf_sha256: str = None) -> str:
     try:
+        # Files on disk are opened by path and never read into memory as a whole
         if pdf_path:
-            with open(pdf_path, "rb") as f:
-                pdf_content = f.read()
+            pdf_source = pdf_path
         elif pdf_base64:
             pdf_content = base64.b64decode(pdf_base64)
+            pdf_source = io.BytesIO(pdf_content)
+            pdf_sha256 = sha256_bytes(pdf_content)
         else:
             return "No PDF content provided (either pdf_base64 or pdf_path required)"
 
-        reader = pypdf.PdfReader(io.BytesIO(pdf_content))
-        total_pages = len(reader.pages)
+        # Page text is cached per (PDF hash, page), so overlapping ranges of a
+        # re-uploaded document only parse the pages not seen before.
+        cache = get_page_cache()
+        digest = (pdf_sha256 or sha256_file(pdf_path)) if cache else None
+
+        reader = None
+        total_pages = cache.get_page_count(digest) if cache else None
+        if total_pages is None:
+            reader = pypdf.PdfReader(pdf_source)
+            total_pages = len(reader.pages)
+            if cache:
+                cache.set_page_count(digest, total_pages)
         
         # Adjust 1-based indexing to 0-based
         start_idx = max(0, start_page - 1)
@@ -27,20 +43,32 @@ def extract_text_logic(pdf_base64: str = None, start_page: int = 1, end_page: in
             end_idx = total_pages
         else:
             end_idx = end_page
+
+        page_indices = [i for i in range(start_idx, end_idx) if i < total_pages]
+        page_texts = cache.get_pages(digest, page_indices) if cache else {}
+
+        missing = [i for i in page_indices if i not in page_texts]
+        if missing:
+            # Large ranges are split across worker processes that open the file by path
+            if reader is None and not pdf_path:
+                reader = pypdf.PdfReader(pdf_source)
+            new_texts = extract_pages(missing, pdf_path=pdf_path, reader=reader)
+            page_texts.update(new_texts)
+            if cache:
+                cache.put_pages(digest, new_texts)
         
         extracted_text = []
-        for i in range(start_idx, end_idx):
-            if i < total_pages:
-                text = reader.pages[i].extract_text()
-                if text:
-                    extracted_text.append(f"--- Page {i+1} ---\n{text}")
+        for i in page_indices:
+            text = page_texts[i]
+            if text:
+                extracted_text.append(f"--- Page {i+1} ---\n{text}")
         
         return "\n\n".join(extracted_text)
     except Exception as e:
         return f"Error extracting PDF text: {str(e)}"
 
 @mcp.tool()
-def extract_text_from_pdf(pdf_base64: str = None, start_page: int = 1, end_page: int = -1, pdf_path: str = None) -> str:
+def extract_text_from_pdf(pdf_base64: str = None, start_page: int = 1, end_page: int = -1, pdf_path: str = None, pdf_sha256: str = None) -> str:
     """
     Extracts text from a PDF file within a specified page range.
     
@@ -50,11 +78,44 @@ def extract_text_from_pdf(pdf_base64: str = None, start_page: int = 1, end_page:
         end_page: The ending page number (1-indexed). Defaults to -1 (last page).
                   If end_page is -1 or greater than the total pages, it extracts until the end.
         pdf_path: Optional. The absolute path to the PDF file on the server.
+        pdf_sha256: Optional. Hex SHA-256 of the file at pdf_path, if the caller already computed it.
     
     Returns:
         The extracted text from the specified pages joined by newlines.
     """
-    return extract_text_logic(pdf_base64, start_page, end_page, pdf_path)
+    return extract_text_logic(pdf_base64, start_page, end_page, pdf_path, pdf_sha256)
+
+def count_pages_logic(pdf_path: str, pdf_sha256: str = None) -> int:
+    cache = get_page_cache()
+    digest = (pdf_sha256 or sha256_file(pdf_path)) if cache else None
+    total_pages = cache.get_page_count(digest) if cache else None
+    if total_pages is None:
+        total_pages = len(pypdf.PdfReader(pdf_path).pages)
+        if cache:
+            cache.set_page_count(digest, total_pages)
+    return total_pages
+
+@mcp.tool()
+def count_pdf_pages(pdf_path: str, pdf_sha256: str = None) -> str:
+    """
+    Returns the number of pages in a PDF file on the server.
+
+    Args:
+        pdf_path: The absolute path to the PDF file on the server.
+        pdf_sha256: Optional. Hex SHA-256 of the file, if the caller already computed it.
+    """
+    try:
+        return str(count_pages_logic(pdf_path, pdf_sha256))
+    except Exception as e:
+        return f"Error reading PDF: {str(e)}"
+
+@mcp.tool()
+def get_extraction_cache_stats() -> str:
+    """
+    Returns the page text cache counters (hits, misses, hit_rate, evictions, entries, bytes) as JSON.
+    """
+    cache = get_page_cache()
+    return json.dumps(cache.stats() if cache else {"enabled": False})
 
 if __name__ == "__main__":
     mcp.run(show_banner=False)
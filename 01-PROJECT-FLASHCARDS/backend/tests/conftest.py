@@ -1,11 +1,39 @@
+import io
 import pytest
+from contextlib import contextmanager
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
 from sqlmodel.pool import StaticPool
-from app.main import app, get_session
+import os
+from unittest.mock import MagicMock, patch
+
+# Almost every test registers and logs in; the production bcrypt cost made that most of the
+# suite's runtime. Set before the app is imported, which reads it once.
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from app.database import Database, build_async_engine
+from app.main import app, get_db, get_session, get_agent
+from app.services.ai_agent import FlashcardAgent
+from app.services.fake_model import FAKE_MODEL_NAME
+from app.auth import user_cache
+from app.crud import clear_tag_cache
+from app.query_stats import count_queries
+from app.services.response_cache import get_refine_cache
 # Import models to ensure they are registered with SQLModel.metadata
 from app import models
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Keep cached refine responses, users and tag ids from leaking between tests."""
+    cache = get_refine_cache()
+    if cache is not None:
+        cache.clear()
+    user_cache.clear()
+    clear_tag_cache()
+    yield
+
 @pytest.fixture(name="session")
 def session_fixture():
     engine = create_engine(
@@ -17,16 +45,64 @@ def session_fixture():
     with Session(engine) as session:
         yield session
 
+@pytest.fixture(name="assert_max_queries")
+def assert_max_queries_fixture(session: Session):
+    """Fail the test if the block runs more than ``limit`` statements on the test database."""
+    @contextmanager
+    def assert_max_queries(limit: int):
+        with count_queries(session.get_bind()) as log:
+            yield log
+        assert log.count <= limit, f"{log.count} queries, expected at most {limit}:\n" + "\n".join(log.statements)
+    return assert_max_queries
+
 @pytest.fixture(name="client")
 def client_fixture(session: Session):
     def get_session_override():
         yield session
 
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_db] = lambda: Database(session=session)
     client = TestClient(app)
     yield client
     app.dependency_overrides.clear()
 
+@pytest.fixture(name="async_client")
+def async_client_fixture():
+    """A client whose handlers use an AsyncSession on an in-memory aiosqlite database."""
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    engine = build_async_engine("sqlite+aiosqlite://")
+
+    async def get_db_override():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield Database(async_session=session)
+
+    app.dependency_overrides[get_db] = get_db_override
+    # Entering the client keeps one event loop for the aiosqlite connection; skip the MCP pool
+    with patch("app.main.MCP_POOL_SIZE", 0), TestClient(app) as client:
+        client.portal.call(_create_tables, engine)
+        yield client
+    app.dependency_overrides.clear()
+
+async def _create_tables(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+@pytest.fixture(name="mock_agent")
+def mock_agent_fixture(client: TestClient):
+    """Replace the app-scoped FlashcardAgent with a MagicMock."""
+    agent = MagicMock()
+    app.dependency_overrides[get_agent] = lambda: agent
+    return agent
+
+@pytest.fixture(name="fake_agent")
+def fake_agent_fixture(client: TestClient):
+    """Serve AI endpoints from a real FlashcardAgent backed by the offline fake model."""
+    with patch.dict(os.environ, {"GEMINI_MODEL": FAKE_MODEL_NAME}):
+        agent = FlashcardAgent()
+    app.dependency_overrides[get_agent] = lambda: agent
+    return agent
+
 @pytest.fixture(name="auth_headers")
 def auth_headers_fixture(client: TestClient):
     # Register a test user
@@ -42,3 +118,26 @@ def auth_headers_fixture(client: TestClient):
     })
     token = response.json()["access_token"]
     return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture(name="make_pdf")
+def make_pdf_fixture():
+    """Build a small PDF in memory with one line of text per page."""
+    def _make_pdf(page_texts):
+        writer = PdfWriter()
+        font = writer._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }))
+        for text in page_texts:
+            page = writer.add_blank_page(612, 792)
+            page[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+            })
+            content = DecodedStreamObject()
+            content.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+            page[NameObject("/Contents")] = writer._add_object(content)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return buffer.getvalue()
+    return _make_pdf
@@ -0,0 +1,61 @@
+from fastapi.testclient import TestClient
+from app.database import to_async_url
+
+
+def register_and_login(client: TestClient, username: str) -> dict:
+    client.post("/register", json={"username": username, "password": "password"})
+    token = client.post("/token", data={"username": username, "password": "password"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_to_async_url():
+    assert to_async_url("sqlite:///database.db") == "sqlite+aiosqlite:///database.db"
+    assert to_async_url("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert to_async_url("postgresql+psycopg2://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+
+
+def test_crud_flow_on_async_session(async_client: TestClient):
+    headers = register_and_login(async_client, "asyncuser")
+    assert async_client.get("/users/me", headers=headers).json()["username"] == "asyncuser"
+
+    deck = async_client.post("/decks/", json={"name": "Async Deck", "tags": ["Async", "db"]}, headers=headers).json()
+    assert sorted(tag["name"] for tag in deck["tags"]) == ["async", "db"]
+
+    updated = async_client.put(f"/decks/{deck['id']}", json={"name": "Renamed", "tags": ["db"]}, headers=headers).json()
+    assert updated["name"] == "Renamed"
+    assert [tag["name"] for tag in updated["tags"]] == ["db"]
+
+    card = async_client.post("/cards/", json={"front": "Q", "back": "A", "deck_id": deck["id"]}, headers=headers).json()
+    async_client.put(f"/cards/{card['id']}", json={"status": "MASTERED"}, headers=headers)
+    cards = async_client.get(f"/decks/{deck['id']}/cards", headers=headers).json()
+    assert [(c["front"], c["status"]) for c in cards] == [("Q", "MASTERED")]
+
+    assert async_client.delete(f"/cards/{card['id']}", headers=headers).json() == {"ok": True}
+    assert async_client.delete(f"/decks/{deck['id']}", headers=headers).json() == {"ok": True}
+    assert async_client.get("/decks/", headers=headers).json() == []
+
+
+def test_async_session_enforces_ownership(async_client: TestClient):
+    headers_a = register_and_login(async_client, "owner")
+    headers_b = register_and_login(async_client, "intruder")
+    deck_id = async_client.post("/decks/", json={"name": "Private"}, headers=headers_a).json()["id"]
+
+    assert async_client.get(f"/decks/{deck_id}", headers=headers_b).status_code == 404
+    assert async_client.get(f"/decks/{deck_id}/cards", headers=headers_b).status_code == 404
+    assert async_client.post("/cards/", json={"front": "Q", "back": "A", "deck_id": deck_id}, headers=headers_b).status_code == 404
+
+
+def test_deck_export_and_search_on_async_session(async_client: TestClient):
+    headers = register_and_login(async_client, "exporter")
+    deck_id = async_client.post("/decks/", json={"name": "Stream"}, headers=headers).json()["id"]
+    cards = [{"front": f"Q{i}", "back": "A", "deck_id": deck_id} for i in range(3)]
+    async_client.post("/cards/batch", json={"cards": cards}, headers=headers)
+
+    archive = async_client.get(f"/decks/{deck_id}/export", headers=headers).content
+    imported = async_client.post("/decks/import", content=archive, headers=headers).json()
+    assert imported["cards"] == 3
+    copied = async_client.get(f"/decks/{imported['deck']['id']}/cards", headers=headers).json()
+    assert [card["front"] for card in copied] == ["Q0", "Q1", "Q2"]
+    # The search index is created with the tables and filled by its triggers
+    hits = async_client.get("/search/cards", params={"q": "q1"}, headers=headers).json()
+    assert [hit["snippet"] for hit in hits] == ["<mark>Q1</mark>", "<mark>Q1</mark>"]
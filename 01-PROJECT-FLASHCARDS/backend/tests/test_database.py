@@ -0,0 +1,25 @@
+from sqlalchemy import text
+from app.database import build_engine
+
+
+def test_tuned_sqlite_engine_applies_pragmas(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == -4096
+    assert engine.pool.size() == 10
+
+
+def test_untuned_engine_keeps_sqlite_defaults(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'default.db'}", tuned=False)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+
+
+def test_in_memory_engine_skips_wal_and_pool_sizing():
+    engine = build_engine("sqlite://")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "memory"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
@@ -0,0 +1,113 @@
+import pytest
+from unittest.mock import patch
+import mcp_server
+from app.services.pdf_cache import PageTextCache
+from app.services.pdf_extraction import extract_pages, split_into_chunks
+
+
+@pytest.fixture(name="page_cache")
+def page_cache_fixture(tmp_path):
+    cache = PageTextCache(path=str(tmp_path / "pages.db"))
+    with patch("mcp_server.get_page_cache", return_value=cache):
+        yield cache
+
+
+def test_extract_text_by_page_range(make_pdf, tmp_path):
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(make_pdf(["Alpha", "Beta", "Gamma"]))
+
+    with patch("mcp_server.get_page_cache", return_value=None):
+        text = mcp_server.extract_text_logic(start_page=2, end_page=-1, pdf_path=str(pdf_path))
+
+    assert text == "--- Page 2 ---\nBeta\n\n--- Page 3 ---\nGamma"
+
+
+def test_overlapping_range_only_extracts_new_pages(make_pdf, tmp_path, page_cache):
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(make_pdf([f"Page text {i}" for i in range(1, 6)]))
+
+    first = mcp_server.extract_text_logic(start_page=1, end_page=3, pdf_path=str(pdf_path))
+    assert page_cache.stats()["misses"] == 3
+
+    second = mcp_server.extract_text_logic(start_page=2, end_page=5, pdf_path=str(pdf_path))
+    stats = page_cache.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 5
+    assert stats["entries"] == 5
+    assert first.startswith("--- Page 1 ---\nPage text 1")
+    assert second.startswith("--- Page 2 ---\nPage text 2")
+    assert second.endswith("--- Page 5 ---\nPage text 5")
+
+
+def test_fully_cached_range_skips_pdf_parsing(make_pdf, tmp_path, page_cache):
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(make_pdf(["One", "Two"]))
+    expected = mcp_server.extract_text_logic(pdf_path=str(pdf_path))
+
+    with patch("mcp_server.pypdf.PdfReader", side_effect=AssertionError("PDF was re-parsed")):
+        assert mcp_server.extract_text_logic(pdf_path=str(pdf_path)) == expected
+    assert page_cache.stats()["hit_rate"] == 0.5
+
+
+def test_metrics_report_the_extractors_cache_counters(make_pdf, tmp_path, page_cache, client):
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(make_pdf(["One", "Two"]))
+    mcp_server.extract_text_logic(pdf_path=str(pdf_path))
+    mcp_server.extract_text_logic(start_page=2, end_page=2, pdf_path=str(pdf_path))
+
+    # The API process has its own connection to the file the extraction servers write
+    app_side = PageTextCache(path=page_cache.path)
+    with patch("app.main.METRICS_ENABLED", True), patch("app.main.get_page_cache", return_value=app_side):
+        stats = client.get("/metrics").json()["pdf_cache"]
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+
+    with patch("app.main.METRICS_ENABLED", True), patch("app.main.get_page_cache", return_value=None):
+        assert client.get("/metrics").json()["pdf_cache"] is None
+
+
+def test_cache_evicts_least_recently_used_pages(tmp_path):
+    cache = PageTextCache(path=str(tmp_path / "pages.db"), max_bytes=10)
+    cache.put_pages("doc", {0: "aaaa", 1: "bbbb"})
+    cache.get_pages("doc", [0])
+    cache.put_pages("doc", {2: "cccc"})
+
+    assert set(cache.get_pages("doc", [0, 1, 2])) == {0, 2}
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 8
+
+
+def test_parallel_extraction_preserves_page_order(make_pdf, tmp_path):
+    pdf_path = tmp_path / "book.pdf"
+    pdf_path.write_bytes(make_pdf([f"Chapter {i}" for i in range(1, 8)]))
+    pages = list(range(1, 7))
+
+    serial = extract_pages(pages, pdf_path=str(pdf_path), workers=1)
+    parallel = extract_pages(pages, pdf_path=str(pdf_path), workers=3, min_parallel_pages=1)
+
+    assert parallel == serial
+    assert parallel[6] == "Chapter 7"
+
+
+def test_small_ranges_are_extracted_serially(make_pdf, tmp_path):
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(make_pdf(["One", "Two"]))
+
+    with patch("app.services.pdf_extraction._get_executor") as mock_get_executor:
+        texts = extract_pages([0, 1], pdf_path=str(pdf_path), workers=4, min_parallel_pages=16)
+
+    mock_get_executor.assert_not_called()
+    assert texts == {0: "One", 1: "Two"}
+
+
+def test_split_into_chunks_is_contiguous():
+    assert split_into_chunks(list(range(7)), 3) == [[0, 1, 2], [3, 4], [5, 6]]
+    assert split_into_chunks([4], 8) == [[4]]
+
+
+def test_count_pages_uses_cached_page_count(make_pdf, tmp_path, page_cache):
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(make_pdf(["One", "Two", "Three"]))
+
+    assert mcp_server.count_pages_logic(str(pdf_path)) == 3
+    with patch("mcp_server.pypdf.PdfReader", side_effect=AssertionError("PDF was re-parsed")):
+        assert mcp_server.count_pages_logic(str(pdf_path)) == 3
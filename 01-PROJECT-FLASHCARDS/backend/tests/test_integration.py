@@ -1,10 +1,16 @@
+import asyncio
+from contextlib import asynccontextmanager
 import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine, select
 from app.main import app, get_session
 from app.models import Deck, Card
 import os
+import json
+import hashlib
 from unittest.mock import patch, MagicMock
+from app.services.uploads import spool_upload
+from app.services.ai_agent import FlashcardAgent
 
 # Setup in-memory SQLite for testing
 sqlite_file_name = "test_integration.db"
@@ -61,17 +67,15 @@ def test_full_user_flow(client: TestClient, auth_headers: dict):
     response = client.get(f"/decks/{deck_id}/cards", headers=auth_headers)
     assert response.json() == []
 
-@patch("app.main.FlashcardAgent")
-def test_ai_generation_flow(mock_agent_class, client: TestClient, auth_headers: dict):
+def test_ai_generation_flow(mock_agent: MagicMock, client: TestClient, auth_headers: dict):
     # Mocking Agent Response
-    mock_agent_instance = MagicMock()
+    mock_agent_instance = mock_agent
     # Define what the async method should return
     from unittest.mock import AsyncMock
-    mock_agent_instance.generate_from_pdf = AsyncMock(return_value=(
+    mock_agent_instance.generate_from_pdf_path = AsyncMock(return_value=(
         [{"front": "AI Question", "back": "AI Answer"}],
         "Source Text"
     ))
-    mock_agent_class.return_value = mock_agent_instance
 
     # 1. Simulate file upload
     files = {'file': ('test.pdf', b'%PDF-1.4 dummy content', 'application/pdf')}
@@ -88,15 +92,100 @@ def test_ai_generation_flow(mock_agent_class, client: TestClient, auth_headers:
         assert generated_cards[0]["back"] == "AI Answer"
         assert data["source_text"] == "Source Text"
 
-@patch("app.main.FlashcardAgent")
-def test_refine_flow(mock_agent_class, client: TestClient, auth_headers: dict):
+        # Only the spooled file's path and hash are handed to the agent
+        kwargs = mock_agent_instance.generate_from_pdf_path.call_args.kwargs
+        assert kwargs["pdf_sha256"] == hashlib.sha256(b'%PDF-1.4 dummy content').hexdigest()
+
+def test_generate_rejects_oversized_upload(mock_agent: MagicMock, client: TestClient, auth_headers: dict):
+    files = {'file': ('big.pdf', b'%PDF-1.4 ' + b'x' * 2048, 'application/pdf')}
+
+    with patch("app.main.spool_upload", lambda f: spool_upload(f, max_bytes=1024)):
+        response = client.post("/generate", files=files, headers=auth_headers)
+
+    assert response.status_code == 413
+    mock_agent.generate_from_pdf_path.assert_not_called()
+
+MULTIPART_HEADERS = {"Content-Type": "multipart/form-data; boundary=pdfboundary"}
+
+def multipart_pdf(chunks: list):
+    """A multipart body carrying ``chunks`` as a PDF upload."""
+    yield (b'--pdfboundary\r\nContent-Disposition: form-data; name="file"; filename="big.pdf"\r\n'
+           b"Content-Type: application/pdf\r\n\r\n")
+    yield from chunks
+    yield b"\r\n--pdfboundary--\r\n"
+
+async def post_in_messages(path: str, chunks: list, headers: dict, send=None):
+    """Send a body to the app one ASGI message per chunk; returns the status and how many were read."""
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+    read = 0
+    responses = []
+
+    async def receive():
+        nonlocal read
+        if read == len(messages):
+            # A connected client sends nothing more
+            await asyncio.Event().wait()
+        read += 1
+        return messages[read - 1]
+
+    async def record(message):
+        responses.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("testclient", 50000), "server": ("testserver", 80),
+    }
+    await app(scope, receive, send or record)
+    return (responses[0]["status"] if responses else None), read
+
+@pytest.mark.parametrize("path", ["/generate", "/generate/stream"])
+def test_oversized_upload_is_rejected_before_the_body_is_read(mock_agent: MagicMock, client: TestClient, auth_headers: dict, path: str):
+    sent = []
+    body = (sent.append(chunk) or chunk for chunk in multipart_pdf([b"x" * 1024]))
+    declared = client.post(path, content=body, headers={**auth_headers, **MULTIPART_HEADERS, "Content-Length": str(10 ** 12)})
+    assert declared.status_code == 413
+    assert sent == []
+
+    # Without a Content-Length the body is cut off once it crosses the limit
+    chunks = list(multipart_pdf([b"x" * 1024] * 50))
+    with patch("app.services.uploads.MAX_UPLOAD_BYTES", 1024), patch("app.services.uploads.FORM_OVERHEAD_BYTES", 0):
+        status, read = asyncio.run(post_in_messages(path, chunks, {**auth_headers, **MULTIPART_HEADERS}))
+    assert status == 413
+    assert read < 5
+    mock_agent.generate_from_pdf_path.assert_not_called()
+
+def test_stream_deletes_the_spooled_upload_when_the_response_never_starts(mock_agent: MagicMock, client: TestClient, auth_headers: dict):
+    spooled = []
+
+    @asynccontextmanager
+    async def recording_spool(file):
+        async with spool_upload(file) as upload:
+            spooled.append(upload.path)
+            yield upload
+
+    async def disconnected(message):
+        raise OSError("client went away")
+
+    async def post_and_check():
+        with pytest.raises(OSError):
+            await post_in_messages("/generate/stream", chunks, {**auth_headers, **MULTIPART_HEADERS}, send=disconnected)
+        # Checked before the loop runs again, so a garbage-collected generator cannot clean up late
+        return [os.path.exists(path) for path in spooled]
+
+    chunks = list(multipart_pdf([b"%PDF-1.4 dummy content"]))
+    with patch("app.main.spool_upload", recording_spool):
+        assert asyncio.run(post_and_check()) == [False]
+    mock_agent.stream_from_pdf_path.assert_not_called()
+
+def test_refine_flow(mock_agent: MagicMock, client: TestClient, auth_headers: dict):
     # Mocking Agent Response
-    mock_agent_instance = MagicMock()
     from unittest.mock import AsyncMock
-    mock_agent_instance.refine_flashcards = AsyncMock(return_value=[
+    mock_agent.refine_flashcards = AsyncMock(return_value=[
         {"front": "Refined Question", "back": "Refined Answer"}
     ])
-    mock_agent_class.return_value = mock_agent_instance
 
     # 1. Simulate refinement request
     refine_data = {
@@ -112,3 +201,78 @@ def test_refine_flow(mock_agent_class, client: TestClient, auth_headers: dict):
     assert len(refined_cards) == 1
     assert refined_cards[0]["front"] == "Refined Question"
     assert refined_cards[0]["back"] == "Refined Answer"
+
+def test_generate_stream_emits_ndjson_events(fake_agent: FlashcardAgent, client: TestClient, auth_headers: dict):
+    async def fake_tool(name, args):
+        if name == "count_pdf_pages":
+            return "2"
+        return "--- Page 1 ---\nStreaming works.\n\n--- Page 2 ---\nCards arrive early."
+
+    files = {'file': ('test.pdf', b'%PDF-1.4 dummy content', 'application/pdf')}
+    with patch.object(fake_agent, "_call_tool", side_effect=fake_tool):
+        response = client.post("/generate/stream", files=files, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[0] == {"type": "progress", "stage": "extracting", "pages_done": 0, "total_pages": 2}
+    assert [e["card"]["back"] for e in events if e["type"] == "card"] == ["Streaming works.", "Cards arrive early."]
+    assert events[-1]["type"] == "done"
+
+def test_generate_drops_near_duplicates_of_the_target_deck(mock_agent: MagicMock, client: TestClient, auth_headers: dict):
+    from unittest.mock import AsyncMock
+    from app.models import CardCreate
+    deck_id = client.post("/decks/", json={"name": "Cells"}, headers=auth_headers).json()["id"]
+    client.post("/cards/", json={"front": "What is the powerhouse of the cell?", "back": "Mitochondria", "deck_id": deck_id}, headers=auth_headers)
+    mock_agent.generate_from_pdf_path = AsyncMock(return_value=([
+        CardCreate(front="What's the powerhouse of a cell", back="Mitochondria."),
+        CardCreate(front="What does DNA stand for?", back="Deoxyribonucleic acid"),
+    ], "Source Text"))
+    files = {'file': ('test.pdf', b'%PDF-1.4 dummy content', 'application/pdf')}
+
+    response = client.post("/generate", files=files, data={"deck_id": str(deck_id)}, headers=auth_headers)
+    assert response.status_code == 200
+    assert [card["front"] for card in response.json()["cards"]] == ["What does DNA stand for?"]
+    assert response.json()["duplicates"] == 1
+
+    # Without a deck nothing is filtered; someone else's deck is a 404
+    assert len(client.post("/generate", files=files, headers=auth_headers).json()["cards"]) == 2
+    assert client.post("/generate", files=files, data={"deck_id": "999"}, headers=auth_headers).status_code == 404
+
+def test_generate_stream_drops_near_duplicates_of_the_target_deck(fake_agent: FlashcardAgent, client: TestClient, auth_headers: dict):
+    async def fake_tool(name, args):
+        if name == "count_pdf_pages":
+            return "2"
+        return "--- Page 1 ---\nStreaming works.\n\n--- Page 2 ---\nCards arrive early."
+
+    deck_id = client.post("/decks/", json={"name": "Streams"}, headers=auth_headers).json()["id"]
+    client.post("/cards/", json={"front": "What does the text say about streaming works", "back": "Streaming works", "deck_id": deck_id}, headers=auth_headers)
+    files = {'file': ('test.pdf', b'%PDF-1.4 dummy content', 'application/pdf')}
+    with patch.object(fake_agent, "_call_tool", side_effect=fake_tool):
+        response = client.post("/generate/stream", files=files, data={"deck_id": str(deck_id)}, headers=auth_headers)
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["card"]["back"] for e in events if e["type"] == "card"] == ["Cards arrive early."]
+    assert (events[-1]["card_count"], events[-1]["duplicates"]) == (1, 1)
+
+def test_metrics_are_off_unless_enabled(client: TestClient):
+    assert client.get("/metrics").status_code == 404
+    with patch("app.main.METRICS_ENABLED", True):
+        assert set(client.get("/metrics").json()) >= {"llm", "refine_cache", "sql"}
+
+def test_repeated_refine_is_served_from_cache(fake_agent: FlashcardAgent, client: TestClient, auth_headers: dict):
+    payload = {
+        "cards": [{"front": "Q", "back": "A"}],
+        "source_text": "--- Page 1 ---\nCaching saves tokens.",
+        "feedback": "Be concise",
+    }
+    first = client.post("/generate/refine", json=payload, headers=auth_headers)
+    second = client.post("/generate/refine", json=payload, headers=auth_headers)
+
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert fake_agent.model.calls == 1
+    with patch("app.main.METRICS_ENABLED", True):
+        refine_stats = client.get("/metrics").json()["refine_cache"]
+    assert refine_stats["hits"] == 1
+    assert refine_stats["saved_tokens"] > 0
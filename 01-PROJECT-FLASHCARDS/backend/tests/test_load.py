@@ -0,0 +1,87 @@
+import asyncio
+import os
+import threading
+import httpx
+import pytest
+from unittest.mock import patch
+from sqlmodel import Session, SQLModel, create_engine
+from app.database import Database
+from app.main import app, get_db, get_session, get_agent
+from app.services.ai_agent import FlashcardAgent
+from app.services.fake_model import FAKE_MODEL_NAME
+
+CONCURRENT_GENERATIONS = 4
+# Safety net so a regression fails the test instead of hanging it
+GATE_TIMEOUT = 10
+
+
+@pytest.fixture(name="file_engine")
+def file_engine_fixture(tmp_path):
+    # A file database so concurrent requests each get their own connection
+    engine = create_engine(f"sqlite:///{tmp_path / 'load.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+
+    def get_session_override():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+
+    def get_db_override():
+        with Session(engine) as session:
+            yield Database(session=session)
+
+    app.dependency_overrides[get_db] = get_db_override
+    yield engine
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.asyncio
+async def test_crud_requests_are_served_while_generations_are_in_flight(file_engine):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/register", json={"username": "loaduser", "password": "password"})
+        token = (await client.post("/token", data={"username": "loaduser", "password": "password"})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.post("/decks/", json={"name": "Load Deck"}, headers=headers)
+
+        refine_body = {
+            "cards": [{"front": "Q", "back": "A"}],
+            "source_text": "--- Page 1 ---\nSlow generation in flight.",
+            "feedback": "More detail",
+        }
+        with patch.dict(os.environ, {"GEMINI_MODEL": FAKE_MODEL_NAME}):
+            slow_agent = FlashcardAgent()
+        # Identical requests must all reach the model
+        slow_agent.refine_cache = None
+        app.dependency_overrides[get_agent] = lambda: slow_agent
+
+        # Every model call blocks until the test opens the gate, so the overlap
+        # below is guaranteed rather than a matter of timing
+        gate = threading.Event()
+        respond = slow_agent.model._cards_for
+
+        def gated(prompt):
+            assert gate.wait(GATE_TIMEOUT), "generation was never released"
+            return respond(prompt)
+
+        slow_agent.model._cards_for = gated
+        generations = [
+            asyncio.create_task(client.post("/generate/refine", json=refine_body, headers=headers))
+            for _ in range(CONCURRENT_GENERATIONS)
+        ]
+        try:
+            while slow_agent.model.active < CONCURRENT_GENERATIONS:
+                assert not any(task.done() for task in generations)
+                await asyncio.sleep(0.01)
+
+            # A blocked event loop could not answer these until the gate opened
+            for path in ("/health", "/decks/", "/health", "/decks/"):
+                assert (await client.get(path, headers=headers)).status_code == 200
+            assert not any(task.done() for task in generations)
+            assert slow_agent.model.max_active == CONCURRENT_GENERATIONS
+        finally:
+            gate.set()
+        results = await asyncio.gather(*generations)
+
+    assert all(r.status_code == 200 for r in results)
@@ -0,0 +1,126 @@
+from unittest.mock import patch
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session, select
+from app import crud
+from app.query_stats import count_queries
+from app.models import Tag
+
+DECKS = 20
+
+
+def create_decks(client: TestClient, headers: dict) -> list:
+    return [
+        client.post("/decks/", json={"name": f"Deck {i}", "tags": [f"tag{i}", "shared"]}, headers=headers).json()["id"]
+        for i in range(DECKS)
+    ]
+
+
+def test_list_decks_query_count_is_constant(client: TestClient, auth_headers: dict, assert_max_queries):
+    create_decks(client, auth_headers)
+    # The user lookup, the decks, and one batched load of all their tags
+    with assert_max_queries(3):
+        response = client.get("/decks/", headers=auth_headers)
+    decks = response.json()
+    assert len(decks) == DECKS
+    assert all(sorted(tag["name"] for tag in deck["tags"])[0] == "shared" for deck in decks)
+
+
+def test_read_deck_query_count(client: TestClient, auth_headers: dict, assert_max_queries):
+    deck_id = create_decks(client, auth_headers)[0]
+    with assert_max_queries(3):
+        response = client.get(f"/decks/{deck_id}", headers=auth_headers)
+    assert len(response.json()["tags"]) == 2
+
+
+def test_list_cards_query_count(client: TestClient, auth_headers: dict, assert_max_queries):
+    deck_id = create_decks(client, auth_headers)[0]
+    for i in range(10):
+        client.post("/cards/", json={"front": f"Q{i}", "back": "A", "deck_id": deck_id}, headers=auth_headers)
+    with assert_max_queries(3):
+        response = client.get(f"/decks/{deck_id}/cards", headers=auth_headers)
+    assert len(response.json()) == 10
+
+
+def test_not_modified_reads_skip_the_rows(client: TestClient, auth_headers: dict, assert_max_queries):
+    deck_id = create_decks(client, auth_headers)[0]
+    client.post("/cards/", json={"front": "Q", "back": "A", "deck_id": deck_id}, headers=auth_headers)
+    for url in ("/decks/", f"/decks/{deck_id}/cards"):
+        etag = client.get(url, headers=auth_headers).headers["etag"]
+        # The user lookup and the version lookup, nothing else
+        with assert_max_queries(2) as log:
+            response = client.get(url, headers={**auth_headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert not any("FROM card" in statement or "decktaglink" in statement for statement in log.statements)
+
+
+def test_deck_creation_query_count_does_not_grow_with_tags(client: TestClient, auth_headers: dict, assert_max_queries):
+    client.get("/users/me", headers=auth_headers)  # warm the user cache
+    with assert_max_queries(6) as one_tag:
+        client.post("/decks/", json={"name": "One", "tags": ["solo"]}, headers=auth_headers)
+    many = [f"topic-{i}" for i in range(30)]
+    with assert_max_queries(6) as many_tags:
+        response = client.post("/decks/", json={"name": "Many", "tags": many + ["Solo", " solo "]}, headers=auth_headers)
+    assert many_tags.count == one_tag.count
+    assert sorted(tag["name"] for tag in response.json()["tags"]) == sorted(many + ["solo"])
+
+
+def test_tag_cache_recovers_from_a_replaced_database(client: TestClient, auth_headers: dict, session: Session):
+    crud._tag_ids["ghost"] = 999  # cached, but not in this database
+    response = client.post("/decks/", json={"name": "Ghost", "tags": ["ghost"]}, headers=auth_headers)
+    assert [tag["name"] for tag in response.json()["tags"]] == ["ghost"]
+    assert crud._tag_ids["ghost"] == session.exec(select(Tag).where(Tag.name == "ghost")).one().id
+
+
+def test_batch_card_creation_query_count_is_constant(client: TestClient, auth_headers: dict, assert_max_queries):
+    deck_id = create_decks(client, auth_headers)[0]
+    cards = [{"front": f"Q{i}", "back": "A", "deck_id": deck_id} for i in range(200)]
+    # Ownership check and one batched INSERT, plus the user lookup
+    with assert_max_queries(3):
+        response = client.post("/cards/batch", json={"cards": cards}, headers=auth_headers)
+    assert len(response.json()["ids"]) == 200
+
+
+
+def test_writes_do_not_read_rows_back(client: TestClient, auth_headers: dict, session: Session):
+    engine = session.get_bind()
+
+    def write(method, url, **kwargs):
+        with count_queries(engine) as log:
+            response = client.request(method, url, headers=auth_headers, **kwargs)
+        assert response.status_code == 200
+        # The write is the last statement: nothing is selected again after it
+        assert not log.statements[-1].startswith("SELECT")
+        return response.json(), log.count
+
+    deck, count = write("POST", "/decks/", json={"name": "Plain"})
+    assert count == 2  # user lookup, INSERT
+    deck, _ = write("PUT", f"/decks/{deck['id']}", json={"name": "Renamed", "tags": ["x"]})
+    assert deck["name"] == "Renamed" and [tag["name"] for tag in deck["tags"]] == ["x"]
+    card, count = write("POST", "/cards/", json={"front": "Q", "back": "A", "deck_id": deck["id"]})
+    assert count == 2  # deck ownership and version bump in one UPDATE, INSERT
+    card, count = write("PUT", f"/cards/{card['id']}", json={"status": "MASTERED"})
+    assert count == 3  # card ownership, UPDATE, deck version bump
+    assert card["status"] == "MASTERED" and card["created_at"]
+
+
+@pytest.mark.parametrize("counters", [False, True])
+def test_deck_stats_query_count_is_constant(client: TestClient, auth_headers: dict, assert_max_queries, counters: bool):
+    with patch("app.crud.DECK_STATS_COUNTERS", counters):
+        for deck_id in create_decks(client, auth_headers):
+            client.post("/cards/", json={"front": "Q", "back": "A", "deck_id": deck_id}, headers=auth_headers)
+        # The user lookup and one aggregate over all decks
+        with assert_max_queries(2):
+            response = client.get("/decks/stats", headers=auth_headers)
+    assert [stats["total"] for stats in response.json()] == [1] * DECKS
+
+
+def test_review_queue_reads_the_due_date_index(session: Session):
+    plan = " ".join(
+        str(row[-1]) for row in session.exec(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM card WHERE user_id = 1 AND due_at <= '2030-01-01' ORDER BY due_at LIMIT 20"
+        ))
+    )
+    assert "ix_card_user_id_due_at" in plan
+    assert "TEMP B-TREE" not in plan
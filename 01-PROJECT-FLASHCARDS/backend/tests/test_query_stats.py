@@ -0,0 +1,79 @@
+import json
+import logging
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import create_engine
+from app.query_stats import QueryInstrumentation, QueryStats
+
+
+def make_engine():
+    return create_engine("sqlite://")
+
+
+def test_disabled_instrumentation_installs_no_hooks():
+    engine = make_engine()
+    instrumentation = QueryInstrumentation(slow_query_ms=0, sample_rate=0)
+    instrumentation.install(engine)
+    assert not event.contains(engine, "after_cursor_execute", instrumentation._after_cursor_execute)
+
+
+def test_queries_are_counted_per_tracked_context():
+    engine = make_engine()
+    instrumentation = QueryInstrumentation(slow_query_ms=10_000, sample_rate=0)
+    instrumentation.install(engine)
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        with instrumentation.track() as stats:
+            conn.execute(text("SELECT 2"))
+            conn.execute(text("SELECT 3"))
+
+    assert stats.count == 2
+    assert stats.slow == 0
+    assert instrumentation.stats()["queries"] == 3
+
+
+def test_failed_statements_do_not_skew_later_timings(monkeypatch):
+    engine = make_engine()
+    instrumentation = QueryInstrumentation(slow_query_ms=10_000, sample_rate=0)
+    instrumentation.install(engine)
+    clock = iter([100.0, 200.0, 200.5])
+    monkeypatch.setattr("app.query_stats.time.perf_counter", lambda: next(clock))
+
+    with engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM missing_table"))
+        conn.execute(text("SELECT 1"))
+        assert "query_start" not in conn.info
+
+    assert instrumentation.stats()["queries"] == 1
+    assert instrumentation.stats()["duration_ms"] == 500.0
+
+
+def test_slow_queries_are_logged_as_json(caplog):
+    engine = make_engine()
+    instrumentation = QueryInstrumentation(slow_query_ms=0.000001, sample_rate=0)
+    instrumentation.install(engine)
+
+    with caplog.at_level(logging.WARNING, logger="app.sql"):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT   42"))
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry["event"] == "slow_query"
+    assert entry["statement"] == "SELECT 42"
+    assert instrumentation.stats()["slow_queries"] == 1
+
+
+def test_request_summaries_respect_sample_rate(caplog):
+    stats = QueryStats()
+    stats.count = 4
+    with caplog.at_level(logging.INFO, logger="app.sql"):
+        QueryInstrumentation(sample_rate=0).log_request("GET", "/decks/", 200, stats)
+        assert not caplog.records
+        QueryInstrumentation(sample_rate=1).log_request("GET", "/decks/", 200, stats)
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry["event"] == "request_queries"
+    assert entry["path"] == "/decks/" and entry["queries"] == 4
@@ -1,4 +1,10 @@
+import gzip
+import json
+from unittest.mock import patch
+import pytest
 from fastapi.testclient import TestClient
+from sqlmodel import Session
+from app import crud
 
 def test_create_deck(client: TestClient, auth_headers: dict):
     response = client.post("/decks/", json={"name": "Test Deck", "description": "Unit Test", "tags": ["tag1", "tag2"]}, headers=auth_headers)
@@ -44,3 +50,326 @@ def test_read_cards_by_deck(client: TestClient, auth_headers: dict):
     response = client.get(f"/decks/{deck_id}/cards", headers=auth_headers)
     assert response.status_code == 200
     assert response.json() == []
+
+def test_decks_keyset_pagination_and_tag_filter(client: TestClient, auth_headers: dict):
+    for i in range(5):
+        tags = ["even"] if i % 2 == 0 else ["odd"]
+        client.post("/decks/", json={"name": f"Deck {i}", "tags": tags}, headers=auth_headers)
+
+    names, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/decks/", params=params, headers=auth_headers)
+        names += [deck["name"] for deck in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert names == [f"Deck {i}" for i in range(5)]
+
+    even = client.get("/decks/", params={"tag": "Even"}, headers=auth_headers).json()
+    assert [deck["name"] for deck in even] == ["Deck 0", "Deck 2", "Deck 4"]
+    assert client.get("/decks/", params={"cursor": "not-a-cursor"}, headers=auth_headers).status_code == 400
+
+def test_cards_keyset_pagination_and_status_filter(client: TestClient, auth_headers: dict):
+    deck_id = client.post("/decks/", json={"name": "Big Deck"}, headers=auth_headers).json()["id"]
+    for i in range(7):
+        status = "MASTERED" if i < 3 else "NEW"
+        client.post("/cards/", json={"front": f"Q{i}", "back": "A", "status": status, "deck_id": deck_id}, headers=auth_headers)
+
+    first = client.get(f"/decks/{deck_id}/cards", params={"limit": 4}, headers=auth_headers)
+    assert [card["front"] for card in first.json()] == ["Q0", "Q1", "Q2", "Q3"]
+    second = client.get(
+        f"/decks/{deck_id}/cards", params={"limit": 4, "cursor": first.headers["X-Next-Cursor"]}, headers=auth_headers
+    )
+    assert [card["front"] for card in second.json()] == ["Q4", "Q5", "Q6"]
+    assert "X-Next-Cursor" not in second.headers
+
+    mastered = client.get(f"/decks/{deck_id}/cards", params={"status": "MASTERED"}, headers=auth_headers).json()
+    assert [card["front"] for card in mastered] == ["Q0", "Q1", "Q2"]
+
+def test_batch_card_endpoints(client: TestClient, auth_headers: dict):
+    deck_id = client.post("/decks/", json={"name": "Batch Deck"}, headers=auth_headers).json()["id"]
+    cards = [{"front": f"Q{i}", "back": f"A{i}", "deck_id": deck_id} for i in range(5)]
+
+    created = client.post("/cards/batch", json={"cards": cards}, headers=auth_headers)
+    assert created.status_code == 200
+    ids = created.json()["ids"]
+    assert len(ids) == 5
+    # Ids come back in request order
+    stored = {card["id"]: card["front"] for card in client.get(f"/decks/{deck_id}/cards", headers=auth_headers).json()}
+    assert [stored[card_id] for card_id in ids] == [card["front"] for card in cards]
+
+    updates = [{"id": ids[0], "status": "MASTERED"}, {"id": ids[1], "front": "Edited"}]
+    assert client.put("/cards/batch", json={"cards": updates}, headers=auth_headers).json()["ids"] == ids[:2]
+    stored = {card["id"]: card for card in client.get(f"/decks/{deck_id}/cards", headers=auth_headers).json()}
+    assert stored[ids[0]]["status"] == "MASTERED"
+    assert stored[ids[1]]["front"] == "Edited"
+
+    assert client.post("/cards/batch/delete", json={"ids": ids[:3]}, headers=auth_headers).json()["ids"] == sorted(ids[:3])
+    remaining = client.get(f"/decks/{deck_id}/cards", headers=auth_headers).json()
+    assert [card["id"] for card in remaining] == ids[3:]
+
+def test_batch_is_all_or_nothing_across_owners(client: TestClient, auth_headers: dict):
+    own_deck = client.post("/decks/", json={"name": "Mine"}, headers=auth_headers).json()["id"]
+    client.post("/register", json={"username": "other", "password": "password"})
+    other_token = client.post("/token", data={"username": "other", "password": "password"}).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {other_token}"}
+    other_deck = client.post("/decks/", json={"name": "Theirs"}, headers=other_headers).json()["id"]
+    other_card = client.post("/cards/", json={"front": "Q", "back": "A", "deck_id": other_deck}, headers=other_headers).json()["id"]
+
+    cards = [{"front": "Q", "back": "A", "deck_id": own_deck}, {"front": "Q", "back": "A", "deck_id": other_deck}]
+    assert client.post("/cards/batch", json={"cards": cards}, headers=auth_headers).status_code == 404
+    assert client.get(f"/decks/{own_deck}/cards", headers=auth_headers).json() == []
+    assert client.put("/cards/batch", json={"cards": [{"id": other_card, "front": "Hacked"}]}, headers=auth_headers).status_code == 404
+    assert client.post("/cards/batch/delete", json={"ids": [other_card]}, headers=auth_headers).status_code == 404
+
+    with patch("app.main.MAX_CARD_BATCH", 1):
+        assert client.post("/cards/batch", json={"cards": cards[:1] * 2}, headers=auth_headers).status_code == 422
+
+def test_deck_export_import_round_trip(client: TestClient, auth_headers: dict):
+    deck = client.post("/decks/", json={"name": "Biology", "description": "Cells", "tags": ["science"]}, headers=auth_headers).json()
+    cards = [{"front": f"Q{i}", "back": f"A{i}", "deck_id": deck["id"], "status": "MASTERED" if i % 2 else "NEW"} for i in range(5)]
+    client.post("/cards/batch", json={"cards": cards}, headers=auth_headers)
+
+    # Small batches so both directions span several database round trips
+    with patch("app.services.deck_archive.ARCHIVE_BATCH_SIZE", 2):
+        plain = client.get(f"/decks/{deck['id']}/export", headers=auth_headers)
+        compressed = client.get(f"/decks/{deck['id']}/export", params={"gzip": True}, headers=auth_headers)
+        assert plain.headers["content-type"] == "application/x-ndjson"
+        assert compressed.headers["content-disposition"] == f'attachment; filename="deck-{deck["id"]}.ndjson.gz"'
+        assert gzip.decompress(compressed.content) == plain.content
+
+        lines = [json.loads(line) for line in plain.text.splitlines()]
+        assert lines[0] == {"type": "deck", "version": 1, "name": "Biology", "description": "Cells", "notes": "", "tags": ["science"]}
+        assert [line["front"] for line in lines[1:]] == [f"Q{i}" for i in range(5)]
+
+        imported = client.post("/decks/import", content=compressed.content, headers=auth_headers)
+    assert imported.status_code == 200
+    assert imported.json()["cards"] == 5
+    new_deck = imported.json()["deck"]
+    assert new_deck["id"] != deck["id"] and [tag["name"] for tag in new_deck["tags"]] == ["science"]
+    copied = client.get(f"/decks/{new_deck['id']}/cards", headers=auth_headers).json()
+    assert [(c["front"], c["back"], c["status"]) for c in copied] == [(c["front"], c["back"], c["status"]) for c in cards]
+
+def test_deck_import_can_drop_near_duplicates(client: TestClient, auth_headers: dict):
+    lines = [
+        {"type": "deck", "version": 1, "name": "Chemistry"},
+        {"type": "card", "front": "What is the symbol for gold?", "back": "Au"},
+        {"type": "card", "front": "What's the symbol for gold", "back": "Au."},
+        {"type": "card", "front": "What is the symbol for silver?", "back": "Ag"},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines).encode()
+
+    assert client.post("/decks/import", content=body, headers=auth_headers).json()["cards"] == 3
+    result = client.post("/decks/import", params={"dedup": True}, content=body, headers=auth_headers).json()
+    assert (result["cards"], result["duplicates"]) == (2, 1)
+    kept = client.get(f"/decks/{result['deck']['id']}/cards", headers=auth_headers).json()
+    assert [card["back"] for card in kept] == ["Au", "Ag"]
+
+def test_deck_import_reads_the_whole_body_before_writing(client: TestClient, auth_headers: dict):
+    started = []
+    start_deck_import = crud.start_deck_import
+
+    def record_start(*args):
+        started.append(args)
+        return start_deck_import(*args)
+
+    def body(last_line: str):
+        yield (json.dumps({"type": "deck", "version": 1, "name": "Slow"}) + "\n").encode()
+        # The write transaction has not started while the upload is still arriving
+        assert not started
+        yield last_line.encode()
+
+    with patch("app.crud.start_deck_import", record_start):
+        rejected = client.post("/decks/import", content=body("not json"), headers=auth_headers)
+        assert rejected.status_code == 400 and not started
+        imported = client.post("/decks/import", content=body('{"type": "card", "front": "Q", "back": "A"}'), headers=auth_headers)
+    assert imported.status_code == 200 and imported.json()["cards"] == 1
+    assert len(started) == 1
+
+def test_deck_import_rejects_malformed_archives(client: TestClient, auth_headers: dict):
+    header = json.dumps({"type": "deck", "version": 1, "name": "Broken"})
+    bad_archives = [
+        b"",
+        b'{"type": "card", "front": "Q", "back": "A"}',
+        json.dumps({"type": "deck", "version": 99, "name": "Future"}).encode(),
+        (header + '\n{"type": "card", "front": "Q", "back": "A"}\nnot json\n').encode(),
+        (header + '\n{"type": "card", "front": "Q"}\n').encode(),
+        b"\x1f\x8b not really gzip",
+    ]
+    for body in bad_archives:
+        response = client.post("/decks/import", content=body, headers=auth_headers)
+        assert response.status_code == 400, body
+    # Nothing from the partial imports was kept
+    assert client.get("/decks/", headers=auth_headers).json() == []
+    assert client.get("/decks/1/export", headers=auth_headers).status_code == 404
+
+def stats_by_deck(client: TestClient, headers: dict) -> dict:
+    response = client.get("/decks/stats", headers=headers)
+    assert response.status_code == 200
+    return {stats["deck_id"]: (stats["total"], stats["counts"]) for stats in response.json()}
+
+@pytest.mark.parametrize("counters", [False, True])
+def test_deck_stats_follow_every_card_write(client: TestClient, auth_headers: dict, counters: bool):
+    with patch("app.crud.DECK_STATS_COUNTERS", counters):
+        deck_a = client.post("/decks/", json={"name": "A"}, headers=auth_headers).json()["id"]
+        deck_b = client.post("/decks/", json={"name": "B"}, headers=auth_headers).json()["id"]
+        empty = {"NEW": 0, "REVIEWING": 0, "MASTERED": 0}
+        assert stats_by_deck(client, auth_headers) == {deck_a: (0, empty), deck_b: (0, empty)}
+
+        card = client.post("/cards/", json={"front": "Q", "back": "A", "deck_id": deck_a}, headers=auth_headers).json()["id"]
+        batch = [{"front": f"Q{i}", "back": "A", "deck_id": deck_b} for i in range(4)]
+        ids = client.post("/cards/batch", json={"cards": batch}, headers=auth_headers).json()["ids"]
+        client.put(f"/cards/{card}", json={"status": "MASTERED"}, headers=auth_headers)
+        client.put(f"/cards/{card}", json={"front": "Edited"}, headers=auth_headers)
+        client.put("/cards/batch", json={"cards": [{"id": ids[0], "status": "REVIEWING"}, {"id": ids[1], "status": "MASTERED"}]}, headers=auth_headers)
+        client.post("/cards/batch/delete", json={"ids": [ids[1], ids[2]]}, headers=auth_headers)
+        client.delete(f"/cards/{ids[3]}", headers=auth_headers)
+        assert stats_by_deck(client, auth_headers) == {
+            deck_a: (1, {"NEW": 0, "REVIEWING": 0, "MASTERED": 1}),
+            deck_b: (1, {"NEW": 0, "REVIEWING": 1, "MASTERED": 0}),
+        }
+
+        imported = client.post("/decks/import", content=client.get(f"/decks/{deck_a}/export", headers=auth_headers).content, headers=auth_headers)
+        deck_c = imported.json()["deck"]["id"]
+        client.delete(f"/decks/{deck_b}", headers=auth_headers)
+        stats = stats_by_deck(client, auth_headers)
+        assert stats == {deck_a: stats[deck_a], deck_c: (1, {"NEW": 0, "REVIEWING": 0, "MASTERED": 1})}
+
+def test_deck_card_counts_rebuild(client: TestClient, auth_headers: dict, session: Session):
+    deck_id = client.post("/decks/", json={"name": "Before"}, headers=auth_headers).json()["id"]
+    cards = [{"front": f"Q{i}", "back": "A", "deck_id": deck_id, "status": "NEW" if i else "MASTERED"} for i in range(3)]
+    client.post("/cards/batch", json={"cards": cards}, headers=auth_headers)
+    with patch("app.crud.DECK_STATS_COUNTERS", True):
+        # Written while counters were off, so nothing was counted yet
+        assert stats_by_deck(client, auth_headers)[deck_id][0] == 0
+        crud.rebuild_deck_card_counts(session)
+        assert stats_by_deck(client, auth_headers)[deck_id] == (3, {"NEW": 2, "REVIEWING": 0, "MASTERED": 1})
+
+def test_review_schedules_cards_and_queue_orders_by_due_date(client: TestClient, auth_headers: dict):
+    deck_a = client.post("/decks/", json={"name": "A"}, headers=auth_headers).json()["id"]
+    deck_b = client.post("/decks/", json={"name": "B"}, headers=auth_headers).json()["id"]
+    first = client.post("/cards/", json={"front": "Q1", "back": "A", "deck_id": deck_a}, headers=auth_headers).json()
+    ids = client.post("/cards/batch", json={"cards": [{"front": "Q2", "back": "A", "deck_id": deck_b}]}, headers=auth_headers).json()["ids"]
+    assert (first["interval_days"], first["ease"], first["repetitions"]) == (0, 2.5, 0)
+
+    # New cards are due immediately, across decks, oldest first
+    queue = client.get("/review/next", headers=auth_headers).json()
+    assert [card["id"] for card in queue] == [first["id"], ids[0]]
+
+    reviewed = client.post(f"/cards/{first['id']}/review", json={"grade": 4}, headers=auth_headers)
+    assert reviewed.status_code == 200
+    assert reviewed.json()["interval_days"] == 1 and reviewed.json()["status"] == "REVIEWING"
+    assert [card["id"] for card in client.get("/review/next", headers=auth_headers).json()] == ids
+    assert client.get("/review/next", params={"limit": 0}, headers=auth_headers).status_code == 422
+
+    assert client.post(f"/cards/{first['id']}/review", json={"grade": 6}, headers=auth_headers).status_code == 422
+    assert client.post("/cards/9999/review", json={"grade": 3}, headers=auth_headers).status_code == 404
+
+def search(client: TestClient, headers: dict, q: str) -> list:
+    response = client.get("/search/cards", params={"q": q}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_card_search(client: TestClient, auth_headers: dict, fts: bool):
+    deck_id = client.post("/decks/", json={"name": "Biology"}, headers=auth_headers).json()["id"]
+    cards = [
+        {"front": "What does <b>ATP</b> stand for?", "back": "Adenosine triphosphate", "deck_id": deck_id},
+        {"front": "Where is energy made?", "back": "The mitochondria, which produce ATP", "deck_id": deck_id},
+        {"front": "Café vocabulary", "back": "Résumé", "deck_id": deck_id},
+    ]
+    ids = client.post("/cards/batch", json={"cards": cards}, headers=auth_headers).json()["ids"]
+    client.post("/register", json={"username": "other", "password": "password"})
+    other_token = client.post("/token", data={"username": "other", "password": "password"}).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {other_token}"}
+
+    with patch("app.search.has_card_search", return_value=fts):
+        hits = search(client, auth_headers, "atp")
+        assert {hit["id"] for hit in hits} == {ids[0], ids[1]}
+        if fts:
+            # A match on the front outranks one on the back, and the snippet is escaped
+            assert hits[0]["id"] == ids[0]
+            assert hits[0]["snippet"] == "What does &lt;b&gt;<mark>ATP</mark>&lt;/b&gt; stand for?"
+            assert [hit["id"] for hit in search(client, auth_headers, "mitochond")] == [ids[1]]
+            assert [hit["id"] for hit in search(client, auth_headers, "resume")] == [ids[2]]
+        assert [hit["id"] for hit in search(client, auth_headers, "energy ATP")] == [ids[1]]
+        assert search(client, other_headers, "atp") == []
+        # FTS5 syntax in the query is treated as plain words
+        assert search(client, auth_headers, 'NEAR( "atp" OR *') == []
+        assert search(client, auth_headers, "!!!") == []
+        # ...and so are LIKE wildcards
+        assert search(client, auth_headers, "a_p") == []
+
+        client.put(f"/cards/{ids[0]}", json={"front": "Renamed"}, headers=auth_headers)
+        client.delete(f"/cards/{ids[1]}", headers=auth_headers)
+        assert search(client, auth_headers, "atp") == []
+        assert [hit["id"] for hit in search(client, auth_headers, "renamed")] == [ids[0]]
+    assert client.get("/search/cards", params={"q": ""}, headers=auth_headers).status_code == 422
+
+def test_deck_reads_answer_conditional_gets(client: TestClient, auth_headers: dict):
+    deck_id = client.post("/decks/", json={"name": "Cached"}, headers=auth_headers).json()["id"]
+    card_id = client.post("/cards/", json={"front": "Q", "back": "A", "deck_id": deck_id}, headers=auth_headers).json()["id"]
+    cards_url = f"/decks/{deck_id}/cards"
+
+    def revalidate(url: str, etag: str, headers: dict = auth_headers):
+        return client.get(url, headers={**headers, "If-None-Match": etag})
+
+    first = client.get(cards_url, headers=auth_headers)
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"') and first.headers["cache-control"] == "private, no-cache"
+    assert first.headers["last-modified"].endswith(" GMT")
+    cached = revalidate(cards_url, f'"other", {etag.removeprefix("W/")}')
+    assert cached.status_code == 304 and cached.content == b"" and cached.headers["etag"] == etag
+    # Another page or filter is another representation
+    assert revalidate(cards_url + "?status=NEW", etag).status_code == 200
+
+    # Every write to the deck or its cards changes the ETag
+    writes = [
+        lambda: client.put(f"/cards/{card_id}", json={"front": "Edited"}, headers=auth_headers),
+        lambda: client.post(f"/cards/{card_id}/review", json={"grade": 5}, headers=auth_headers),
+        lambda: client.post("/cards/batch", json={"cards": [{"front": "B", "back": "A", "deck_id": deck_id}]}, headers=auth_headers),
+        lambda: client.put("/cards/batch", json={"cards": [{"id": card_id, "status": "MASTERED"}]}, headers=auth_headers),
+        lambda: client.put(f"/decks/{deck_id}", json={"tags": ["new"]}, headers=auth_headers),
+        lambda: client.delete(f"/cards/{card_id}", headers=auth_headers),
+    ]
+    list_etag = client.get("/decks/", headers=auth_headers).headers["etag"]
+    for write in writes:
+        assert write().status_code == 200
+        response = revalidate(cards_url, etag)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert revalidate(cards_url, etag).status_code == 304
+    assert revalidate("/decks/", list_etag).status_code == 200
+
+    list_etag = client.get("/decks/", headers=auth_headers).headers["etag"]
+    assert revalidate("/decks/", list_etag).status_code == 304
+    client.post("/decks/", json={"name": "Another"}, headers=auth_headers)
+    assert revalidate("/decks/", list_etag).status_code == 200
+
+    # An ETag never carries over to another user
+    client.post("/register", json={"username": "other", "password": "password"})
+    other_token = client.post("/token", data={"username": "other", "password": "password"}).json()["access_token"]
+    other_headers = {"Authorization": f"Bearer {other_token}"}
+    assert revalidate(cards_url, etag, other_headers).status_code == 404
+
+def test_a_recreated_deck_does_not_inherit_etags(client: TestClient, auth_headers: dict):
+    def deck_with_card(front: str) -> int:
+        deck_id = client.post("/decks/", json={"name": "Reused"}, headers=auth_headers).json()["id"]
+        client.post("/cards/", json={"front": front, "back": "A", "deck_id": deck_id}, headers=auth_headers)
+        return deck_id
+
+    def imported_deck(front: str) -> int:
+        lines = [{"type": "deck", "version": 1, "name": "Reused"}, {"type": "card", "front": front, "back": "A"}]
+        body = "\n".join(json.dumps(line) for line in lines).encode()
+        return client.post("/decks/import", content=body, headers=auth_headers).json()["deck"]["id"]
+
+    for recreate in (deck_with_card, imported_deck):
+        deck_id = deck_with_card("Old")
+        etag = client.get(f"/decks/{deck_id}/cards", headers=auth_headers).headers["etag"]
+        client.delete(f"/decks/{deck_id}", headers=auth_headers)
+        # SQLite reuses the id, and the new deck reaches the same version number
+        assert recreate("New") == deck_id
+        response = client.get(f"/decks/{deck_id}/cards", headers={**auth_headers, "If-None-Match": etag})
+        assert response.status_code == 200 and response.json()[0]["front"] == "New"
+        client.delete(f"/decks/{deck_id}", headers=auth_headers)
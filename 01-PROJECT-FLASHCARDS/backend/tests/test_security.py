@@ -1,6 +1,11 @@
 import pytest
+from unittest.mock import patch
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlmodel import Session, select
+from app import crud
+from app.auth import user_cache
+from app.models import User
+from app.services.password_hasher import PasswordHasher
 
 def test_user_data_isolation(client: TestClient, session: Session):
     # 1. Register and Login User A
@@ -62,3 +67,65 @@ def test_card_isolation(client: TestClient):
     
     # Bob tries to update Alice's card
     assert client.put(f"/cards/{card_id}", json={"front": "Bob was here"}, headers=headers_b).status_code == 404
+
+def login(client: TestClient, username: str) -> dict:
+    client.post("/register", json={"username": username, "password": "password"})
+    token = client.post("/token", data={"username": username, "password": "password"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def test_authenticated_user_is_cached(client: TestClient):
+    headers = login(client, "carol")
+    with patch("app.main.crud.get_user_by_username", wraps=crud.get_user_by_username) as lookup:
+        for _ in range(5):
+            assert client.get("/decks/", headers=headers).status_code == 200
+        assert client.get("/users/me", headers=headers).json()["username"] == "carol"
+    assert lookup.call_count == 1
+
+def test_user_changes_invalidate_cached_identity(client: TestClient, session: Session):
+    headers = login(client, "dave")
+    client.get("/users/me", headers=headers)
+    assert user_cache.get("dave") is not None
+
+    user = session.exec(select(User).where(User.username == "dave")).one()
+    user.email = "dave@example.com"
+    session.add(user)
+    session.commit()
+
+    assert user_cache.get("dave") is None
+    assert client.get("/users/me", headers=headers).json()["email"] == "dave@example.com"
+
+def test_token_user_id_skips_user_lookup(client: TestClient):
+    headers = login(client, "erin")
+    deck_id = client.post("/decks/", json={"name": "Erin Deck"}, headers=headers).json()["id"]
+    with patch("app.main.AUTH_TOKEN_USER_ID", True):
+        with patch("app.main.crud.get_user_by_username", wraps=crud.get_user_by_username) as lookup:
+            user_cache.clear()
+            assert client.get(f"/decks/{deck_id}", headers=headers).status_code == 200
+            # /users/me needs the full record, so it still looks the user up
+            client.get("/users/me", headers=headers)
+    assert lookup.call_count == 1
+
+@pytest.mark.asyncio
+async def test_password_hasher_runs_in_worker_processes():
+    hasher = PasswordHasher(rounds=4, workers=1)
+    try:
+        hashed = await hasher.hash("secret")
+        assert hashed.startswith("$2b$04$")
+        assert await hasher.verify("secret", hashed) == (True, None)
+        assert (await hasher.verify("wrong", hashed))[0] is False
+    finally:
+        hasher.shutdown()
+
+def test_login_rehashes_when_rounds_change(client: TestClient, session: Session):
+    with patch("app.main.password_hasher", PasswordHasher(rounds=4, workers=0)):
+        login(client, "frank")
+    stored = session.exec(select(User).where(User.username == "frank")).one().hashed_password
+    assert stored.startswith("$2b$04$")
+
+    hasher = PasswordHasher(rounds=5, workers=0)
+    with patch("app.main.password_hasher", hasher):
+        assert client.post("/token", data={"username": "frank", "password": "password"}).status_code == 200
+        assert client.post("/token", data={"username": "frank", "password": "password"}).status_code == 200
+    session.expire_all()
+    assert session.exec(select(User).where(User.username == "frank")).one().hashed_password.startswith("$2b$05$")
+    assert hasher.rehashes == 1
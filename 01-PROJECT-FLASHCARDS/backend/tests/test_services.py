@@ -1,7 +1,23 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+import asyncio
 import pytest
+from contextlib import asynccontextmanager
 from unittest.mock import MagicMock, patch, AsyncMock
-from app.services.ai_agent import FlashcardAgent
-from app.models import CardCreate
+from fastapi.testclient import TestClient
+from app.main import app, get_agent
+from app.services.ai_agent import FlashcardAgent, IncrementalCardParser, extract_text_from_pdf, split_text_into_chunks
+from app.services.fake_model import FakeGenerativeModel, FAKE_MODEL_NAME
+from app.services.llm_runtime import LLMExecutor, LLMTimeoutError
+from app.services.mcp_pool import MCPSessionPool, MCPPoolTimeoutError
+from app.services.response_cache import ResponseCache
+from app.services import dedup
+from app.services.dedup import NearDuplicateIndex
+from app.services.scheduler import sm2
+from app.models import CardCreate, CardStatus
 
 class TestFlashcardAgent:
     @pytest.fixture
@@ -155,6 +171,31 @@ class TestFlashcardAgent:
                         prompt = call_args[0][0]
                         assert "pages 2 to 5" in prompt
 
+    @pytest.mark.asyncio
+    async def test_model_cannot_choose_the_file_or_its_cache_key(self, mock_genai):
+        with patch("os.getenv", return_value="fake_key"):
+            agent = FlashcardAgent()
+        tool_call = MagicMock()
+        tool_call.function_call.name = "extract_text_from_pdf"
+        # As if a prompt injection in the document asked for another user's cached pages
+        tool_call.function_call.args = {
+            "start_page": 1, "end_page": 2, "pdf_path": "/etc/passwd", "pdf_sha256": "someone-elses-hash",
+        }
+        first = MagicMock(candidates=[MagicMock(content=MagicMock(parts=[tool_call]))])
+        final = MagicMock(text='[{"front": "Q", "back": "A"}]', candidates=[MagicMock(content=MagicMock(parts=[]))])
+        chat = MagicMock()
+        chat.send_message.side_effect = [first, final]
+
+        with patch("app.services.ai_agent.genai.GenerativeModel") as mock_model_class, \
+                patch.object(agent, "_call_extract_tool", AsyncMock(return_value="Page content")) as mock_extract:
+            mock_model_class.return_value.start_chat.return_value = chat
+            await agent.generate_from_pdf(b"pdf", start_page=1, end_page=2)
+
+        tool_args = mock_extract.call_args.args[0]
+        assert tool_args["pdf_sha256"] == hashlib.sha256(b"pdf").hexdigest()
+        assert tool_args["pdf_path"] != "/etc/passwd"
+        assert set(tool_args) == {"start_page", "end_page", "pdf_path", "pdf_sha256"}
+
     @pytest.mark.asyncio
     async def test_refine_flashcards_success(self, mock_genai):
         with patch("os.getenv", return_value="fake_key"):
@@ -176,3 +217,385 @@ class TestFlashcardAgent:
             assert "Old Q" in args
             assert "Make it better" in args
             assert "Source text" in args
+
+
+class TestMCPSessionPool:
+    @pytest.fixture
+    def mock_genai(self):
+        with patch("app.services.ai_agent.genai") as mock:
+            yield mock
+
+    @pytest.fixture
+    def mock_mcp(self):
+        with patch("app.services.mcp_pool.stdio_client") as mock_stdio_client:
+            with patch("app.services.mcp_pool.ClientSession") as mock_client_session:
+                mock_stdio_client.return_value.__aenter__.return_value = (None, None)
+                session_instance = mock_client_session.return_value.__aenter__.return_value
+                session_instance.initialize = AsyncMock()
+                session_instance.send_ping = AsyncMock()
+                yield mock_stdio_client, session_instance
+
+    @pytest.mark.asyncio
+    async def test_sessions_are_reused_across_checkouts(self, mock_mcp):
+        mock_stdio_client, session_instance = mock_mcp
+        pool = MCPSessionPool(size=1)
+        await pool.start()
+        try:
+            async with pool.session() as first:
+                pass
+            async with pool.session() as second:
+                pass
+            assert first is second is session_instance
+            assert mock_stdio_client.call_count == 1
+            assert session_instance.initialize.await_count == 1
+            assert pool.stats()["checkouts"] == 2
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_checkout_times_out_when_pool_exhausted(self, mock_mcp):
+        pool = MCPSessionPool(size=1, checkout_timeout=0.05)
+        await pool.start()
+        try:
+            async with pool.session():
+                with pytest.raises(MCPPoolTimeoutError):
+                    async with pool.session():
+                        pass
+            assert pool.stats()["checkout_timeouts"] == 1
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_crashed_connection_is_restarted_on_checkout(self, mock_mcp):
+        mock_stdio_client, session_instance = mock_mcp
+        pool = MCPSessionPool(size=1)
+        await pool.start()
+        try:
+            # Simulate the server process exiting underneath the pool
+            await pool._connections[0].close()
+            assert pool.stats()["live"] == 0
+
+            async with pool.session() as session:
+                assert session is session_instance
+            assert pool.stats()["restarts"] == 1
+            assert mock_stdio_client.call_count == 2
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_failed_health_check_triggers_restart(self, mock_mcp):
+        mock_stdio_client, session_instance = mock_mcp
+        session_instance.send_ping = AsyncMock(side_effect=RuntimeError("broken pipe"))
+        pool = MCPSessionPool(size=1, health_check_interval=0)
+        await pool.start()
+        try:
+            async with pool.session():
+                pass
+            assert pool.stats()["restarts"] == 1
+        finally:
+            await pool.close()
+
+    @pytest.mark.asyncio
+    async def test_agent_uses_pooled_session(self, mock_genai):
+        session_instance = MagicMock()
+        session_instance.call_tool = AsyncMock(return_value=MagicMock(content=[MagicMock(text="Pooled text")]))
+
+        pool = MagicMock()
+
+        @asynccontextmanager
+        async def pooled_session():
+            yield session_instance
+        pool.session = pooled_session
+
+        mock_call = MagicMock()
+        mock_call.name = "extract_text_from_pdf"
+        mock_call.args = {"start_page": 1, "end_page": -1}
+        mock_response_1 = MagicMock()
+        mock_response_1.candidates = [MagicMock(content=MagicMock(parts=[MagicMock(function_call=mock_call)]))]
+        mock_response_2 = MagicMock()
+        mock_response_2.text = '[{"front": "Q1", "back": "A1"}]'
+        mock_response_2.candidates = [MagicMock(content=MagicMock(parts=[]))]
+        mock_chat = MagicMock()
+        mock_chat.send_message.side_effect = [mock_response_1, mock_response_2]
+
+        with patch("os.getenv", return_value="fake_key"):
+            with patch("app.services.ai_agent.stdio_client") as mock_stdio_client:
+                with patch("app.services.ai_agent.genai.GenerativeModel") as mock_model_class:
+                    mock_model_class.return_value.start_chat.return_value = mock_chat
+
+                    agent = FlashcardAgent(mcp_pool=pool)
+                    result, text = await agent.generate_from_pdf(b"pdf")
+
+                    assert text == "Pooled text"
+                    assert result[0].front == "Q1"
+                    mock_stdio_client.assert_not_called()
+
+
+class TestChunkedGeneration:
+    @pytest.fixture
+    def fake_agent(self):
+        with patch.dict(os.environ, {"GEMINI_MODEL": FAKE_MODEL_NAME}):
+            agent = FlashcardAgent()
+        assert agent.is_fake
+        return agent
+
+    def test_split_text_keeps_pages_whole(self):
+        text = "\n\n".join(f"--- Page {i} ---\n" + "x" * 40 for i in range(1, 6))
+        chunks = split_text_into_chunks(text, max_chars=120)
+
+        assert len(chunks) == 3
+        assert chunks[0].startswith("--- Page 1 ---") and "--- Page 2 ---" in chunks[0]
+        assert chunks[-1].startswith("--- Page 5 ---")
+        assert "".join(chunks).count("--- Page") == 5
+
+    @pytest.mark.asyncio
+    async def test_chunks_generate_concurrently_within_limit(self, fake_agent):
+        fake_agent.model.delay = 0.05
+        text = "\n\n".join(f"--- Page {i} ---\nTopic number {i} is important." for i in range(1, 9))
+
+        cards = await fake_agent.generate_from_text_chunked(text, max_chars=60, max_concurrency=3)
+
+        assert fake_agent.model.calls == 8
+        assert 1 < fake_agent.model.max_active <= 3
+        assert [card.back for card in cards] == [f"Topic number {i} is important." for i in range(1, 9)]
+
+    @pytest.mark.asyncio
+    async def test_merge_pass_drops_repeated_questions(self, fake_agent):
+        text = "\n\n".join([
+            "--- Page 1 ---\nPhotosynthesis converts light into energy.",
+            "--- Page 2 ---\nPhotosynthesis converts light into energy!",
+            "--- Page 3 ---\nMitochondria produce ATP.",
+        ])
+
+        cards = await fake_agent.generate_from_text_chunked(text, max_chars=10)
+
+        assert len(cards) == 2
+        assert cards[1].back == "Mitochondria produce ATP."
+
+    @pytest.mark.asyncio
+    async def test_generate_from_pdf_path_chunked_mode(self, fake_agent):
+        extracted = "--- Page 1 ---\nCells are the unit of life."
+        with patch.object(fake_agent, "_call_extract_tool", AsyncMock(return_value=extracted)) as mock_extract:
+            cards, source_text = await fake_agent.generate_from_pdf_path("/tmp/doc.pdf", start_page=1, end_page=3, pdf_sha256="abc")
+
+        assert source_text == extracted
+        assert cards == [CardCreate(front="What does the text say about Cells are the unit of?", back="Cells are the unit of life.")]
+        mock_extract.assert_awaited_once_with({"pdf_path": "/tmp/doc.pdf", "start_page": 1, "end_page": 3, "pdf_sha256": "abc"})
+
+
+class TestStreamingGeneration:
+    def test_parser_emits_cards_across_arbitrary_chunk_boundaries(self):
+        text = '```json\n[{"front": "Q {1}", "back": "A \\"1\\""}, {"front": "no back"}, {"front": "Q2", "back": "[A2]"}]\n```'
+        for size in (1, 2, 5, len(text)):
+            parser = IncrementalCardParser()
+            cards = []
+            for i in range(0, len(text), size):
+                cards.extend(parser.feed(text[i:i + size]))
+            assert [(c.front, c.back) for c in cards] == [("Q {1}", 'A "1"'), ("Q2", "[A2]")]
+
+    def test_parser_yields_first_card_before_array_closes(self):
+        parser = IncrementalCardParser()
+        assert parser.feed('[{"front": "Q1", "back": "A1"}, {"front": "Q') == [CardCreate(front="Q1", back="A1")]
+        assert parser.feed('2", "back": "A2"}]') == [CardCreate(front="Q2", back="A2")]
+
+    @pytest.mark.asyncio
+    async def test_stream_reports_progress_then_cards(self):
+        async def fake_tool(name, args):
+            if name == "count_pdf_pages":
+                return "5"
+            return "\n\n".join(f"--- Page {p} ---\nFact number {p}." for p in range(args["start_page"], args["end_page"] + 1))
+
+        with patch.dict(os.environ, {"GEMINI_MODEL": FAKE_MODEL_NAME}):
+            agent = FlashcardAgent()
+        with patch.object(agent, "_call_tool", side_effect=fake_tool):
+            events = [event async for event in agent.stream_from_pdf_path("/tmp/doc.pdf", start_page=2, batch_pages=2)]
+
+        progress = [e for e in events if e["type"] == "progress" and e["stage"] == "extracting"]
+        assert [(e["pages_done"], e["total_pages"]) for e in progress] == [(0, 4), (2, 4), (4, 4)]
+        cards = [e["card"] for e in events if e["type"] == "card"]
+        assert [c["back"] for c in cards] == [f"Fact number {p}." for p in range(2, 6)]
+        assert events[-1]["type"] == "done"
+        assert events[-1]["card_count"] == 4
+
+
+class TestLLMExecutor:
+    @pytest.mark.asyncio
+    async def test_call_times_out(self):
+        executor = LLMExecutor(max_concurrency=1, timeout=0.05)
+        with pytest.raises(LLMTimeoutError):
+            await executor.run(time.sleep, 0.3)
+        assert executor.stats()["timeouts"] == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_bounded(self):
+        model = FakeGenerativeModel(delay=0.05)
+        executor = LLMExecutor(max_concurrency=2)
+        await asyncio.gather(*(executor.run(model.generate_content, "prompt") for _ in range(6)))
+        assert model.max_active == 2
+
+
+class TestAgentReuse:
+    def test_model_handles_are_cached_per_tool_set(self):
+        with patch("app.services.ai_agent.genai") as mock_genai:
+            mock_genai.GenerativeModel.side_effect = lambda *args, **kwargs: MagicMock()
+            with patch("os.getenv", return_value="fake_key"):
+                agent = FlashcardAgent()
+
+            with_tools = agent.get_model(tools=(extract_text_from_pdf,))
+            assert agent.get_model(tools=(extract_text_from_pdf,)) is with_tools
+            assert agent.get_model() is agent.model is not with_tools
+            assert mock_genai.GenerativeModel.call_count == 2
+            mock_genai.configure.assert_called_once()
+
+    def test_lifespan_creates_one_shared_agent(self):
+        with patch.dict(os.environ, {"GEMINI_MODEL": FAKE_MODEL_NAME}):
+            with patch("app.main.MCP_POOL_SIZE", 0):
+                with TestClient(app):
+                    agent = app.state.agent
+                    assert isinstance(agent, FlashcardAgent)
+                    request = MagicMock()
+                    request.app = app
+                    assert get_agent(request) is get_agent(request) is agent
+        assert app.state.agent is None
+
+
+class TestRefineCache:
+    def test_lru_bound_and_ttl(self):
+        cache = ResponseCache(max_entries=2, max_bytes=1024, ttl=60)
+        cache.put("a", [1])
+        cache.put("b", [2])
+        assert cache.get("a") == [1]
+        cache.put("c", [3])  # evicts "b", the least recently used
+        assert cache.get("b") is None
+        assert cache.get("a") == [1] and cache.get("c") == [3]
+
+        with patch("app.services.response_cache.time.time", return_value=time.time() + 61):
+            assert cache.get("a") is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_disk_tier_survives_a_new_instance(self, tmp_path):
+        path = str(tmp_path / "refine.db")
+        ResponseCache(db_path=path).put("key", [{"front": "Q", "back": "A"}], tokens=50)
+
+        cache = ResponseCache(db_path=path)
+        assert cache.get("key") == [{"front": "Q", "back": "A"}]
+        stats = cache.stats()
+        assert stats["disk_hits"] == 1 and stats["saved_tokens"] == 50
+
+    @pytest.mark.asyncio
+    async def test_identical_refine_requests_skip_the_model(self):
+        cache = ResponseCache()
+        with patch.dict(os.environ, {"GEMINI_MODEL": FAKE_MODEL_NAME}):
+            agent = FlashcardAgent(refine_cache=cache)
+        agent.model = MagicMock()
+        agent.model.generate_content.return_value = MagicMock(
+            text='[{"front": "New Q", "back": "New A"}]',
+            usage_metadata=MagicMock(total_token_count=321),
+        )
+        cards = [CardCreate(front="Q", back="A")]
+
+        first = await agent.refine_flashcards(cards, "Source text", "Make it better")
+        second = await agent.refine_flashcards(cards, "Source text", "Make it better")
+        assert first == second == [CardCreate(front="New Q", back="New A")]
+        assert agent.model.generate_content.call_count == 1
+
+        await agent.refine_flashcards(cards, "Source text", "Shorter answers")
+        assert agent.model.generate_content.call_count == 2
+
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 2
+        assert stats["saved_tokens"] == 321
+
+    @pytest.mark.asyncio
+    async def test_slow_disk_tier_does_not_block_the_event_loop(self, tmp_path):
+        cache = ResponseCache(db_path=str(tmp_path / "refine.db"))
+        with patch.dict(os.environ, {"GEMINI_MODEL": FAKE_MODEL_NAME}):
+            agent = FlashcardAgent(refine_cache=cache)
+        entered, release, returned = threading.Event(), threading.Event(), threading.Event()
+        disk_get = cache._disk_get
+
+        def busy_disk_get(key, now):
+            # Stands in for a cache file another worker holds locked
+            entered.set()
+            release.wait(5)
+            returned.set()
+            return disk_get(key, now)
+
+        with patch.object(cache, "_disk_get", side_effect=busy_disk_get):
+            task = asyncio.create_task(agent.refine_flashcards([CardCreate(front="Q", back="A")], "Text", "Better"))
+            try:
+                while not entered.is_set():
+                    await asyncio.sleep(0.01)
+                # Running here at all means the loop is free; the memory tier is too
+                assert cache.stats()["misses"] == 0
+                assert not returned.is_set()
+            finally:
+                release.set()
+            await task
+        assert cache.stats()["misses"] == 1
+
+
+class TestScheduler:
+    def test_sm2_intervals_grow_and_reset(self):
+        now = datetime(2024, 1, 1)
+        first = sm2(0, 2.5, 0, 4, now)
+        assert (first.interval_days, first.repetitions, first.due_at) == (1, 1, datetime(2024, 1, 2))
+        second = sm2(first.interval_days, first.ease, first.repetitions, 4, now)
+        assert second.interval_days == 6
+        third = sm2(second.interval_days, second.ease, second.repetitions, 5, now)
+        assert third.interval_days == round(6 * second.ease) and third.ease > second.ease
+        assert third.status == CardStatus.REVIEWING
+
+        forgotten = sm2(third.interval_days, third.ease, third.repetitions, 1, now)
+        assert (forgotten.interval_days, forgotten.repetitions) == (1, 0)
+        assert forgotten.ease < third.ease
+
+    def test_sm2_ease_floor_and_mastery(self):
+        now = datetime(2024, 1, 1)
+        assert sm2(1, 1.3, 0, 0, now).ease == 1.3
+        assert sm2(20, 2.5, 5, 5, now).status == CardStatus.MASTERED
+
+
+class TestDedup:
+    def test_rephrased_cards_are_duplicates_and_different_ones_are_not(self):
+        index = NearDuplicateIndex()
+        index.add("cell", "What is the powerhouse of the cell?", "Mitochondria")
+        index.add("france", "What is the capital of France?", "Paris")
+
+        assert index.find("What's the powerhouse of a cell", "mitochondria.") == "cell"
+        assert index.find("WHAT IS THE CAPITAL OF FRANCE", "Paris!") == "france"
+        assert index.find("What is the capital of Spain?", "Madrid") is None
+        assert index.find("What does ATP stand for?", "Adenosine triphosphate") is None
+
+    def test_drop_duplicates_keeps_first_occurrence(self):
+        cards = [
+            CardCreate(front="Define osmosis", back="Diffusion of water across a membrane"),
+            CardCreate(front="Define osmosis.", back="Diffusion of water across a membrane."),
+            CardCreate(front="Define diffusion", back="Movement from high to low concentration"),
+        ]
+        assert NearDuplicateIndex().drop_duplicates(cards) == ([cards[0], cards[2]], 1)
+
+    def test_a_shared_short_answer_does_not_make_lookups_linear(self):
+        index = NearDuplicateIndex()
+        index.add_rows((f"Question {i} about topic {i * 7919 % 10007}?", "Yes") for i in range(5000))
+        new_cards = [CardCreate(front=f"Is {hashlib.md5(str(i).encode()).hexdigest()[:16]} true?", back="Yes") for i in range(50)]
+        with patch("app.services.dedup.similarity", wraps=dedup.similarity) as compared:
+            kept, dropped = index.drop_duplicates(new_cards)
+        assert (len(kept), dropped) == (50, 0)
+        # Each lookup reads at most one capped bucket per band, not every "Yes" card
+        assert compared.call_count <= len(new_cards) * dedup.BANDS * dedup.MAX_BUCKET_SIZE
+
+    def test_large_deck_lookups_stay_fast(self):
+        rows = [(f"Question {i} about topic {i * 7919 % 10007}?", f"Answer number {i} in detail") for i in range(20000)]
+        index = NearDuplicateIndex()
+        start = time.perf_counter()
+        index.add_rows(rows)
+        kept, dropped = index.drop_duplicates([
+            # A rephrasing of row 123
+            CardCreate(front="Question 123 about the topic 3358", back="Answer number 123 in detail."),
+            CardCreate(front="Who wrote Hamlet?", back="Shakespeare"),
+        ])
+        # Banding keeps this far from 20000 x 20000 comparisons
+        assert time.perf_counter() - start < 30
+        assert (len(index), dropped) == (20001, 1)
+        assert [card.front for card in kept] == ["Who wrote Hamlet?"]
@@ -11,6 +11,7 @@ vi.mock('../api', () => ({
     updateDeck: vi.fn(),
     getCards: vi.fn(),
     createCard: vi.fn(),
+    createCards: vi.fn(),
     updateCard: vi.fn(),
     deleteCard: vi.fn(),
     generateCards: vi.fn(),
@@ -9,6 +9,7 @@ vi.mock('../api', () => ({
     getDeck: vi.fn(),
     getCards: vi.fn(),
     createCard: vi.fn(),
+    createCards: vi.fn(),
     generateCards: vi.fn(),
     deleteCard: vi.fn(),
     refineCards: vi.fn(),
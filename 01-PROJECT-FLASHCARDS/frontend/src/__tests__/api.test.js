@@ -23,13 +23,24 @@ vi.mock('axios', () => {
 describe('API functions', () => {
     it('getDecks fetches decks successfully', async () => {
         const mockDecks = [{ id: 1, name: 'Test Deck' }];
-        api.get.mockResolvedValue({ data: mockDecks });
+        api.get.mockResolvedValue({ data: mockDecks, headers: {} });
 
         const result = await getDecks();
-        expect(api.get).toHaveBeenCalledWith('/decks/');
+        expect(api.get).toHaveBeenCalledWith('/decks/', { params: {} });
         expect(result).toEqual(mockDecks);
     });
 
+    it('getDecks follows the next-page cursor', async () => {
+        api.get.mockReset();
+        api.get
+            .mockResolvedValueOnce({ data: [{ id: 1 }], headers: { 'x-next-cursor': 'abc' } })
+            .mockResolvedValueOnce({ data: [{ id: 2 }], headers: {} });
+
+        const result = await getDecks();
+        expect(api.get).toHaveBeenLastCalledWith('/decks/', { params: { cursor: 'abc' } });
+        expect(result).toEqual([{ id: 1 }, { id: 2 }]);
+    });
+
     it('createDeck posts new deck', async () => {
         const newDeck = { name: 'New Deck' };
         const responseData = { id: 2, ...newDeck };
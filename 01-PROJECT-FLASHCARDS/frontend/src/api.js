@@ -45,9 +45,20 @@ export const registerUser = async (username, password, email) => {
     return response.data;
 };
 
+// List endpoints are paginated: the cursor for the next page comes back in X-Next-Cursor
+const getAllPages = async (url, params = {}) => {
+    const items = [];
+    let cursor = null;
+    do {
+        const response = await api.get(url, { params: cursor ? { ...params, cursor } : params });
+        items.push(...response.data);
+        cursor = response.headers?.['x-next-cursor'];
+    } while (cursor);
+    return items;
+};
+
 export const getDecks = async () => {
-    const response = await api.get('/decks/');
-    return response.data;
+    return getAllPages('/decks/');
 };
 
 export const createDeck = async (deck) => {
@@ -71,8 +82,7 @@ export const deleteDeck = async (id) => {
 };
 
 export const getCards = async (deckId) => {
-    const response = await api.get(`/decks/${deckId}/cards`);
-    return response.data;
+    return getAllPages(`/decks/${deckId}/cards`);
 };
 
 export const createCard = async (card) => {
@@ -80,6 +90,12 @@ export const createCard = async (card) => {
     return response.data;
 };
 
+// Saves every card in one request and one transaction; returns the new ids in order
+export const createCards = async (cards) => {
+    const response = await api.post('/cards/batch', { cards });
+    return response.data.ids;
+};
+
 export const updateCard = async (id, card) => {
     const response = await api.put(`/cards/${id}`, card);
     return response.data;
@@ -90,11 +106,15 @@ export const deleteCard = async (id) => {
     return response.data;
 };
 
-export const generateCards = async (file, startPage = 1, endPage = -1) => {
+export const generateCards = async (file, startPage = 1, endPage = -1, deckId = null) => {
     const formData = new FormData();
     formData.append('file', file);
     formData.append('start_page', startPage);
     formData.append('end_page', endPage);
+    if (deckId !== null) {
+        // Leaves out near-duplicates of cards already in the deck
+        formData.append('deck_id', deckId);
+    }
     const response = await api.post('/generate', formData, {
         headers: {
             'Content-Type': 'multipart/form-data',
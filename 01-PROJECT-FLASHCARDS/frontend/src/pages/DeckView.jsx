@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, Link } from 'react-router-dom';
-import { getDeck, getCards, createCard, generateCards, deleteCard, refineCards } from '../api';
+import { getDeck, getCards, createCard, createCards, generateCards, deleteCard, refineCards } from '../api';
 import { ArrowLeft, Plus, Sparkles, Trash2, Loader2, PlayCircle } from 'lucide-react';
 
 function DeckView() {
@@ -66,7 +66,7 @@ function DeckView() {
         try {
             const valEndPage = endPage === '' ? -1 : parseInt(endPage);
             const valStartPage = parseInt(startPage);
-            const response = await generateCards(file, valStartPage, valEndPage);
+            const response = await generateCards(file, valStartPage, valEndPage, id);
 
             // Response is { cards: [...], source_text: "..." }
             setGeneratedCards(response.cards);
@@ -98,16 +98,14 @@ function DeckView() {
 
     const handleSaveGenerated = async () => {
         try {
-            for (const card of generatedCards) {
-                await createCard({ ...card, deck_id: id });
-            }
+            await createCards(generatedCards.map(card => ({ ...card, deck_id: id })));
             setIsReviewing(false);
             setGeneratedCards([]);
             setSourceText('');
             loadData();
         } catch (error) {
             console.error("Failed to save cards", error);
-            alert("Failed to save some cards.");
+            alert("Failed to save cards.");
         }
     };
 